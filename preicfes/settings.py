@@ -165,4 +165,45 @@ LOGIN_URL = 'login'
 
 # Formatos de fecha personalizados
 DATE_FORMAT = 'l d \\d\\e F \\d\\e Y'  # ejemplo: "martes 8 de abril de 2025"
-SHORT_DATE_FORMAT = 'd/m/Y'
\ No newline at end of file
+SHORT_DATE_FORMAT = 'd/m/Y'
+
+
+# OMR de simulacros: procesos en paralelo y tiempo máximo (segundos) por hoja
+OMR_MAX_WORKERS = env.int('OMR_MAX_WORKERS', default=4)
+OMR_TIMEOUT_HOJA = env.int('OMR_TIMEOUT_HOJA', default=60)
+# Alineación de las hojas: 'contorno' (borde del papel, escáner) o 'aruco'
+# (marcadores de las esquinas, fotos de celular; vuelve al contorno si no los ve)
+OMR_ALINEACION = env('OMR_ALINEACION', default='contorno')
+# Caché de resultados por contenido de la hoja (simulacros/cache_omr.py):
+# tamaño máximo en MB; 0 la desactiva
+OMR_CACHE_MAX_MB = env.int('OMR_CACHE_MAX_MB', default=100)
+# Recortes de las tiras para la revisión (simulacros/recortes_omr.py): días
+# que se guardan desde que se sube el lote; 0 no los guarda
+OMR_RECORTES_DIAS = env.int('OMR_RECORTES_DIAS', default=60)
+# Escaneos completos de las hojas (omr/hojas/): días que se guardan desde que
+# se califica el lote (simulacros/cola_omr.py, purgar_hojas)
+OMR_HOJAS_DIAS = env.int('OMR_HOJAS_DIAS', default=30)
+# Hojas sin sesión asignada: decidir S1/S2 por el formato (clasificar_sesion).
+# Apagado hasta calibrarlo con escaneos reales (simulacros/escaneos_referencia/)
+OMR_SESION_AUTOMATICA = env.bool('OMR_SESION_AUTOMATICA', default=False)
+# Revisión del lote: mostrar todos los alumnos con sus tiras completas (?todas=0
+# deja solo las preguntas dudosas). Encendido hasta medir MARGEN_DUDA con
+# escaneos reales
+OMR_REVISAR_TODAS = env.bool('OMR_REVISAR_TODAS', default=True)
+
+# Registro del OMR: una línea JSON por hoja procesada y por lote cerrado
+# (ver simulacros/cola_omr.py). DEBUG también muestra los rectángulos detectados.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'consola': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'simulacros.omr': {
+            'handlers': ['consola'],
+            'level': env('OMR_LOG_NIVEL', default='INFO'),
+            'propagate': False,
+        },
+    },
+}
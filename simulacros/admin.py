@@ -1,5 +1,16 @@
-from django.contrib import admin
-from .models import Simulacro, ResultadoSimulacro, _DEFAULT_COMPONENTES_S1, _DEFAULT_COMPONENTES_S2
+import json
+
+from django.contrib import admin, messages
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils.html import format_html
+from .models import (
+    Simulacro, ResultadoSimulacro, LoteOMR, TareaOMR, CacheOMR, _DEFAULT_COMPONENTES_S1, _DEFAULT_COMPONENTES_S2,
+)
+from .estadisticas_items import contribuciones, registrar
+from .recalificacion import (
+    CAMPOS_CLAVE, MAX_RECALIFICAR_EN_LINEA, componentes_afectados, configuracion, recalificar,
+)
 
 
 @admin.register(Simulacro)
@@ -31,6 +42,33 @@ class SimulacroAdmin(admin.ModelAdmin):
         }),
     )
 
+    def save_model(self, request, obj, form, change):
+        # Corregir la clave, los cortes o los componentes recalcula los resultados ya guardados
+        anterior = None
+        if change and set(form.changed_data) & set(CAMPOS_CLAVE):
+            anterior = configuracion(Simulacro.objects.get(pk=obj.pk))
+        super().save_model(request, obj, form, change)
+        if anterior is None:
+            return
+        afectados = componentes_afectados(anterior, configuracion(obj))
+        if not afectados:
+            return
+        total = ResultadoSimulacro.objects.filter(simulacro=obj).count()
+        if total > MAX_RECALIFICAR_EN_LINEA:
+            self.message_user(
+                request,
+                f"El simulacro tiene {total} resultados y no se recalificaron al guardar. Ejecute "
+                f"`python manage.py recalificar_simulacro {obj.pk} --componentes {' '.join(sorted(afectados))}` "
+                "para actualizarlos.",
+                level=messages.WARNING,
+            )
+        else:
+            cambiados = recalificar(obj, afectados)
+            self.message_user(
+                request,
+                f"Se recalificaron {', '.join(sorted(afectados))}: {cambiados} resultados cambiaron.",
+            )
+
     @admin.display(description='Componentes S1')
     def mostrar_componentes_s1(self, obj):
         return ' → '.join(obj.get_componentes_s1())
@@ -63,3 +101,90 @@ class ResultadoSimulacroAdmin(admin.ModelAdmin):
     @admin.display(description='Municipio', ordering='alumno__municipio__nombre')
     def get_municipio(self, obj):
         return obj.alumno.municipio.nombre
+
+    # Las estadísticas por pregunta se mantienen al editar o borrar resultados a mano
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            anteriores = contribuciones(obj.simulacro, [obj.alumno_id]) if change else []
+            super().save_model(request, obj, form, change)
+            registrar(obj.simulacro, anteriores, contribuciones(obj.simulacro, [obj.alumno_id]))
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            anteriores = contribuciones(obj.simulacro, [obj.alumno_id])
+            super().delete_model(request, obj)
+            registrar(obj.simulacro, anteriores, [])
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            anteriores = {}
+            for simulacro in Simulacro.objects.filter(resultados__in=queryset).distinct():
+                ids = queryset.filter(simulacro=simulacro).values_list('alumno_id', flat=True)
+                anteriores[simulacro] = contribuciones(simulacro, list(ids))
+            super().delete_queryset(request, queryset)
+            for simulacro, filas in anteriores.items():
+                registrar(simulacro, filas, [])
+
+
+class TareaOMRInline(admin.TabularInline):
+    model = TareaOMR
+    extra = 0
+    fields = ('orden', 'alumno', 'sesion', 'nombre_original', 'estado', 'intentos', 'duracion', 'error')
+    readonly_fields = fields
+    can_delete = False
+
+
+@admin.register(LoteOMR)
+class LoteOMRAdmin(admin.ModelAdmin):
+    list_display = ('id', 'simulacro', 'grupo', 'fecha_realizacion', 'estado', 'registrador', 'fecha_creacion')
+    list_filter = ('estado', 'simulacro')
+    readonly_fields = ('resumen_metricas',)
+    inlines = [TareaOMRInline]
+
+    @admin.display(description='Métricas OMR')
+    def resumen_metricas(self, obj):
+        if not obj.pk:
+            return '-'
+        return format_html('<pre>{}</pre>', json.dumps(obj.resumen_metricas(), indent=2, ensure_ascii=False))
+
+
+@admin.register(TareaOMR)
+class TareaOMRAdmin(admin.ModelAdmin):
+    list_display = ('id', 'lote', 'alumno', 'sesion', 'estado', 'intentos', 'duracion', 'coordenadas', 'fecha_fin')
+    list_filter = ('estado', 'sesion')
+    readonly_fields = ('metricas', 'hash_contenido', 'recortes')
+    search_fields = ('alumno__primer_apellido', 'alumno__nombres', 'nombre_original', 'hash_contenido')
+    actions = ['reencolar']
+
+    @admin.action(description='Reencolar tareas seleccionadas')
+    def reencolar(self, request, queryset):
+        """
+        Devuelve a la cola las tareas cuyo escaneo sigue guardado; las de
+        escaneos ya purgados (archivo vacío o inexistente) se dejan como están.
+        """
+        # Las páginas de un mismo PDF/TIFF comparten archivo
+        nombres = set(queryset.exclude(archivo='').values_list('archivo', flat=True))
+        disponibles = [nombre for nombre in nombres if default_storage.exists(nombre)]
+        tareas = queryset.filter(archivo__in=disponibles)
+        omitidas = queryset.count() - tareas.count()
+        lote_ids = set(tareas.values_list('lote_id', flat=True))
+        n = tareas.update(estado=TareaOMR.ESTADO_PENDIENTE, intentos=0, error='')
+        LoteOMR.objects.filter(id__in=lote_ids).update(estado=LoteOMR.ESTADO_PROCESANDO)
+        self.message_user(request, f"{n} tareas reencoladas.")
+        if omitidas:
+            self.message_user(
+                request, f"{omitidas} tareas no se reencolaron: su escaneo ya no está guardado.", messages.WARNING)
+
+    @admin.display(description='Tiras')
+    def coordenadas(self, obj):
+        if not obj.metricas:
+            return '-'
+        return 'coord. fijas' if obj.metricas.get('fallback_coordenadas') else 'contornos'
+
+
+@admin.register(CacheOMR)
+class CacheOMRAdmin(admin.ModelAdmin):
+    list_display = ('hash_contenido', 'modo', 'version', 'tamano', 'usos', 'fecha_creacion', 'ultimo_uso')
+    list_filter = ('version', 'modo')
+    search_fields = ('hash_contenido',)
+    readonly_fields = [f.name for f in CacheOMR._meta.fields]
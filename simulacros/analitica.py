@@ -0,0 +1,157 @@
+"""
+analitica.py — Análisis de ítems de un simulacro (teoría clásica de los tests).
+
+Con las respuestas guardadas de todos los alumnos del simulacro se arma, por
+sesión, la matriz de correctas (calculos.matriz_correctas) y sobre ella se
+calcula en bloque, sin recorrer alumno por alumno:
+
+  - dificultad (p): proporción de alumnos que acertaron la pregunta;
+  - discriminación: correlación punto-biserial entre acertar la pregunta y
+    el puntaje en el resto de la sesión (sin la pregunta misma);
+  - distractores: proporción que marcó cada opción y su punto-biserial con
+    el mismo puntaje; un distractor con correlación positiva atrae a los
+    mejores alumnos y suele indicar una clave errada o una pregunta ambigua;
+  - confiabilidad KR-20 de cada sesión y de cada componente.
+
+Solo cuentan los alumnos con la sesión completa. El resultado se guarda en la
+caché de Django con una llave que incluye una firma de los resultados (cuántos
+hay y la última calificación) y de la clave: al calificar, recalificar o
+borrar resultados la llave cambia y el análisis se recalcula.
+"""
+import hashlib
+
+import numpy as np
+from django.core.cache import cache
+from django.db.models import Count, Max
+
+from .calculos import componente_por_pregunta, empaquetar_respuestas, matriz_correctas
+from .calificacion import cortes_sesion
+from .models import ResultadoSimulacro
+
+LETRAS = 'ABCDEFGH'
+
+# Alertas por pregunta
+DISCRIMINACION_MINIMA = 0.2
+DIFICULTAD_MINIMA = 0.1
+DIFICULTAD_MAXIMA = 0.95
+# Un distractor cuenta si lo marca al menos esta proporción de alumnos
+PROPORCION_DISTRACTOR = 0.05
+
+
+def _correlaciones(x, y):
+    """Correlación de Pearson columna a columna entre dos matrices (alumnos × preguntas); 0 si no hay varianza."""
+    xc = x - x.mean(axis=0)
+    yc = y - y.mean(axis=0)
+    denominador = np.sqrt((xc ** 2).sum(axis=0) * (yc ** 2).sum(axis=0))
+    return np.divide((xc * yc).sum(axis=0), denominador, out=np.zeros(x.shape[1]), where=denominador > 0)
+
+
+def kr20(correctas):
+    """Confiabilidad KR-20 de una matriz booleana (alumnos × preguntas); None si no se puede calcular."""
+    n_alumnos, k = correctas.shape
+    if k < 2 or n_alumnos < 2:
+        return None
+    p = correctas.mean(axis=0)
+    varianza = correctas.sum(axis=1).var()
+    if varianza == 0:
+        return None
+    return float(k / (k - 1) * (1 - (p * (1 - p)).sum() / varianza))
+
+
+def analizar_sesion(respuestas, clave, componentes):
+    """
+    Análisis de una sesión: `respuestas` son las secuencias de los alumnos,
+    `componentes` el componente de cada pregunta (componente_por_pregunta).
+    """
+    correctas, validas = matriz_correctas(respuestas, clave)
+    correctas = correctas[validas]
+    marcas = empaquetar_respuestas(respuestas, len(clave))[0][validas]
+    n_alumnos = len(correctas)
+
+    x = correctas.astype(np.float64)
+    resto = x.sum(axis=1, keepdims=True) - x
+    p = x.mean(axis=0) if n_alumnos else np.zeros(len(clave))
+    discriminacion = _correlaciones(x, resto) if n_alumnos else np.zeros(len(clave))
+
+    codigos = np.frombuffer(LETRAS.encode('ascii'), np.uint8)
+    elegidas = marcas[None, :, :] == codigos[:, None, None]  # opción × alumno × pregunta
+    proporciones = elegidas.mean(axis=1) if n_alumnos else np.zeros((len(LETRAS), len(clave)))
+    blancos = (marcas == ord('Z')).mean(axis=0) if n_alumnos else np.zeros(len(clave))
+    correlaciones = np.array([_correlaciones(e.astype(np.float64), resto) for e in elegidas]) \
+        if n_alumnos else np.zeros((len(LETRAS), len(clave)))
+
+    items = []
+    for j, letra in enumerate(clave):
+        opciones = {
+            opcion: {'proporcion': float(proporciones[i, j]), 'discriminacion': float(correlaciones[i, j])}
+            for i, opcion in enumerate(LETRAS) if proporciones[i, j] or opcion == letra
+        }
+        alertas = []
+        if n_alumnos:
+            if discriminacion[j] < 0:
+                alertas.append('discriminación negativa: revisar la clave')
+            elif discriminacion[j] < DISCRIMINACION_MINIMA:
+                alertas.append('discrimina poco')
+            if p[j] < DIFICULTAD_MINIMA:
+                alertas.append('muy difícil')
+            elif p[j] > DIFICULTAD_MAXIMA:
+                alertas.append('muy fácil')
+            atrayentes = [o for o, d in opciones.items()
+                          if o != letra and d['proporcion'] >= PROPORCION_DISTRACTOR and d['discriminacion'] > 0]
+            if atrayentes:
+                alertas.append(f"distractor {', '.join(atrayentes)} atrae a los mejores")
+        items.append({
+            'item': j + 1,
+            'componente': componentes[j] if j < len(componentes) else '',
+            'clave': letra,
+            'dificultad': float(p[j]),
+            'discriminacion': float(discriminacion[j]),
+            'blancos': float(blancos[j]),
+            'opciones': opciones,
+            'alertas': alertas,
+        })
+
+    por_componente = {}
+    for comp in dict.fromkeys(componentes):
+        columnas = [j for j, c in enumerate(componentes) if c == comp]
+        por_componente[comp] = {'items': len(columnas), 'kr20': kr20(correctas[:, columnas])}
+    return {'alumnos': n_alumnos, 'kr20': kr20(correctas), 'componentes': por_componente, 'items': items}
+
+
+def analizar_respuestas(simulacro, respuestas_s1, respuestas_s2):
+    """Análisis de las dos sesiones a partir de listas de secuencias: {'S1': ..., 'S2': ...}."""
+    analisis = {}
+    for sesion, respuestas, clave, cortes, comps in (
+        ('S1', respuestas_s1, simulacro.soluciones_s1, simulacro.puntos_corte_s1, simulacro.get_componentes_s1()),
+        ('S2', respuestas_s2, simulacro.soluciones_s2, simulacro.puntos_corte_s2, simulacro.get_componentes_s2()),
+    ):
+        componentes = componente_por_pregunta(len(clave), cortes_sesion(cortes), list(comps))
+        analisis[sesion] = analizar_sesion(respuestas, clave, componentes)
+    return analisis
+
+
+def _llave(simulacro):
+    """Llave de caché: cambia cuando cambian los resultados o la configuración del simulacro."""
+    estado = ResultadoSimulacro.objects.filter(simulacro=simulacro).aggregate(
+        n=Count('pk'), ultimo=Max('fecha_calificacion'), mayor=Max('pk'))
+    firma = repr((
+        estado['n'], estado['ultimo'], estado['mayor'],
+        simulacro.soluciones_s1, simulacro.soluciones_s2, simulacro.puntos_corte_s1, simulacro.puntos_corte_s2,
+        simulacro.componentes_s1, simulacro.componentes_s2,
+    ))
+    return f'simulacros:analitica:{simulacro.pk}:{hashlib.sha1(firma.encode()).hexdigest()}'
+
+
+def analizar(simulacro):
+    """Análisis de ítems de todos los resultados del simulacro, desde la caché si no cambió nada."""
+    llave = _llave(simulacro)
+    analisis = cache.get(llave)
+    if analisis is None:
+        filas = ResultadoSimulacro.objects.filter(simulacro=simulacro).values_list('respuestas_s1', 'respuestas_s2')
+        respuestas_s1, respuestas_s2 = [], []
+        for s1, s2 in filas:
+            respuestas_s1.append(s1 or '')
+            respuestas_s2.append(s2 or '')
+        analisis = analizar_respuestas(simulacro, respuestas_s1, respuestas_s2)
+        cache.set(llave, analisis, None)
+    return analisis
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class SimulacrosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'simulacros'
+
+    def ready(self):
+        from . import signals  # registra los receptores
@@ -0,0 +1,128 @@
+"""
+cache_omr.py — Caché de resultados OMR por contenido de la hoja.
+
+Es común volver a subir un grupo completo después de corregir un solo
+archivo. La cola calcula el SHA-256 de cada hoja (los bytes subidos o la
+página extraída del PDF/TIFF) y, si ya hay un resultado para ese contenido,
+leído en el mismo modo y con la misma versión del OMR (version_cache), lo
+toma de CacheOMR en lugar de volver a procesarla.
+
+La caché se limita a OMR_CACHE_MAX_MB: al pasarse, se borran las entradas
+usadas hace más tiempo. El comando `purgar_cache_omr` la vacía o la recorta
+a mano. Con OMR_CACHE_MAX_MB = 0 no se usa.
+"""
+import hashlib
+import json
+
+import numpy as np
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import CacheOMR
+from .procesar_simulacro import ALINEACION_OMR, VERSION_OMR
+
+# Al recortar se deja la caché en esta fracción del máximo, para no tener
+# que recortar otra vez en el siguiente bloque
+FRACCION_TRAS_RECORTE = 0.9
+
+
+def hash_contenido(fuente):
+    """SHA-256 (hex) de una hoja: bytes del archivo o imagen ya decodificada."""
+    h = hashlib.sha256()
+    if hasattr(fuente, 'shape'):
+        # Página de un TIFF/PDF ya decodificada: las dimensiones también cuentan
+        h.update(repr(fuente.shape).encode())
+        h.update(np.ascontiguousarray(fuente))
+    else:
+        h.update(fuente)
+    return h.hexdigest()
+
+
+def version_cache(alineacion=None):
+    """Todo lo que cambia la lectura de una misma hoja, salvo su modo."""
+    return f"{VERSION_OMR}/{alineacion or ALINEACION_OMR}"
+
+
+def habilitada():
+    return settings.OMR_CACHE_MAX_MB > 0
+
+
+def buscar(claves, version):
+    """
+    Resultados guardados para [(hash, modo), ...] con `version`. Retorna
+    {(hash, modo): {'tiras': [...], 'metricas': {...}}} con las que hay y
+    registra su uso (las más usadas recientemente son las últimas en salir).
+    """
+    claves = set(claves)
+    if not claves:
+        return {}
+    entradas = [
+        entrada
+        for entrada in CacheOMR.objects.filter(
+            hash_contenido__in={h for h, _modo in claves}, version=version,
+        )
+        if (entrada.hash_contenido, entrada.modo) in claves
+    ]
+    if entradas:
+        CacheOMR.objects.filter(pk__in=[e.pk for e in entradas]).update(
+            usos=F('usos') + 1, ultimo_uso=timezone.now(),
+        )
+    return {(e.hash_contenido, e.modo): {'tiras': e.tiras, 'metricas': e.metricas} for e in entradas}
+
+
+def guardar(entradas, version):
+    """
+    Guarda [(hash, modo, tiras, metricas), ...] y recorta la caché si pasa
+    del máximo. Una entrada que ya existe (otro worker la guardó) se ignora.
+    """
+    objetos = []
+    for hash_hoja, modo, tiras, metricas in entradas:
+        tamano = len(json.dumps(tiras)) + len(json.dumps(metricas, default=str))
+        objetos.append(CacheOMR(hash_contenido=hash_hoja, modo=modo, version=version,
+                                tiras=tiras, metricas=metricas, tamano=tamano))
+    if objetos:
+        CacheOMR.objects.bulk_create(objetos, ignore_conflicts=True)
+        recortar(settings.OMR_CACHE_MAX_MB * 2**20)
+
+
+def recortar(max_bytes):
+    """
+    Si la caché ocupa más de `max_bytes`, borra las entradas usadas hace
+    más tiempo hasta dejarla en FRACCION_TRAS_RECORTE del máximo.
+    Retorna (entradas borradas, bytes liberados).
+    """
+    total = CacheOMR.objects.aggregate(total=Sum('tamano'))['total'] or 0
+    if total <= max_bytes:
+        return 0, 0
+    sobra = total - int(max_bytes * FRACCION_TRAS_RECORTE)
+    borrar, liberados = [], 0
+    for pk, tamano in CacheOMR.objects.order_by('ultimo_uso', 'pk').values_list('pk', 'tamano').iterator():
+        if liberados >= sobra:
+            break
+        borrar.append(pk)
+        liberados += tamano
+    for i in range(0, len(borrar), 500):
+        CacheOMR.objects.filter(pk__in=borrar[i:i + 500]).delete()
+    return len(borrar), liberados
+
+
+def purgar(todo=False, max_bytes=None):
+    """
+    Borra toda la caché (`todo`) o las entradas de versiones del OMR que ya
+    no se usan y luego la recorta a `max_bytes` (por defecto OMR_CACHE_MAX_MB).
+    Retorna (entradas borradas, bytes liberados).
+    """
+    if todo:
+        consulta = CacheOMR.objects.all()
+    else:
+        vigente = version_cache(settings.OMR_ALINEACION)
+        consulta = CacheOMR.objects.exclude(version=vigente)
+    liberados = consulta.aggregate(total=Sum('tamano'))['total'] or 0
+    borradas, _por_modelo = consulta.delete()
+    if not todo:
+        max_bytes = settings.OMR_CACHE_MAX_MB * 2**20 if max_bytes is None else max_bytes
+        recortadas, recortados = recortar(max_bytes)
+        borradas += recortadas
+        liberados += recortados
+    return borradas, liberados
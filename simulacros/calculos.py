@@ -1,5 +1,11 @@
 import math
 
+import numpy as np
+
+# Peso de cada componente en el puntaje global (los demás pesan 1)
+PESOS_COMPONENTES = {'naturales': 3, 'sociales': 3, 'lectura': 3, 'matematicas': 3, 'ingles': 1}
+
+
 def calificar(respuesta_estudiante, solucion, cortes, componentes):
     """
     Califica las respuestas del estudiante y devuelve un diccionario con las buenas y totales por componente.
@@ -37,6 +43,103 @@ def calificar(respuesta_estudiante, solucion, cortes, componentes):
     return resultados
 
 
+def empaquetar_respuestas(respuestas, n_preguntas):
+    """
+    Matriz uint8 (alumnos × preguntas) con el código ASCII de cada respuesta y
+    el vector booleano de los alumnos cuya secuencia tiene `n_preguntas`
+    (las filas de los demás quedan en 0).
+    """
+    validas = np.fromiter((len(r) == n_preguntas for r in respuestas), bool, len(respuestas))
+    matriz = np.zeros((len(respuestas), n_preguntas), np.uint8)
+    if n_preguntas and validas.any():
+        texto = ''.join(r for r, ok in zip(respuestas, validas) if ok).encode('ascii', 'replace')
+        matriz[validas] = np.frombuffer(texto, np.uint8).reshape(-1, n_preguntas)
+    return matriz, validas
+
+
+def matriz_correctas(respuestas, solucion):
+    """
+    Matriz booleana (alumnos × preguntas) de respuestas correctas de toda una
+    cohorte contra `solucion`, en una sola comparación. Retorna (matriz,
+    validas): un alumno con una secuencia de otra longitud no tiene ninguna
+    correcta, como en `calificar`.
+    """
+    matriz, validas = empaquetar_respuestas(respuestas, len(solucion))
+    clave = np.frombuffer(solucion.encode('ascii', 'replace'), np.uint8)
+    return (matriz == clave) & validas[:, None], validas
+
+
+def _inicios_tramos(n_preguntas, cortes, n_componentes):
+    """
+    Inicio de cada tramo de preguntas, con la misma regla de `calificar`: los
+    cortes ordenados se aplican mientras sean crecientes y caigan dentro de
+    la sesión; lo que queda después del último aplicado va al último componente.
+    """
+    inicios = [0]
+    for corte in sorted(cortes):
+        if len(inicios) == n_componentes or not inicios[-1] < corte <= n_preguntas:
+            break
+        inicios.append(corte)
+    return inicios
+
+
+def componente_por_pregunta(n_preguntas, cortes, componentes):
+    """
+    Componente al que `calificar` le suma cada pregunta de la sesión, en orden
+    (lista vacía si la sesión no tiene componentes).
+    """
+    if not componentes:
+        return []
+    inicios = _inicios_tramos(n_preguntas, cortes, len(componentes))
+    destinos = componentes[:len(inicios) - 1] + [componentes[-1]]
+    fines = inicios[1:] + [n_preguntas]
+    return [comp for comp, inicio, fin in zip(destinos, inicios, fines) for _ in range(fin - inicio)]
+
+
+def calificar_cohorte(respuestas, solucion, cortes, componentes):
+    """
+    Versión vectorizada de `calificar` para una lista de secuencias: retorna
+    {componente: {'buenas': array, 'totales': array}} con un valor por alumno.
+    """
+    correctas, validas = matriz_correctas(respuestas, solucion)
+    n_alumnos, n_preguntas = correctas.shape
+    resultados = {comp: {'buenas': np.zeros(n_alumnos, np.int64), 'totales': np.zeros(n_alumnos, np.int64)}
+                  for comp in componentes}
+    if not validas.any():
+        return resultados
+    if len(cortes) != len(componentes) - 1:
+        raise ValueError("La cantidad de cortes no coincide con la cantidad de componentes.")
+
+    inicios = _inicios_tramos(n_preguntas, cortes, len(componentes))
+    # Una columna extra en cero permite un último tramo vacío (corte == n_preguntas)
+    buenas = np.add.reduceat(
+        np.pad(correctas.view(np.uint8), ((0, 0), (0, 1))), inicios, axis=1, dtype=np.int64,
+    )
+    totales = np.diff(inicios + [n_preguntas])
+    destinos = componentes[:len(inicios) - 1] + [componentes[-1]]
+    for tramo, comp in enumerate(destinos):
+        resultados[comp] = {'buenas': buenas[:, tramo], 'totales': totales[tramo] * validas.astype(np.int64)}
+    return resultados
+
+
+def calcular_puntaje_icfes_cohorte(puntajes_componentes):
+    """
+    Versión vectorizada de `calcular_puntaje_icfes`: recibe arrays de buenas
+    y totales por componente y retorna {componente: array, 'global': array}.
+    """
+    resultados = {}
+    suma_ponderada = 0
+    for comp, datos in puntajes_componentes.items():
+        buenas = np.asarray(datos['buenas'], np.float64)
+        totales = np.asarray(datos['totales'], np.float64)
+        razon = np.divide(buenas, totales, out=np.zeros_like(buenas), where=totales > 0)
+        # np.rint redondea al par más cercano, igual que round()
+        resultados[comp] = np.rint(razon * 100).astype(np.int64)
+        suma_ponderada = suma_ponderada + resultados[comp] * PESOS_COMPONENTES.get(comp, 1)
+    resultados['global'] = np.rint(suma_ponderada / sum(PESOS_COMPONENTES.values()) * 5).astype(np.int64)
+    return resultados
+
+
 def calcular_puntaje_icfes(puntajes_componentes):
     """
     Genera la ponderación y calificación a base 100 de los 5 componentes.
@@ -50,13 +153,7 @@ def calcular_puntaje_icfes(puntajes_componentes):
         'matematicas': {'buenas': X, 'totales': Y}
     }
     """
-    pesos = {
-        'naturales': 3,
-        'sociales': 3,
-        'lectura': 3,
-        'matematicas': 3,
-        'ingles': 1
-    }
+    pesos = PESOS_COMPONENTES
     
     resultados = {}
     suma_ponderada = 0
@@ -142,7 +239,7 @@ def modificar_puntajes(puntajes_reales, simulacro=None):
 
     # Escalar componentes manteniendo límite 100 y añadiendo jitter
     modificados = {}
-    pesos = {'naturales': 3, 'sociales': 3, 'lectura': 3, 'matematicas': 3, 'ingles': 1}
+    pesos = PESOS_COMPONENTES
     total_pesos = sum(pesos.values())
     suma_ponderada = 0
     for comp, valor in puntajes_reales.items():
@@ -0,0 +1,173 @@
+"""
+calificacion.py — Calificación de un lote de alumnos de un simulacro.
+
+calificar_lote recibe las respuestas de todos los alumnos y los califica
+juntos con la matriz de correctas de la cohorte (calculos.calificar_cohorte
+→ calcular_puntaje_icfes_cohorte; modificar_puntajes sigue siendo por
+alumno). Guarda todos los ResultadoSimulacro en un solo bulk_create dentro
+de una transacción: un alumno con resultado previo en el simulacro se
+actualiza. Un error de un alumno no frena a los demás. En la misma
+transacción se actualizan las estadísticas por pregunta (estadisticas_items).
+"""
+from django.db import transaction
+
+from . import estadisticas_items
+from .calculos import calcular_puntaje_icfes_cohorte, calificar_cohorte, modificar_puntajes
+from .models import ResultadoSimulacro, TareaOMR
+
+# Campos que se reemplazan si el alumno ya tenía resultado en el simulacro
+CAMPOS_RESULTADO = [
+    'respuestas_s1', 'respuestas_s2',
+    'puntaje_global', 'puntaje_matematicas', 'puntaje_lectura',
+    'puntaje_sociales', 'puntaje_naturales', 'puntaje_ingles',
+    'puntaje_global_modificado', 'puntaje_matematicas_modificado', 'puntaje_lectura_modificado',
+    'puntaje_sociales_modificado', 'puntaje_naturales_modificado', 'puntaje_ingles_modificado',
+    'fecha_realizacion', 'registrador', 'fecha_calificacion',
+]
+
+
+def cortes_sesion(valor):
+    return valor if isinstance(valor, list) else valor.get('cortes', [])
+
+
+def puntajes_cohorte(simulacro, respuestas_s1, respuestas_s2):
+    """
+    Puntajes reales de muchos alumnos a la vez (listas paralelas de
+    secuencias S1 y S2): cada sesión se califica con una sola matriz de
+    correctas (calculos.calificar_cohorte). Retorna una lista, en el mismo
+    orden, de dicts como los de calcular_puntaje_icfes.
+    """
+    componentes_s1, componentes_s2 = simulacro.get_componentes_s1(), simulacro.get_componentes_s2()
+    comp_s1 = calificar_cohorte(respuestas_s1, simulacro.soluciones_s1, cortes_sesion(simulacro.puntos_corte_s1),
+                                componentes_s1)
+    comp_s2 = calificar_cohorte(respuestas_s2, simulacro.soluciones_s2, cortes_sesion(simulacro.puntos_corte_s2),
+                                componentes_s2)
+    consolidados = {}
+    for comp in set(componentes_s1 + componentes_s2):
+        parciales = [parcial[comp] for parcial in (comp_s1, comp_s2) if comp in parcial]
+        consolidados[comp] = {clave: sum(p[clave] for p in parciales) for clave in ('buenas', 'totales')}
+
+    columnas = {comp: valores.tolist() for comp, valores in calcular_puntaje_icfes_cohorte(consolidados).items()}
+    return [dict(zip(columnas, fila)) for fila in zip(*columnas.values())]
+
+
+def puntajes_alumno(simulacro, resp_s1, resp_s2):
+    """Puntajes reales y modificados de un alumno: ({'global': ..., 'matematicas': ...}, {...})."""
+    puntajes = puntajes_cohorte(simulacro, [resp_s1], [resp_s2])[0]
+    # SE PASA EL SIMULACRO COMPLETO PARA SOPORTAR LOS PARÁMETROS CONFIGURABLES DESDE EL ADMIN
+    return puntajes, modificar_puntajes(puntajes, simulacro)
+
+
+def calificar_lote(simulacro, respuestas, fecha_realizacion, registrador=None):
+    """
+    Califica y guarda de una vez a todos los alumnos de `respuestas`
+    ({alumno_id: (respuestas_s1, respuestas_s2)}).
+    Retorna (resultados guardados, {alumno_id: mensaje de error}).
+    """
+    alumno_ids = list(respuestas)
+    try:
+        cohorte = puntajes_cohorte(simulacro, [respuestas[a][0] for a in alumno_ids],
+                                   [respuestas[a][1] for a in alumno_ids])
+    except Exception as e:
+        # Un error de configuración del simulacro (cortes/componentes) afecta a todos
+        return [], {alumno_id: str(e) for alumno_id in alumno_ids}
+
+    resultados, errores = [], {}
+    for alumno_id, puntajes in zip(alumno_ids, cohorte):
+        resp_s1, resp_s2 = respuestas[alumno_id]
+        try:
+            # SE PASA EL SIMULACRO COMPLETO PARA SOPORTAR LOS PARÁMETROS CONFIGURABLES DESDE EL ADMIN
+            modificados = modificar_puntajes(puntajes, simulacro)
+        except Exception as e:
+            errores[alumno_id] = str(e)
+            continue
+        resultados.append(ResultadoSimulacro(
+            alumno_id=alumno_id,
+            simulacro=simulacro,
+            respuestas_s1=resp_s1,
+            respuestas_s2=resp_s2,
+            puntaje_global=puntajes['global'],
+            puntaje_matematicas=puntajes.get('matematicas', 0),
+            puntaje_lectura=puntajes.get('lectura', 0),
+            puntaje_sociales=puntajes.get('sociales', 0),
+            puntaje_naturales=puntajes.get('naturales', 0),
+            puntaje_ingles=puntajes.get('ingles', 0),
+            puntaje_global_modificado=modificados['global'],
+            puntaje_matematicas_modificado=modificados.get('matematicas', 0),
+            puntaje_lectura_modificado=modificados.get('lectura', 0),
+            puntaje_sociales_modificado=modificados.get('sociales', 0),
+            puntaje_naturales_modificado=modificados.get('naturales', 0),
+            puntaje_ingles_modificado=modificados.get('ingles', 0),
+            fecha_realizacion=fecha_realizacion,
+            registrador=registrador,
+        ))
+
+    calificados = [r.alumno_id for r in resultados]
+    with transaction.atomic():
+        anteriores = estadisticas_items.contribuciones(simulacro, calificados)
+        ResultadoSimulacro.objects.bulk_create(
+            resultados, batch_size=500,
+            update_conflicts=True, unique_fields=['alumno', 'simulacro'], update_fields=CAMPOS_RESULTADO,
+        )
+        estadisticas_items.registrar(simulacro, anteriores, estadisticas_items.contribuciones(simulacro, calificados))
+    return resultados, errores
+
+
+def secuencias_leidas(lote):
+    """
+    Respuestas tal como las leyó el OMR, para calificar un lote sin pasar
+    por la revisión. Retorna ({alumno_id: (respuestas_s1, respuestas_s2)},
+    {alumno_id: motivo}): un alumno solo se califica si sus dos hojas se
+    leyeron y todas sus tiras tienen la longitud esperada.
+    """
+    hojas = {}
+    for tarea in lote.tareas.filter(alumno__isnull=False).only('alumno_id', 'sesion', 'estado', 'error', 'tiras'):
+        hojas.setdefault(tarea.alumno_id, {})[tarea.sesion] = tarea
+    return _secuencias(hojas)
+
+
+def secuencias_de_alumnos(simulacro, alumno_ids):
+    """
+    Como secuencias_leidas, pero cada hoja de los alumnos puede venir de
+    cualquier lote del simulacro (la ingesta continua recibe la S1 y la S2
+    por separado). De cada sesión se toma la última hoja leída sin error,
+    o la última que falló si ninguna se leyó.
+    """
+    hojas = {}
+    tareas = (
+        TareaOMR.objects.filter(lote__simulacro=simulacro, alumno_id__in=alumno_ids,
+                                estado__in=TareaOMR.ESTADOS_FINALES)
+        .exclude(sesion='')
+        .only('alumno_id', 'sesion', 'estado', 'error', 'tiras')
+        .order_by('pk')
+    )
+    for tarea in tareas:
+        por_sesion = hojas.setdefault(tarea.alumno_id, {})
+        anterior = por_sesion.get(tarea.sesion)
+        if anterior is None or tarea.estado == TareaOMR.ESTADO_COMPLETADA or anterior.estado != TareaOMR.ESTADO_COMPLETADA:
+            por_sesion[tarea.sesion] = tarea
+    return _secuencias(hojas)
+
+
+def _secuencias(hojas):
+    """({alumno_id: (s1, s2)}, {alumno_id: motivo}) a partir de {alumno_id: {sesion: tarea}}."""
+    respuestas, pendientes = {}, {}
+    for alumno_id, por_sesion in hojas.items():
+        motivos = []
+        for sesion in ('S1', 'S2'):
+            tarea = por_sesion.get(sesion)
+            if tarea is None:
+                motivos.append(f"{sesion}: falta la hoja")
+            elif tarea.estado != TareaOMR.ESTADO_COMPLETADA:
+                motivos.append(f"{sesion}: {tarea.error or 'sin procesar'}")
+            else:
+                cortas = [t['etiqueta'] for t in tarea.tiras if not t['ok']]
+                if cortas:
+                    motivos.append(f"{sesion}: tiras con longitud distinta a la esperada ({', '.join(cortas)})")
+        if motivos:
+            pendientes[alumno_id] = ' | '.join(motivos)
+        else:
+            respuestas[alumno_id] = tuple(
+                ''.join(t['secuencia'] for t in por_sesion[sesion].tiras) for sesion in ('S1', 'S2')
+            )
+    return respuestas, pendientes
@@ -0,0 +1,249 @@
+"""
+carpeta_escaneos.py — Ingesta continua desde la carpeta de los escáneres de red.
+
+Las multifuncionales dejan cada fajo escaneado (imagen, PDF o TIFF) en una
+carpeta compartida. El comando `vigilar_escaneos` la observa y encola cada
+archivo en la cola OMR (cola_omr.py) apenas termina de escribirse, en lugar
+de esperar a que alguien lo suba por la web. Las hojas se identifican por su
+código QR, así que el orden de los archivos no importa, y cada alumno se
+califica en cuanto se han leído sus dos sesiones, aunque lleguen en archivos
+distintos (calificacion.secuencias_de_alumnos).
+
+El estado de cada archivo es la carpeta donde está:
+
+    <carpeta>/               recién llegado; se toma cuando lleva `espera`
+                             segundos sin modificarse (el escáner terminó de escribirlo)
+    <carpeta>/en_proceso/    encolado, como <lote>__<nombre>
+    <carpeta>/procesados/    se leyeron todas sus hojas
+    <carpeta>/fallidos/      alguna hoja no se pudo leer; el motivo queda en
+                             <lote>__<nombre>.error.txt
+
+Como no hay estado en memoria que no esté también en la carpeta, el comando
+retoma donde iba al reiniciarse: lo que está en en_proceso/ se sigue
+esperando (o se vuelve a encolar si el lote no llegó a crearse).
+
+En Linux se usa inotify (vía ctypes, sin dependencias) para despertar en
+cuanto llega un archivo; en otros sistemas se revisa la carpeta cada pocos
+segundos.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import time
+
+from django.core.files import File
+from django.utils import timezone
+
+from .calificacion import calificar_lote, secuencias_de_alumnos
+from .cola_omr import encolar_lote
+from .escaneos import es_escaneo, hojas_de_archivos
+from .models import LoteOMR, TareaOMR
+
+EN_PROCESO = 'en_proceso'
+PROCESADOS = 'procesados'
+FALLIDOS = 'fallidos'
+
+# Segundos sin cambios para dar un archivo por terminado de escribir
+ESPERA_DEFECTO = 5.0
+
+# Archivos encolados a la vez: el resto espera en la carpeta
+MAX_PENDIENTES_DEFECTO = 50
+
+_SEPARADOR_LOTE = '__'
+
+# Eventos de inotify(7): archivo cerrado tras escribirlo o movido a la carpeta
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+
+
+class Inotify:
+    """Avisos del kernel cuando un archivo termina de escribirse o se mueve a `ruta` (solo Linux)."""
+
+    def __init__(self, ruta):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 falló")
+        if libc.inotify_add_watch(self.fd, os.fsencode(ruta), _IN_CLOSE_WRITE | _IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"No se puede vigilar {ruta}")
+
+    def esperar(self, segundos):
+        """Bloquea hasta que llegue un evento o pasen `segundos`. Retorna True si hubo eventos."""
+        listos, _, _ = select.select([self.fd], [], [], segundos)
+        if not listos:
+            return False
+        # Solo interesa que algo cambió: la carpeta se vuelve a listar completa
+        try:
+            while os.read(self.fd, 64 * 1024):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def cerrar(self):
+        os.close(self.fd)
+
+
+def crear_observador(ruta):
+    """Un Inotify sobre `ruta`, o None si el sistema no lo soporta (se revisa por sondeo)."""
+    try:
+        return Inotify(ruta)
+    except (OSError, AttributeError, TypeError):
+        return None
+
+
+def _destino_libre(carpeta, nombre):
+    """Ruta en `carpeta` para `nombre` sin pisar un archivo existente (nombre-1.ext, nombre-2.ext...)."""
+    base, extension = os.path.splitext(nombre)
+    ruta, n = os.path.join(carpeta, nombre), 0
+    while os.path.exists(ruta):
+        n += 1
+        ruta = os.path.join(carpeta, f"{base}-{n}{extension}")
+    return ruta
+
+
+def _lote_de(nombre):
+    """(id del lote, nombre original) de un archivo de en_proceso/; (None, nombre) si aún no se encoló."""
+    prefijo, separador, resto = nombre.partition(_SEPARADOR_LOTE)
+    if separador and prefijo.isdigit():
+        return int(prefijo), resto
+    return None, nombre
+
+
+class CarpetaEscaneos:
+    """
+    Una carpeta vigilada para un simulacro. `revisar()` hace una pasada
+    completa: encola lo nuevo y cierra lo que la cola ya terminó; el comando
+    la llama en bucle mientras procesa la cola.
+    """
+
+    def __init__(self, ruta, simulacro, espera=ESPERA_DEFECTO, max_pendientes=MAX_PENDIENTES_DEFECTO,
+                 fecha_realizacion=None, registrador=None):
+        self.ruta = os.path.abspath(ruta)
+        self.simulacro = simulacro
+        self.espera = espera
+        self.max_pendientes = max_pendientes
+        self.fecha_realizacion = fecha_realizacion
+        self.registrador = registrador
+        for sub in (EN_PROCESO, PROCESADOS, FALLIDOS):
+            os.makedirs(os.path.join(self.ruta, sub), exist_ok=True)
+
+    def _en_proceso(self):
+        """{lote_id o None: [nombre en en_proceso/, ...]}."""
+        por_lote = {}
+        for nombre in sorted(os.listdir(os.path.join(self.ruta, EN_PROCESO))):
+            if es_escaneo(nombre):
+                por_lote.setdefault(_lote_de(nombre)[0], []).append(nombre)
+        existentes = set(LoteOMR.objects.filter(pk__in=[pk for pk in por_lote if pk]).values_list('pk', flat=True))
+        for pk in [pk for pk in por_lote if pk and pk not in existentes]:
+            # El lote se borró: sus archivos se vuelven a encolar
+            por_lote.setdefault(None, []).extend(por_lote.pop(pk))
+        return por_lote
+
+    def listos(self):
+        """Archivos de la carpeta que ya terminaron de escribirse, del más antiguo al más nuevo."""
+        ahora = time.time()
+        listos = []
+        with os.scandir(self.ruta) as entradas:
+            for entrada in entradas:
+                if not entrada.is_file() or entrada.name.startswith('.') or not es_escaneo(entrada.name):
+                    continue
+                estado = entrada.stat()
+                if estado.st_size > 0 and ahora - estado.st_mtime >= self.espera:
+                    listos.append((estado.st_mtime, entrada.name))
+        return [nombre for _mtime, nombre in sorted(listos)]
+
+    def revisar(self):
+        """
+        Una pasada: encola los archivos listos (hasta completar max_pendientes)
+        y mueve a procesados/ o fallidos/ los de lotes que terminaron.
+        Retorna {'encolados': [...], 'procesados': [...], 'fallidos': [...], 'calificados': n}.
+        """
+        por_lote = self._en_proceso()
+        sin_lote = por_lote.pop(None, [])
+        cupo = self.max_pendientes - sum(len(nombres) for nombres in por_lote.values()) - len(sin_lote)
+        carpeta_proceso = os.path.join(self.ruta, EN_PROCESO)
+        for nombre in self.listos()[:max(cupo, 0)]:
+            destino = _destino_libre(carpeta_proceso, nombre)
+            os.replace(os.path.join(self.ruta, nombre), destino)
+            sin_lote.append(os.path.basename(destino))
+
+        informe = {'encolados': [], 'procesados': [], 'fallidos': [], 'calificados': 0}
+        if sin_lote:
+            informe['encolados'] = self._encolar(sin_lote)
+        for lote in LoteOMR.objects.filter(pk__in=por_lote).exclude(estado=LoteOMR.ESTADO_PROCESANDO):
+            self._cerrar(lote, por_lote[lote.pk], informe)
+        return informe
+
+    def pendientes(self):
+        """True si queda algo por encolar o esperando a la cola."""
+        return any(es_escaneo(n) for n in os.listdir(os.path.join(self.ruta, EN_PROCESO))) or bool(self.listos())
+
+    def _encolar(self, nombres):
+        """Encola los archivos de en_proceso/ `nombres` en un lote nuevo y les antepone su id."""
+        carpeta = os.path.join(self.ruta, EN_PROCESO)
+        # Un nombre con prefijo de un lote borrado se encola con su nombre original
+        originales = [_lote_de(nombre)[1] for nombre in nombres]
+        archivos = [File(open(os.path.join(carpeta, n), 'rb'), name=o) for n, o in zip(nombres, originales)]
+        try:
+            hojas, malos = [], []
+            for nombre, archivo in zip(nombres, archivos):
+                try:
+                    hojas.extend(hojas_de_archivos([archivo]))
+                except ValueError as e:
+                    malos.append((nombre, str(e)))
+            lote = None
+            if hojas:
+                lote = encolar_lote(
+                    self.simulacro, hojas, [(None, '')] * len(hojas),
+                    self.fecha_realizacion or timezone.localdate(), registrador=self.registrador,
+                )
+        finally:
+            for archivo in archivos:
+                archivo.close()
+
+        for nombre, error in malos:
+            self._mover(nombre, FALLIDOS, [error])
+        encolados = []
+        for nombre, original in zip(nombres, originales):
+            if lote is not None and nombre not in dict(malos):
+                os.replace(os.path.join(carpeta, nombre),
+                           _destino_libre(carpeta, f"{lote.pk}{_SEPARADOR_LOTE}{original}"))
+                encolados.append(original)
+        return encolados
+
+    def _cerrar(self, lote, nombres, informe):
+        """Califica a los alumnos del lote terminado y saca sus archivos de en_proceso/."""
+        tareas = list(lote.tareas.only('nombre_original', 'pagina', 'alumno_id', 'estado', 'error', 'tiras'))
+        alumnos = {t.alumno_id for t in tareas if t.alumno_id and t.estado == TareaOMR.ESTADO_COMPLETADA}
+        respuestas, _pendientes = secuencias_de_alumnos(self.simulacro, alumnos)
+        calificados, errores = calificar_lote(self.simulacro, respuestas, lote.fecha_realizacion, self.registrador)
+        informe['calificados'] += len(calificados)
+
+        # Un alumno al que le falta la otra sesión se califica cuando llegue su hoja;
+        # el lote solo necesita revisión web si alguna de sus propias hojas quedó mal.
+        bien_leido = all(t.estado == TareaOMR.ESTADO_COMPLETADA and all(tira['ok'] for tira in t.tiras)
+                         for t in tareas)
+        if bien_leido and not errores:
+            lote.estado = LoteOMR.ESTADO_CALIFICADO
+            lote.fecha_calificacion = timezone.now()
+            lote.save(update_fields=['estado', 'fecha_calificacion'])
+
+        for nombre in nombres:
+            original = _lote_de(nombre)[1]
+            fallas = [
+                (f"página {t.pagina + 1}: " if t.pagina is not None else '') + t.error
+                for t in tareas if t.nombre_original == original and t.error
+            ]
+            self._mover(nombre, FALLIDOS if fallas else PROCESADOS, fallas)
+            informe['fallidos' if fallas else 'procesados'].append(original)
+
+    def _mover(self, nombre, carpeta, errores=()):
+        destino = _destino_libre(os.path.join(self.ruta, carpeta), nombre)
+        os.replace(os.path.join(self.ruta, EN_PROCESO, nombre), destino)
+        if errores:
+            with open(destino + '.error.txt', 'w', encoding='utf-8') as f:
+                f.write('\n'.join(errores) + '\n')
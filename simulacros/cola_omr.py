@@ -0,0 +1,378 @@
+"""
+cola_omr.py — Cola de OMR persistida en base de datos.
+
+La vista de carga solo crea un LoteOMR con una TareaOMR por hoja y responde
+de inmediato. Un proceso aparte (`python manage.py procesar_omr`) reclama
+las tareas pendientes, las pasa por el pool de omr_paralelo y guarda el
+resultado. Cuando todas las hojas de un lote terminan, el lote queda listo
+para revisión.
+
+Las tareas subidas sin alumno ni sesión (hojas personalizadas con QR) se
+asignan aquí con lo que leyó el OMR del código de la hoja; las que solo no
+tienen sesión, con la que detectó el OMR por el formato de la hoja.
+
+Antes de procesar, cada hoja se busca por el hash de su contenido en la
+caché de resultados (cache_omr.py): volver a subir las mismas imágenes no
+las vuelve a pasar por el OMR. De cada hoja leída se guarda el recorte de
+sus tiras para la revisión (recortes_omr.py).
+
+Si un proceso del pool muere, sus hojas vuelven a 'pendiente' (hasta
+MAX_INTENTOS intentos) en lugar de quedar como error o colgadas.
+
+Los escaneos completos (omr/hojas/) solo hacen falta hasta calificar el
+lote: purgar_hojas() borra los de lotes calificados hace más de
+OMR_HOJAS_DIAS días y los que quedaron de lotes eliminados (comando
+`purgar_recortes_omr`).
+
+Cada hoja procesada deja una línea JSON en el logger 'simulacros.omr'
+(evento 'omr_hoja', con sus métricas por etapa) y cada lote cerrado una con
+el resumen agregado (evento 'omr_lote').
+"""
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from academico.models import Alumno
+
+from . import cache_omr, recortes_omr
+from .escaneos import DocumentoMultipagina
+from .models import LoteOMR, TareaOMR
+from .omr_paralelo import procesar_hojas
+from .procesar_simulacro import MODO_QR
+
+# Reintentos antes de dar una hoja por fallida definitivamente
+MAX_INTENTOS = 3
+
+CARPETA_HOJAS = 'omr/hojas'
+
+logger = logging.getLogger('simulacros.omr')
+
+
+def _registrar_evento(evento, **datos):
+    """Una línea JSON por evento; los datos también van en record.omr para otros handlers."""
+    datos = {'evento': evento, **datos}
+    logger.info(json.dumps(datos, ensure_ascii=False, default=str), extra={'omr': datos})
+
+
+def encolar_lote(simulacro, hojas, asignaciones, fecha_realizacion, grupo=None, alumnos=(), registrador=None):
+    """
+    Crea un LoteOMR con una TareaOMR pendiente por hoja y lo retorna.
+    `hojas` es [(archivo, pagina), ...] (ver escaneos.hojas_de_archivos) y
+    `asignaciones` [(alumno o None, sesión o ''), ...], una por hoja: sin
+    alumno la hoja se identifica por QR y sin sesión, por su formato.
+    `alumnos` es el orden en que se mostrarán en la revisión.
+    """
+    guardados = {}  # un PDF/TIFF se guarda una vez y lo comparten sus páginas
+    with transaction.atomic():
+        lote = LoteOMR.objects.create(
+            simulacro=simulacro,
+            grupo=grupo,
+            fecha_realizacion=fecha_realizacion,
+            alumnos=[a.id for a in alumnos],
+            registrador=registrador,
+        )
+        for orden, ((archivo, pagina), (alumno, sesion)) in enumerate(zip(hojas, asignaciones)):
+            tarea = TareaOMR(
+                lote=lote,
+                alumno=alumno,
+                sesion=sesion,
+                orden=orden,
+                pagina=pagina,
+                nombre_original=os.path.basename(archivo.name),
+            )
+            if id(archivo) in guardados:
+                tarea.archivo.name = guardados[id(archivo)]
+            else:
+                tarea.archivo.save(os.path.basename(archivo.name), archivo, save=False)
+            tarea.save()
+            guardados[id(archivo)] = tarea.archivo.name
+    return lote
+
+
+def reclamar_tareas(limite):
+    """
+    Marca como 'procesando' hasta `limite` tareas pendientes y las retorna.
+
+    El reclamo es un UPDATE condicionado al estado, así dos workers que
+    compiten por la misma tarea nunca la procesan ambos (funciona igual en
+    SQLite y PostgreSQL).
+    """
+    candidatas = list(
+        TareaOMR.objects.filter(estado=TareaOMR.ESTADO_PENDIENTE)
+        .order_by('lote_id', 'orden')
+        .values_list('id', flat=True)[:limite]
+    )
+    ahora = timezone.now()
+    reclamadas = []
+    for tarea_id in candidatas:
+        ok = TareaOMR.objects.filter(id=tarea_id, estado=TareaOMR.ESTADO_PENDIENTE).update(
+            estado=TareaOMR.ESTADO_PROCESANDO,
+            fecha_inicio=ahora,
+            intentos=F('intentos') + 1,
+        )
+        if ok:
+            reclamadas.append(tarea_id)
+    return list(
+        TareaOMR.objects.filter(id__in=reclamadas)
+        .select_related('lote__registrador')
+        .order_by('lote_id', 'orden')
+    )
+
+
+def liberar_tareas_colgadas(minutos=30):
+    """
+    Devuelve a 'pendiente' las tareas que quedaron en 'procesando' porque el
+    worker murió. Las que ya agotaron sus intentos se marcan como error.
+    """
+    limite = timezone.now() - timedelta(minutes=minutos)
+    colgadas = TareaOMR.objects.filter(estado=TareaOMR.ESTADO_PROCESANDO, fecha_inicio__lt=limite)
+    agotadas = colgadas.filter(intentos__gte=MAX_INTENTOS).update(
+        estado=TareaOMR.ESTADO_ERROR,
+        error="El procesamiento se interrumpió demasiadas veces.",
+        fecha_fin=timezone.now(),
+    )
+    liberadas = colgadas.update(estado=TareaOMR.ESTADO_PENDIENTE)
+    return liberadas + agotadas
+
+
+def _reintentar(tarea, error, fin):
+    """
+    La hoja se quedó sin leer porque murió un proceso del pool: vuelve a la
+    cola (los intentos ya se contaron al reclamarla) o, si ya agotó
+    MAX_INTENTOS, queda con error.
+    """
+    if tarea.intentos >= MAX_INTENTOS:
+        tarea.estado = TareaOMR.ESTADO_ERROR
+        tarea.error = f"El procesamiento falló demasiadas veces. {error}"
+        tarea.fecha_fin = fin
+    else:
+        tarea.estado = TareaOMR.ESTADO_PENDIENTE
+    tarea.save(update_fields=['estado', 'error', 'fecha_fin'])
+    _registrar_evento('omr_reintento', lote=tarea.lote_id, tarea=tarea.pk, intentos=tarea.intentos,
+                      estado=tarea.estado, error=error)
+
+
+def cerrar_lotes(lote_ids):
+    """Pasa a revisión los lotes cuyas tareas ya terminaron todas."""
+    cerrados = 0
+    for lote in LoteOMR.objects.filter(id__in=lote_ids, estado=LoteOMR.ESTADO_PROCESANDO):
+        if not lote.tareas.exclude(estado__in=TareaOMR.ESTADOS_FINALES).exists():
+            lote.estado = LoteOMR.ESTADO_REVISION
+            lote.save(update_fields=['estado'])
+            _registrar_evento('omr_lote', lote=lote.pk, **lote.resumen_metricas())
+            cerrados += 1
+    return cerrados
+
+
+def purgar_hojas(dias=None):
+    """
+    Borra los escaneos de los lotes calificados hace más de `dias` (por
+    defecto OMR_HOJAS_DIAS) y deja vacío TareaOMR.archivo. También borra los
+    archivos de omr/hojas/ de más de `dias` días que ya no son de ninguna
+    tarea (lotes eliminados). Retorna la cantidad de archivos borrados.
+    """
+    dias = settings.OMR_HOJAS_DIAS if dias is None else dias
+    limite = timezone.now() - timedelta(days=dias)
+    vencidas = TareaOMR.objects.filter(
+        lote__estado=LoteOMR.ESTADO_CALIFICADO, lote__fecha_calificacion__lt=limite,
+    ).exclude(archivo='')
+    # Las páginas de un mismo PDF/TIFF comparten archivo
+    nombres = set(vencidas.values_list('archivo', flat=True))
+    for nombre in nombres:
+        default_storage.delete(nombre)
+    vencidas.update(archivo='')
+    borrados = len(nombres)
+
+    # omr/hojas/<año>/<mes>/<día>/: solo se miran los días ya vencidos, así no
+    # se toca lo que se está subiendo mientras se crea su tarea
+    en_uso = set(TareaOMR.objects.exclude(archivo='').values_list('archivo', flat=True))
+    for carpeta in _carpetas_por_dia(CARPETA_HOJAS):
+        try:
+            fecha = timezone.make_aware(datetime.strptime(carpeta[len(CARPETA_HOJAS) + 1:], '%Y/%m/%d'))
+        except ValueError:
+            continue
+        if fecha + timedelta(days=1) > limite:
+            continue
+        for archivo in default_storage.listdir(carpeta)[1]:
+            nombre = f"{carpeta}/{archivo}"
+            if nombre not in en_uso:
+                default_storage.delete(nombre)
+                borrados += 1
+    return borrados
+
+
+def _carpetas_por_dia(raiz, nivel=3):
+    """Carpetas que quedan `nivel` niveles debajo de `raiz` en el almacenamiento."""
+    try:
+        carpetas = default_storage.listdir(raiz)[0]
+    except FileNotFoundError:
+        return []
+    if nivel == 1:
+        return [f"{raiz}/{c}" for c in carpetas]
+    return [sub for c in carpetas for sub in _carpetas_por_dia(f"{raiz}/{c}", nivel - 1)]
+
+
+def _modo_tarea(tarea):
+    """
+    Modo con que se envía la hoja al OMR: su sesión, o identificarla si falta
+    (solo llegan sin sesión con OMR_SESION_AUTOMATICA).
+    """
+    if tarea.alumno_id is None:
+        return MODO_QR
+    return tarea.sesion or None
+
+
+def _asignar_hoja(tarea, resultado):
+    """
+    Completa alumno y/o sesión de una tarea subida sin asignar con lo que
+    identificó el OMR (QR o formato de la hoja). Retorna el error a
+    registrar, o None si quedó asignada.
+    """
+    if tarea.alumno_id is None:
+        identificacion = resultado['metricas'].get('identificacion')
+        if not identificacion:
+            return "La hoja no se pudo identificar."
+        alumno_id, sesion = identificacion['alumno'], identificacion['sesion']
+        if not Alumno.objects.filter(id=alumno_id).exists():
+            return f"El código QR corresponde a un alumno que no existe (id {alumno_id})."
+    else:
+        alumno_id = tarea.alumno_id
+        sesion = (resultado['metricas'].get('sesion_detectada') or {}).get('sesion')
+        if not sesion:
+            return "No se pudo determinar la sesión de la hoja."
+    repetida = (
+        TareaOMR.objects.filter(lote_id=tarea.lote_id, alumno_id=alumno_id, sesion=sesion)
+        .exclude(id=tarea.id)
+        .exists()
+    )
+    if repetida:
+        return f"Hoja repetida: el lote ya tiene la hoja {sesion} de este alumno."
+    tarea.alumno_id = alumno_id
+    tarea.sesion = sesion
+    return None
+
+
+def _leer_hojas(tareas):
+    """
+    Retorna [(fuente, error), ...]: los bytes del archivo de cada tarea, o la
+    página que le corresponde si viene de un PDF/TIFF multipágina. Cada
+    documento se abre e indexa una sola vez por bloque y solo se leen las
+    páginas reclamadas, así la memoria no depende del tamaño del fajo.
+    """
+    abiertos = []
+    documentos = {}
+    salida = []
+    try:
+        for tarea in tareas:
+            try:
+                if tarea.pagina is None:
+                    with tarea.archivo.open('rb') as f:
+                        salida.append((f.read(), None))
+                    continue
+                nombre = tarea.archivo.name
+                if nombre not in documentos:
+                    f = tarea.archivo.storage.open(nombre, 'rb')
+                    abiertos.append(f)
+                    documentos[nombre] = DocumentoMultipagina(f)
+                salida.append((documentos[nombre].pagina(tarea.pagina), None))
+            except Exception as e:
+                salida.append((None, f"No se pudo leer la hoja: {e}"))
+    finally:
+        for doc in documentos.values():
+            doc.cerrar()
+        for f in abiertos:
+            f.close()
+    return salida
+
+
+def procesar_pendientes(limite=None, max_workers=None, timeout_hoja=None, pool=None):
+    """
+    Reclama un bloque de tareas pendientes y las procesa en paralelo,
+    reutilizando `pool` si se indica. Retorna la cantidad de tareas
+    procesadas (0 si la cola estaba vacía).
+    """
+    max_workers = max_workers or settings.OMR_MAX_WORKERS
+    timeout_hoja = timeout_hoja or settings.OMR_TIMEOUT_HOJA
+    # Bloques de unas pocas hojas por proceso: mantiene el pool ocupado sin
+    # reclamar de golpe tareas que otro worker podría estar atendiendo.
+    limite = limite or max_workers * 4
+
+    tareas = reclamar_tareas(limite)
+    if not tareas:
+        return 0
+
+    # Se envían los bytes tal como se subieron; cada proceso los decodifica en
+    # memoria con cv2.imdecode (sirve con cualquier backend de almacenamiento).
+    leidas = _leer_hojas(tareas)
+    resultados = [{'tiras': [], 'error': error, 'duracion': 0, 'metricas': {}} for _fuente, error in leidas]
+    if not settings.OMR_SESION_AUTOMATICA:
+        for tarea, resultado in zip(tareas, resultados):
+            if tarea.alumno_id is not None and not tarea.sesion and not resultado['error']:
+                resultado['error'] = ("La hoja no tiene sesión asignada y la detección automática "
+                                      "está desactivada (OMR_SESION_AUTOMATICA).")
+    legibles = [i for i, resultado in enumerate(resultados) if not resultado['error']]
+    claves = {}
+    for i in legibles:
+        tareas[i].hash_contenido = cache_omr.hash_contenido(leidas[i][0])
+        claves[i] = (tareas[i].hash_contenido, _modo_tarea(tareas[i]) or '')
+
+    # Hojas ya leídas antes (mismos bytes, mismo modo y versión del OMR)
+    version = cache_omr.version_cache(settings.OMR_ALINEACION)
+    en_cache = cache_omr.buscar(claves.values(), version) if cache_omr.habilitada() else {}
+    a_procesar = []
+    for i in legibles:
+        guardado = en_cache.get(claves[i])
+        if guardado is None:
+            a_procesar.append(i)
+            continue
+        resultados[i] = {
+            'tiras': guardado['tiras'], 'error': None, 'duracion': 0,
+            'metricas': {**guardado['metricas'], 'tiempos': {}, 'cache': True},
+        }
+
+    hojas = [(leidas[i][0], _modo_tarea(tareas[i])) for i in a_procesar]
+    procesadas = procesar_hojas(hojas, max_workers=max_workers, timeout_hoja=timeout_hoja,
+                                user=tareas[0].lote.registrador, pool=pool,
+                                alineacion=settings.OMR_ALINEACION,
+                                con_recortes=recortes_omr.habilitados())
+    nuevas = []
+    for i, resultado in zip(a_procesar, procesadas):
+        resultados[i] = resultado
+        if not resultado['error']:
+            nuevas.append((*claves[i], resultado['tiras'], resultado['metricas']))
+    if nuevas and cache_omr.habilitada():
+        cache_omr.guardar(nuevas, version)
+
+    fin = timezone.now()
+    for tarea, resultado in zip(tareas, resultados):
+        if resultado.get('pool_roto'):
+            _reintentar(tarea, resultado['error'], fin)
+            continue
+        if (tarea.alumno_id is None or not tarea.sesion) and not resultado['error']:
+            resultado['error'] = _asignar_hoja(tarea, resultado)
+        tarea.tiras = resultado['tiras'] if not resultado['error'] else []
+        tarea.error = resultado['error'] or ''
+        tarea.duracion = resultado['duracion']
+        tarea.metricas = resultado['metricas']
+        tarea.fecha_fin = fin
+        tarea.estado = TareaOMR.ESTADO_ERROR if resultado['error'] else TareaOMR.ESTADO_COMPLETADA
+        if resultado.get('recortes'):
+            recortes_omr.guardar(tarea, resultado['recortes'])
+        elif resultado['metricas'].get('cache') and recortes_omr.habilitados():
+            recortes_omr.copiar_de_anterior(tarea)
+        tarea.save(update_fields=['alumno', 'sesion', 'tiras', 'error', 'duracion', 'metricas',
+                                  'hash_contenido', 'recortes', 'fecha_fin', 'estado'])
+        _registrar_evento(
+            'omr_hoja', lote=tarea.lote_id, tarea=tarea.pk, sesion=tarea.sesion,
+            estado=tarea.estado, error=tarea.error or None, duracion=tarea.duracion, **tarea.metricas,
+        )
+
+    cerrar_lotes({tarea.lote_id for tarea in tareas})
+    return len(tareas)
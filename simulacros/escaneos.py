@@ -0,0 +1,214 @@
+"""
+escaneos.py — Lectura de la salida multipágina del escáner (PDF / TIFF).
+
+El escáner con alimentador (ADF) entrega un solo PDF o TIFF por fajo de
+hojas. En lugar de partirlo a mano en JPGs, aquí se abre el archivo y se
+entregan las páginas de a una, sin cargar el documento completo en memoria:
+
+  - TIFF: Pillow salta de página en página (seek) y solo decodifica la actual.
+  - PDF: los PDF de escáner guardan cada página como una imagen embebida
+    (casi siempre JPEG, /DCTDecode). pypdf recorre el árbol de páginas (con
+    los recursos heredados) y de cada página se toma su imagen más grande
+    (los logos o miniaturas se ignoran). Un JPEG se entrega como los bytes
+    originales, que cargar_imagen decodifica con cv2.imdecode; las demás
+    compresiones las decodifica pypdf. No se rasteriza el PDF.
+
+Las páginas salen en el orden del documento; se asume el orden del escáner
+(S1, S2, S1, S2, ... por alumno). Por eso una página que no se puede leer
+(sin imagen o con una compresión no soportada) invalida todo el PDF en vez
+de saltarse y correr el emparejamiento de las siguientes.
+"""
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+from pypdf import PdfReader
+from pypdf.errors import PyPdfError
+
+EXTENSIONES_MULTIPAGINA = ('.pdf', '.tif', '.tiff')
+EXTENSIONES_IMAGEN = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+# Filtros de imagen que se pueden leer: los JPEG van tal cual a cv2.imdecode
+# y el resto los decodifica pypdf (JBIG2 necesita un binario externo)
+_FILTROS_CODIFICADOS = ('/DCTDecode', '/JPXDecode')
+_FILTROS_PYPDF = ('/FlateDecode', '/LZWDecode', '/RunLengthDecode', '/CCITTFaxDecode',
+                  '/ASCIIHexDecode', '/ASCII85Decode')
+
+_AVISO_COMPRESION = "Configure el escáner para guardar en JPEG o TIFF."
+
+
+def _filtros(dic):
+    """Lista de filtros (/Filter) de un stream de imagen del PDF."""
+    filtro = dic.get('/Filter')
+    if filtro is None:
+        return []
+    return list(filtro) if isinstance(filtro, list) else [filtro]
+
+
+def _a_bgr(imagen):
+    """Imagen de Pillow (cualquier modo) como ndarray BGR de 8 bits."""
+    if imagen.mode not in ('RGB', 'L'):
+        imagen = imagen.convert('L' if imagen.mode in ('1', 'I;16', 'I') else 'RGB')
+    arr = np.asarray(imagen)
+    if arr.ndim == 2:
+        return cv2.cvtColor(arr, cv2.COLOR_GRAY2BGR)
+    return cv2.cvtColor(arr, cv2.COLOR_RGB2BGR)
+
+
+def es_multipagina(nombre):
+    """True si el nombre de archivo corresponde a un PDF o TIFF."""
+    return os.path.splitext(nombre or '')[1].lower() in EXTENSIONES_MULTIPAGINA
+
+
+def es_escaneo(nombre):
+    """True si el nombre de archivo corresponde a una imagen, PDF o TIFF."""
+    return os.path.splitext(nombre or '')[1].lower() in EXTENSIONES_IMAGEN + EXTENSIONES_MULTIPAGINA
+
+
+class DocumentoMultipagina:
+    """
+    Acceso perezoso a las páginas de un PDF o TIFF de escáner.
+
+    `archivo` es una ruta o un archivo binario abierto (con seek). Se usa como
+    context manager:
+
+        with DocumentoMultipagina(ruta) as doc:
+            for pagina in doc:          # una página a la vez
+                procesar_hoja(pagina, ...)
+            doc.pagina(3)               # acceso directo a una página
+
+    Cada página es bytes JPEG (PDF con imágenes JPEG) o un ndarray BGR (TIFF
+    y las demás imágenes de PDF); ambos los acepta procesar_simulacro.cargar_imagen.
+    """
+
+    def __init__(self, archivo):
+        self._propio = isinstance(archivo, (str, os.PathLike))
+        self._archivo = open(archivo, 'rb') if self._propio else archivo
+        self._archivo.seek(0)
+        cabecera = self._archivo.read(4)
+        self._archivo.seek(0)
+
+        self._tiff = None
+        if cabecera == b'%PDF':
+            self.tipo = 'pdf'
+            try:
+                self._indexar_pdf()
+            except ValueError:
+                self.cerrar()
+                raise
+        elif cabecera in (b'II*\x00', b'MM\x00*'):
+            self.tipo = 'tiff'
+            self._tiff = Image.open(self._archivo)
+            self._n_paginas = getattr(self._tiff, 'n_frames', 1)
+        else:
+            self.cerrar()
+            raise ValueError("El archivo no es un PDF ni un TIFF.")
+
+    # ── PDF ──────────────────────────────────────────────────────────────
+    def _indexar_pdf(self):
+        # pypdf lee del archivo solo los objetos que se piden
+        try:
+            paginas = list(PdfReader(self._archivo).pages)
+        except (PyPdfError, ValueError, KeyError, TypeError) as e:
+            raise ValueError(f"No se pudo leer la estructura del PDF ({e}).") from e
+        self._paginas = [self._imagen_de_pagina(n, pagina) for n, pagina in enumerate(paginas, 1)]
+        self._n_paginas = len(self._paginas)
+
+    @staticmethod
+    def _imagen_de_pagina(numero, pagina):
+        """(página, nombre, imagen) de la imagen más grande de la página `numero` (desde 1)."""
+        recursos = pagina.get('/Resources')
+        xobjetos = recursos.get_object().get('/XObject') if recursos is not None else None
+        imagenes = []
+        for nombre, ref in (xobjetos.get_object().items() if xobjetos is not None else ()):
+            dic = ref.get_object()
+            if dic.get('/Subtype') == '/Image' and not dic.get('/ImageMask'):
+                ancho, alto = dic.get('/Width'), dic.get('/Height')
+                if isinstance(ancho, int) and isinstance(alto, int):
+                    imagenes.append((ancho * alto, nombre, dic))
+        if not imagenes:
+            raise ValueError(f"La página {numero} del PDF no tiene una imagen escaneada. {_AVISO_COMPRESION}")
+        _area, nombre, dic = max(imagenes, key=lambda i: i[0])
+
+        # El último filtro es el de la imagen; los anteriores, de transporte
+        filtros = _filtros(dic)
+        *transporte, ultimo = filtros or [None]
+        if all(f in _FILTROS_PYPDF for f in transporte) and ultimo in (None, *_FILTROS_CODIFICADOS, *_FILTROS_PYPDF):
+            return pagina, nombre, dic
+        raise ValueError(
+            f"La página {numero} del PDF usa una compresión de imagen no soportada "
+            f"({' + '.join(f.lstrip('/') for f in filtros) or 'sin filtro'}). {_AVISO_COMPRESION}"
+        )
+
+    def _pagina_pdf(self, indice):
+        pagina, nombre, dic = self._paginas[indice]
+        filtros = _filtros(dic)
+        try:
+            if filtros and filtros[-1] in _FILTROS_CODIFICADOS:
+                # pypdf deshace los filtros de transporte y deja el JPEG tal cual
+                return dic.get_data()
+            return _a_bgr(pagina.images[nombre].image)
+        except (PyPdfError, OSError, ValueError, KeyError) as e:
+            raise ValueError(f"No se pudo leer la imagen de la página {indice + 1} del PDF ({e}).") from e
+
+    # ── TIFF ─────────────────────────────────────────────────────────────
+    def _pagina_tiff(self, indice):
+        self._tiff.seek(indice)
+        return _a_bgr(self._tiff)
+
+    # ── API pública ──────────────────────────────────────────────────────
+    def __len__(self):
+        return self._n_paginas
+
+    def pagina(self, indice):
+        if not 0 <= indice < self._n_paginas:
+            raise IndexError(f"El documento tiene {self._n_paginas} páginas; no existe la {indice + 1}.")
+        if self.tipo == 'pdf':
+            return self._pagina_pdf(indice)
+        return self._pagina_tiff(indice)
+
+    def __iter__(self):
+        for indice in range(self._n_paginas):
+            yield self.pagina(indice)
+
+    def cerrar(self):
+        if self._tiff is not None:
+            self._tiff.close()
+            self._tiff = None
+        self._paginas = None
+        if self._propio:
+            self._archivo.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+        return False
+
+
+def contar_paginas(archivo):
+    """Cantidad de páginas de un PDF/TIFF sin decodificar ninguna."""
+    with DocumentoMultipagina(archivo) as doc:
+        return len(doc)
+
+
+def hojas_de_archivos(archivos):
+    """
+    Hojas que aportan `archivos` (subidos o File de Django), en ese orden:
+    [(archivo, None), ...] para una imagen y [(archivo, 0), (archivo, 1), ...]
+    para las páginas de un PDF/TIFF. Solo se cuentan las páginas; se leen
+    después en el worker. Lanza ValueError si un PDF/TIFF no se puede abrir.
+    """
+    hojas = []
+    for archivo in archivos:
+        if es_multipagina(archivo.name):
+            try:
+                n_paginas = contar_paginas(archivo)
+            except ValueError as e:
+                raise ValueError(f"{archivo.name}: {e}") from e
+            hojas.extend((archivo, pagina) for pagina in range(n_paginas))
+        else:
+            hojas.append((archivo, None))
+    return hojas
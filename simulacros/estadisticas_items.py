@@ -0,0 +1,196 @@
+"""
+estadisticas_items.py — Estadísticas por pregunta mantenidas al calificar.
+
+EstadisticaItem guarda, por simulacro, grupo, sesión y pregunta, cuántos
+alumnos respondieron la sesión completa, cuántos acertaron, cuántos la
+dejaron en blanco ('Z') y cuántos marcaron cada opción (A–H). Los informes
+leen de ahí con una suma por pregunta (resumen), en lugar de recorrer las
+respuestas de todos los alumnos en cada descarga.
+
+La tabla se mantiene por diferencias: quien reemplaza resultados toma con
+contribuciones() lo que aportaban antes y lo que aportan después, y
+registrar() resta lo uno y suma lo otro (calificacion.calificar_lote y el
+admin de resultados lo hacen). Como la distribución por opción ya está
+guardada, corregir la clave solo recalcula 'correctas' (actualizar_correctas,
+que llama la recalificación).
+
+Un alumno cuenta en su grupo actual, el mismo por el que filtran los
+informes: si se le cambia de grupo, la señal de signals.py pasa sus aportes
+al nuevo (mover_alumno). El comando `reconstruir_estadisticas_items` la
+rehace desde cero si se cambian resultados o alumnos por otra vía
+(queryset.update, SQL directo).
+"""
+import numpy as np
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Max, Sum, Value, When
+
+from .calculos import empaquetar_respuestas
+from .models import EstadisticaItem, ResultadoSimulacro
+
+LETRAS = 'ABCDEFGH'
+CAMPOS_OPCION = [f'opcion_{letra.lower()}' for letra in LETRAS]
+CAMPOS_CONTEO = ['intentos', 'correctas', 'blancos'] + CAMPOS_OPCION
+
+# Filas de la matriz de conteos: intentos, blancos y una por opción
+_CODIGOS = np.frombuffer(('Z' + LETRAS).encode('ascii'), np.uint8)
+
+# Preguntas por UPDATE al sumar (cada una agrega dos parámetros por campo)
+_ITEMS_POR_CONSULTA = 150
+
+
+def _claves(simulacro):
+    return {'S1': simulacro.soluciones_s1, 'S2': simulacro.soluciones_s2}
+
+
+def contribuciones(simulacro, alumno_ids=None):
+    """
+    Lo que aportan a la tabla los resultados guardados del simulacro (de
+    `alumno_ids`, o todos): [(grupo_id, respuestas_s1, respuestas_s2), ...].
+    """
+    resultados = ResultadoSimulacro.objects.filter(simulacro=simulacro)
+    if alumno_ids is not None:
+        resultados = resultados.filter(alumno_id__in=alumno_ids)
+    return list(resultados.values_list('alumno__grupo_actual_id', 'respuestas_s1', 'respuestas_s2'))
+
+
+def _conteos(filas, columna, n_items):
+    """{grupo_id: matriz (10 × n_items) con intentos, blancos y A–H} de la sesión en `columna`."""
+    grupos = np.array([fila[0] or 0 for fila in filas])
+    matriz, validas = empaquetar_respuestas([fila[columna] or '' for fila in filas], n_items)
+    por_grupo = {}
+    for grupo in np.unique(grupos[validas]):
+        sub = matriz[validas & (grupos == grupo)]
+        por_grupo[int(grupo)] = np.vstack(
+            [np.full(n_items, len(sub))] + [(sub == codigo).sum(axis=0) for codigo in _CODIGOS]
+        )
+    return por_grupo
+
+
+def _sumas(campo, valores, items):
+    """F(campo) + el valor de cada pregunta de `items` (CASE por pregunta)."""
+    casos = [When(item=j + 1, then=Value(int(valores[j]))) for j in items if valores[j]]
+    return F(campo) + Case(*casos, default=Value(0), output_field=IntegerField())
+
+
+def registrar(simulacro, anteriores, nuevos):
+    """
+    Aplica a la tabla el cambio de `anteriores` a `nuevos` (listas de
+    contribuciones()). Va en la misma transacción que el cambio de resultados
+    que la origina. Las filas que faltan se crean en cero (ignorando las que
+    otra transacción cree a la vez) y los conteos se suman en la base de
+    datos con F(), así dos calificaciones simultáneas no se pisan.
+    """
+    claves = _claves(simulacro)
+    deltas = {}
+    for signo, filas in ((-1, anteriores), (1, nuevos)):
+        for columna, sesion in ((1, 'S1'), (2, 'S2')):
+            for grupo, conteo in _conteos(filas, columna, len(claves[sesion])).items():
+                deltas[(grupo, sesion)] = deltas.get((grupo, sesion), 0) + signo * conteo
+    deltas = {llave: delta for llave, delta in deltas.items() if delta.any() and llave[0]}
+    if not deltas:
+        return
+
+    existentes = set(
+        EstadisticaItem.objects.filter(simulacro=simulacro, grupo_id__in={g for g, _s in deltas})
+        .values_list('grupo_id', 'sesion', 'item')
+    )
+    EstadisticaItem.objects.bulk_create(
+        [EstadisticaItem(simulacro=simulacro, grupo_id=grupo, sesion=sesion, item=j + 1)
+         for (grupo, sesion), delta in deltas.items()
+         for j in np.flatnonzero(delta.any(axis=0)) if (grupo, sesion, j + 1) not in existentes],
+        batch_size=500, ignore_conflicts=True,
+    )
+    for (grupo, sesion), delta in deltas.items():
+        clave = claves[sesion]
+        # 'correctas' cambia lo mismo que la opción de la clave en cada pregunta
+        correctas = np.array([delta[2 + LETRAS.index(letra), j] if letra in LETRAS else 0
+                              for j, letra in enumerate(clave)])
+        valores = dict(zip(['intentos', 'blancos'] + CAMPOS_OPCION, delta))
+        valores['correctas'] = correctas
+        cambiadas = np.flatnonzero(delta.any(axis=0))
+        for inicio in range(0, len(cambiadas), _ITEMS_POR_CONSULTA):
+            items = cambiadas[inicio:inicio + _ITEMS_POR_CONSULTA]
+            EstadisticaItem.objects.filter(
+                simulacro=simulacro, grupo_id=grupo, sesion=sesion, item__in=[int(j) + 1 for j in items],
+            ).update(**{campo: _sumas(campo, v, items) for campo, v in valores.items() if v[items].any()})
+
+
+def actualizar_correctas(simulacro):
+    """
+    Recalcula 'correctas' con la clave actual a partir de la distribución
+    guardada, en la base de datos (una consulta por sesión). Si cambió la
+    longitud de una clave, la tabla se reconstruye.
+    """
+    claves = _claves(simulacro)
+    longitudes = dict(
+        EstadisticaItem.objects.filter(simulacro=simulacro).order_by().values_list('sesion').annotate(Max('item'))
+    )
+    if any(n != len(claves[sesion]) for sesion, n in longitudes.items()):
+        reconstruir(simulacro)
+        return
+    for sesion in longitudes:
+        casos = [When(item=j + 1, then=F(f'opcion_{letra.lower()}'))
+                 for j, letra in enumerate(claves[sesion]) if letra in LETRAS]
+        EstadisticaItem.objects.filter(simulacro=simulacro, sesion=sesion).update(
+            correctas=Case(*casos, default=Value(0), output_field=IntegerField()))
+
+
+def mover_alumno(alumno_id, grupo_anterior, grupo_nuevo):
+    """Pasa lo que aportan los resultados del alumno de un grupo a otro, en todos sus simulacros."""
+    resultados = ResultadoSimulacro.objects.filter(alumno_id=alumno_id).select_related('simulacro')
+    with transaction.atomic():
+        for resultado in resultados:
+            respuestas = (resultado.respuestas_s1, resultado.respuestas_s2)
+            registrar(resultado.simulacro, [(grupo_anterior, *respuestas)], [(grupo_nuevo, *respuestas)])
+
+
+def reconstruir(simulacro):
+    """Rehace desde cero las estadísticas del simulacro con sus resultados guardados."""
+    with transaction.atomic():
+        EstadisticaItem.objects.filter(simulacro=simulacro).delete()
+        registrar(simulacro, [], contribuciones(simulacro))
+
+
+def resumen(simulacro, sede_id=None, grupo_id=None):
+    """
+    Estadísticas de cada pregunta sumando los grupos del simulacro (o los de
+    una sede, o uno solo): {(sesion, item): {'intentos', 'correctas',
+    'blancos', 'opciones': {'A': n, ...}}}. Una sola consulta agregada.
+    """
+    filas = EstadisticaItem.objects.filter(simulacro=simulacro)
+    if sede_id:
+        filas = filas.filter(grupo__salon__sede_id=sede_id)
+    if grupo_id:
+        filas = filas.filter(grupo_id=grupo_id)
+    salida = {}
+    for fila in filas.values('sesion', 'item').annotate(**{f'total_{c}': Sum(c) for c in CAMPOS_CONTEO}):
+        salida[(fila['sesion'], fila['item'])] = {
+            'intentos': fila['total_intentos'],
+            'correctas': fila['total_correctas'],
+            'blancos': fila['total_blancos'],
+            'opciones': {letra: fila[f'total_{campo}'] for letra, campo in zip(LETRAS, CAMPOS_OPCION)},
+        }
+    return salida
+
+
+def resumen_de_resultados(simulacro, resultados):
+    """
+    Lo mismo que resumen(), pero calculado en memoria sobre un queryset de
+    resultados del simulacro: para filtros que la tabla no guarda (fechas).
+    """
+    claves = _claves(simulacro)
+    filas = [(1,) + tuple(f) for f in resultados.values_list('respuestas_s1', 'respuestas_s2')]
+    salida = {}
+    for columna, sesion in ((1, 'S1'), (2, 'S2')):
+        conteo = _conteos(filas, columna, len(claves[sesion])).get(1)
+        if conteo is None:
+            continue
+        for j, letra in enumerate(claves[sesion]):
+            opciones = {l: int(conteo[2 + k, j]) for k, l in enumerate(LETRAS)}
+            salida[(sesion, j + 1)] = {
+                'intentos': int(conteo[0, j]),
+                'correctas': opciones.get(letra, 0),
+                'blancos': int(conteo[1, j]),
+                'opciones': opciones,
+            }
+    return salida
@@ -0,0 +1,110 @@
+"""
+hojas_respuesta.py — Hojas de respuesta en blanco personalizadas por alumno.
+
+Cada alumno recibe sus hojas S1 y S2 con su nombre y, en el encabezado, el QR
+de identificación (codificar_identificacion). Al subirlas con "identificar
+por código QR", el OMR asigna cada hoja a su alumno y sesión sin importar el
+orden de los archivos ni el grupo. Las esquinas llevan los marcadores ArUco
+que usa la alineación 'aruco' para fotos de celular.
+
+El formato se dibuja con las mismas coordenadas que lee el OMR (S1_CONF /
+S2_CONF para las tiras, la plantilla para las burbujas, ZONA_QR y
+MARCADORES_ARUCO) sobre una página carta: la hoja normalizada de
+NORM_W × NORM_H px es una carta a 150 dpi.
+"""
+import cv2
+import numpy as np
+from reportlab.graphics import renderPDF
+from reportlab.graphics.barcode.qr import QrCodeWidget
+from reportlab.graphics.shapes import Drawing
+from reportlab.lib.pagesizes import LETTER
+from reportlab.pdfgen import canvas
+
+from .procesar_simulacro import (
+    DICCIONARIO_ARUCO, LADO_ARUCO, LETRAS_OPCIONES, MARCADORES_ARUCO, NORM_H, NORM_W,
+    S1_CONF, S2_CONF, ZONA_QR, codificar_identificacion, compilar_plantilla,
+)
+
+# Puntos PDF por píxel de la hoja normalizada (72 pt por pulgada, 150 px por pulgada)
+PT_POR_PX = LETTER[0] / NORM_W
+
+_TIRAS = {'S1': (S1_CONF, ['c1', 'c2', 'c3', 'c4']), 'S2': (S2_CONF, ['c1', 'c2a', 'c2b', 'c3'])}
+
+
+def _pt(x, y):
+    """Coordenadas de la hoja normalizada (origen arriba) a puntos PDF (origen abajo)."""
+    return x * PT_POR_PX, (NORM_H - y) * PT_POR_PX
+
+
+def _dibujar_qr(c, texto):
+    x, y, lado = ZONA_QR
+    widget = QrCodeWidget(texto, barBorder=4)
+    x1, y1, x2, y2 = widget.getBounds()
+    lado_pt = lado * PT_POR_PX
+    dibujo = Drawing(lado_pt, lado_pt, transform=[lado_pt / (x2 - x1), 0, 0, lado_pt / (y2 - y1), 0, 0])
+    dibujo.add(widget)
+    renderPDF.draw(dibujo, c, *_pt(x, y + lado))
+
+
+def _dibujar_aruco(c):
+    diccionario = cv2.aruco.getPredefinedDictionary(DICCIONARIO_ARUCO)
+    celda = LADO_ARUCO / 6  # 4×4 bits más el borde negro de un bit
+    for id_marcador, (x, y) in MARCADORES_ARUCO.items():
+        bits = cv2.aruco.generateImageMarker(diccionario, id_marcador, 6)
+        for fila, columna in zip(*np.nonzero(bits == 0)):
+            c.rect(*_pt(x + columna * celda, y + (fila + 1) * celda),
+                   celda * PT_POR_PX, celda * PT_POR_PX, stroke=0, fill=1)
+
+
+def dibujar_hoja(c, modo, alumno, titulo=''):
+    """Dibuja en el canvas `c` la página en blanco de la sesión `modo` para `alumno`."""
+    nombre = f"{alumno.primer_apellido} {alumno.segundo_apellido} {alumno.nombres}".strip()
+
+    c.setFont('Helvetica-Bold', 19)
+    c.drawString(*_pt(140, 80), "HOJA RESPUESTA SIMULACRO")
+    c.setFont('Helvetica-Bold', 13)
+    c.drawString(*_pt(140, 115), f"SESIÓN {modo[-1]}" + (f" — {titulo}" if titulo else ""))
+    c.setFont('Helvetica', 11)
+    c.drawString(*_pt(140, 150), nombre)
+    c.setFont('Helvetica', 9)
+    c.drawString(*_pt(140, 172), f"Documento: {alumno.identificacion}")
+    _dibujar_qr(c, codificar_identificacion(alumno.pk, modo))
+    _dibujar_aruco(c)
+
+    conf, claves = _TIRAS[modo]
+    c.setLineWidth(3 * PT_POR_PX)
+    for k in claves:
+        x1, y1 = _pt(conf[f'{k}_x_ini'], conf[f'{k}_y_fin'])
+        x2, y2 = _pt(conf[f'{k}_x_fin'], conf[f'{k}_y_ini'])
+        c.rect(x1, y1, x2 - x1, y2 - y1)
+
+    c.setLineWidth(2 * PT_POR_PX)
+    pregunta = 0
+    for _etq, n_opciones, centros, (ancho, alto) in compilar_plantilla(modo):
+        rx, ry = ancho / 2 * PT_POR_PX, alto / 2 * PT_POR_PX
+        # Letras sobre la primera fila: dentro de la burbuja sumarían tinta al relleno
+        c.setFont('Helvetica-Bold', 7)
+        for letra, (cx, cy) in zip(LETRAS_OPCIONES[n_opciones], centros[0]):
+            c.drawCentredString(*_pt(cx, cy - alto), letra)
+        c.setFont('Helvetica', 7)
+        for fila in centros:
+            pregunta += 1
+            c.drawRightString(*_pt(fila[0][0] - ancho, fila[0][1] + 3), str(pregunta))
+            for cx, cy in fila:
+                x, y = _pt(cx, cy)
+                c.ellipse(x - rx, y - ry, x + rx, y + ry)
+
+
+def generar_hojas_pdf(destino, alumnos, titulo=''):
+    """
+    Escribe en `destino` (ruta o archivo, p. ej. un HttpResponse) un PDF con
+    las hojas S1 y S2 de cada alumno, en ese orden, listo para imprimir a
+    doble cara o por separado.
+    """
+    c = canvas.Canvas(destino, pagesize=LETTER)
+    c.setTitle(f"Hojas de respuesta {titulo}".strip())
+    for alumno in alumnos:
+        for modo in ('S1', 'S2'):
+            dibujar_hoja(c, modo, alumno, titulo)
+            c.showPage()
+    c.save()
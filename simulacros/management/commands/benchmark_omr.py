@@ -0,0 +1,277 @@
+import json
+import subprocess
+import time
+import tracemalloc
+from collections import defaultdict
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from simulacros.omr_sintetico import NIVELES_RUIDO, generar_par
+from simulacros.procesar_simulacro import (
+    ALINEACION_OMR, ETIQUETAS_S1, ETIQUETAS_S2, LONGITUDES_ESPERADAS,
+    extraer_tiras_individuales, procesar_imagen,
+)
+
+FUNCIONES = ('procesar_imagen', 'extraer_tiras_individuales')
+PERCENTILES = (50, 90, 99)
+
+
+def _percentiles(valores):
+    """{'p50': ms, 'p90': ms, 'p99': ms} de una lista de segundos."""
+    ms = np.percentile(np.asarray(valores) * 1000, PERCENTILES)
+    return {f'p{p}': round(float(v), 2) for p, v in zip(PERCENTILES, ms)}
+
+
+def _aciertos_por_tira(tiras, clave, modo):
+    """
+    Compara tira por tira, para que una tira corta no corra las siguientes.
+    Retorna (aciertos, preguntas dudosas, errores que no quedaron como dudosos).
+    """
+    etiquetas = ETIQUETAS_S1 if modo == 'S1' else ETIQUETAS_S2
+    leidas = {t['etiqueta']: t for t in tiras}
+    aciertos, dudosas, errores_ocultos, inicio = 0, 0, 0, 0
+    for etiqueta in etiquetas:
+        largo = LONGITUDES_ESPERADAS[modo][etiqueta]
+        esperada = clave[inicio:inicio + largo]
+        tira = leidas.get(etiqueta, {})
+        filas_dudosas = {d['fila'] for d in tira.get('dudosas', [])}
+        for fila, (a, b) in enumerate(zip(tira.get('secuencia', ''), esperada)):
+            aciertos += a == b
+            errores_ocultos += a != b and fila not in filas_dudosas
+        dudosas += len(filas_dudosas)
+        inicio += largo
+    return aciertos, dudosas, errores_ocultos
+
+
+def _correr(funcion, par, metricas, alineacion=None):
+    """
+    Ejecuta `funcion` sobre un par (S1, S2) de hojas codificadas; las métricas
+    de cada hoja se agregan a la lista `metricas`.
+    Retorna [(modo, aciertos, longitud_ok, dudosas, errores_ocultos), ...],
+    una tupla por hoja (ver _aciertos_por_tira; procesar_imagen no da márgenes).
+    """
+    (jpg_s1, hoja_s1), (jpg_s2, hoja_s2) = par
+    if funcion == 'procesar_imagen':
+        # Una llamada por hoja; la secuencia es plana, se compara por posición
+        salida = []
+        for jpg, hoja in ((jpg_s1, hoja_s1), (jpg_s2, hoja_s2)):
+            metricas.append({})
+            seq = procesar_imagen(jpg, hoja.modo, metricas=metricas[-1], alineacion=alineacion)
+            aciertos = sum(a == b for a, b in zip(seq, hoja.clave))
+            salida.append((hoja.modo, aciertos, len(seq) == len(hoja.clave), 0, 0))
+        return salida
+
+    por_hoja = {}
+    resultado = extraer_tiras_individuales(jpg_s1, jpg_s2, metricas=por_hoja, alineacion=alineacion)
+    metricas.extend(por_hoja.values())
+    salida = []
+    for hoja, tiras in ((hoja_s1, resultado['s1']), (hoja_s2, resultado['s2'])):
+        longitud_ok = bool(tiras) and all(t['ok'] for t in tiras)
+        aciertos, dudosas, errores_ocultos = _aciertos_por_tira(tiras, hoja.clave, hoja.modo)
+        salida.append((hoja.modo, aciertos, longitud_ok, dudosas, errores_ocultos))
+    return salida
+
+
+def medir(funcion, pares, alineacion=None):
+    """
+    Corre `funcion` sobre todos los pares y resume velocidad, memoria y
+    exactitud. Latencias y etapas son por hoja (promedio de las dos del par).
+    """
+    duraciones = []
+    etapas = defaultdict(list)
+    aciertos = defaultdict(int)
+    items = defaultdict(int)
+    longitud_ok = 0
+    hojas = 0
+    fallback = 0
+    aruco = 0
+    bajo_umbral = 0
+    dudosas = 0
+    errores_ocultos = 0
+
+    inicio_total = time.perf_counter()
+    for par in pares:
+        metricas = []
+        inicio = time.perf_counter()
+        salida = _correr(funcion, par, metricas, alineacion)
+        duraciones.extend([(time.perf_counter() - inicio) / len(par)] * len(par))
+        for m in metricas:
+            for etapa, seg in m.get('tiempos', {}).items():
+                etapas[etapa].append(seg)
+            fallback += bool(m.get('fallback_coordenadas'))
+            aruco += m.get('normalizacion') == 'aruco'
+            bajo_umbral += bool(m.get('calidad', {}).get('motivos'))
+        for (modo, ok, largo_ok, dudas, ocultos), (_jpg, hoja) in zip(salida, par):
+            aciertos[modo] += ok
+            dudosas += dudas
+            errores_ocultos += ocultos
+            items[modo] += len(hoja.clave)
+            longitud_ok += largo_ok
+            hojas += 1
+    total = time.perf_counter() - inicio_total
+
+    # Memoria: pasada aparte sobre el primer par (tracemalloc frena numpy)
+    tracemalloc.start()
+    try:
+        _correr(funcion, pares[0], [], alineacion)
+        _actual, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    reporte = {
+        'hojas': hojas,
+        'hojas_por_segundo': round(hojas / total, 2),
+        'latencia_ms': _percentiles(duraciones),
+        'etapas_ms': {etapa: _percentiles(valores) for etapa, valores in etapas.items()},
+        'memoria_pico_mb': round(pico / 2**20, 1),
+        'exactitud': round(sum(aciertos.values()) / sum(items.values()), 4),
+        'exactitud_por_sesion': {modo: round(aciertos[modo] / items[modo], 4) for modo in sorted(items)},
+        'hojas_longitud_correcta': longitud_ok,
+        'hojas_coordenadas_fijas': fallback,
+        'hojas_alineadas_aruco': aruco,
+        'hojas_bajo_umbral_calidad': bajo_umbral,
+    }
+    if funcion != 'procesar_imagen':
+        # Preguntas que irían a revisión humana (MARGEN_DUDA) y errores que se escaparían
+        reporte['items_dudosos'] = round(dudosas / sum(items.values()), 4)
+        reporte['errores_no_dudosos'] = errores_ocultos
+    return reporte
+
+
+def _commit_actual():
+    try:
+        salida = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                                capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return salida.stdout.strip() or None
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide velocidad y exactitud del OMR sobre hojas sintéticas con respuestas "
+        "conocidas (simulacros/omr_sintetico.py). Los resultados se pueden guardar "
+        "en JSON y comparar contra una corrida anterior."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pares', type=int, default=10,
+                            help="Pares de hojas (S1 + S2) a generar.")
+        parser.add_argument('--ruido', choices=sorted(NIVELES_RUIDO), default='leve',
+                            help="Nivel de defectos de escaneo simulados.")
+        parser.add_argument('--semilla', type=int, default=7,
+                            help="Semilla del generador; la misma semilla produce las mismas hojas.")
+        parser.add_argument('--alineacion', choices=('contorno', 'aruco'), default=ALINEACION_OMR,
+                            help="Alineación de las hojas; con 'aruco' se generan con marcadores.")
+        parser.add_argument('--funcion', choices=FUNCIONES, action='append', dest='funciones',
+                            help="Medir solo esta función (se puede repetir).")
+        parser.add_argument('--guardar', metavar='ARCHIVO.json',
+                            help="Guardar los resultados para comparar en otra versión.")
+        parser.add_argument('--comparar', metavar='ARCHIVO.json',
+                            help="Comparar contra resultados guardados con --guardar.")
+
+    def handle(self, *args, **options):
+        if options['pares'] < 1:
+            raise CommandError("--pares debe ser al menos 1.")
+        anterior = None
+        if options['comparar']:
+            try:
+                with open(options['comparar'], encoding='utf-8') as f:
+                    anterior = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"No se pudo leer {options['comparar']}: {e}")
+
+        rng = np.random.default_rng(options['semilla'])
+        ruido = NIVELES_RUIDO[options['ruido']]
+        self.stdout.write(f"Generando {options['pares']} pares de hojas (ruido '{options['ruido']}')...")
+        pares = []
+        for _ in range(options['pares']):
+            # Se miden desde JPEG, como llegan del escáner: incluye la decodificación
+            pares.append(tuple(
+                (cv2.imencode('.jpg', hoja.imagen, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes(), hoja)
+                for hoja in generar_par(rng, ruido, aruco=options['alineacion'] == 'aruco')
+            ))
+
+        reporte = {
+            'fecha': timezone.now().isoformat(timespec='seconds'),
+            'commit': _commit_actual(),
+            'configuracion': {
+                'pares': options['pares'], 'ruido': options['ruido'],
+                'semilla': options['semilla'],
+                'alineacion': options['alineacion'],
+            },
+            'resultados': {},
+        }
+        for funcion in options['funciones'] or FUNCIONES:
+            self.stdout.write(f"Midiendo {funcion}...")
+            reporte['resultados'][funcion] = medir(funcion, pares, options['alineacion'])
+
+        self._imprimir(reporte)
+        if anterior:
+            self._comparar(anterior, reporte)
+
+        if options['guardar']:
+            with open(options['guardar'], 'w', encoding='utf-8') as f:
+                json.dump(reporte, f, indent=2, ensure_ascii=False)
+            self.stdout.write(self.style.SUCCESS(f"Resultados guardados en {options['guardar']}"))
+
+    def _imprimir(self, reporte):
+        for funcion, r in reporte['resultados'].items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f"\n{funcion}"))
+            lat = r['latencia_ms']
+            self.stdout.write(
+                f"  {r['hojas']} hojas · {r['hojas_por_segundo']} hojas/s · "
+                f"latencia p50 {lat['p50']} ms, p90 {lat['p90']} ms, p99 {lat['p99']} ms · "
+                f"memoria pico {r['memoria_pico_mb']} MB"
+            )
+            por_sesion = ", ".join(f"{m} {v:.2%}" for m, v in r['exactitud_por_sesion'].items())
+            self.stdout.write(
+                f"  exactitud por ítem {r['exactitud']:.2%} ({por_sesion}) · "
+                f"hojas con longitud correcta {r['hojas_longitud_correcta']}/{r['hojas']}"
+            )
+            if 'items_dudosos' in r:
+                self.stdout.write(
+                    f"  ítems a revisión {r['items_dudosos']:.2%} · "
+                    f"errores que no quedaron como dudosos {r['errores_no_dudosos']}"
+                )
+            if 'hojas_coordenadas_fijas' in r:
+                self.stdout.write(
+                    f"  coordenadas fijas en {r['hojas_coordenadas_fijas']} hojas"
+                    + (f" · alineadas con ArUco {r['hojas_alineadas_aruco']}" if r.get('hojas_alineadas_aruco') else "")
+                    + (f" · bajo el umbral de calidad {r['hojas_bajo_umbral_calidad']}" if r.get('hojas_bajo_umbral_calidad') else "")
+                )
+            for etapa, p in r['etapas_ms'].items():
+                self.stdout.write(f"    {etapa:<12} p50 {p['p50']:>8} ms   p90 {p['p90']:>8} ms   p99 {p['p99']:>8} ms")
+
+    def _comparar(self, anterior, reporte):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"\nComparación contra {anterior.get('commit') or 'corrida anterior'} ({anterior.get('fecha')})"
+        ))
+        if anterior.get('configuracion') != reporte['configuracion']:
+            self.stdout.write(self.style.WARNING(
+                f"  Configuración distinta: {anterior.get('configuracion')} vs {reporte['configuracion']}"
+            ))
+        for funcion, r in reporte['resultados'].items():
+            previo = anterior.get('resultados', {}).get(funcion)
+            if not previo:
+                continue
+            self.stdout.write(f"  {funcion}")
+            filas = [
+                ('hojas/s', previo['hojas_por_segundo'], r['hojas_por_segundo'], True),
+                ('latencia p50 ms', previo['latencia_ms']['p50'], r['latencia_ms']['p50'], False),
+                ('latencia p90 ms', previo['latencia_ms']['p90'], r['latencia_ms']['p90'], False),
+                ('memoria pico MB', previo['memoria_pico_mb'], r['memoria_pico_mb'], False),
+                ('exactitud', previo['exactitud'], r['exactitud'], True),
+            ]
+            for etapa, p in r['etapas_ms'].items():
+                if etapa in previo['etapas_ms']:
+                    filas.append((f"{etapa} p50 ms", previo['etapas_ms'][etapa]['p50'], p['p50'], False))
+            for nombre, antes, ahora, mayor_mejor in filas:
+                cambio = (ahora - antes) / antes if antes else 0.0
+                mejora = cambio > 0 if mayor_mejor else cambio < 0
+                estilo = self.style.SUCCESS if mejora else (self.style.ERROR if abs(cambio) > 0.05 else str)
+                self.stdout.write(f"    {nombre:<20} {antes:>10} → {ahora:<10} {estilo(f'{cambio:+.1%}')}")
@@ -0,0 +1,228 @@
+import csv
+import json
+import os
+import tarfile
+import time
+import zipfile
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from academico.models import Alumno, Grupo
+from simulacros.calificacion import calificar_lote, secuencias_leidas
+from simulacros.cola_omr import encolar_lote, procesar_pendientes
+from simulacros.escaneos import es_escaneo, hojas_de_archivos
+from simulacros.models import LoteOMR, Simulacro
+from simulacros.omr_paralelo import calcular_workers, crear_pool
+
+
+class Command(BaseCommand):
+    help = (
+        "Califica sin navegador una carpeta o archivo comprimido (.zip, .tar, .tar.gz) "
+        "con los escaneos de un simulacro: encola las hojas como un lote, corre el OMR "
+        "en un pool de procesos, califica a los alumnos con las dos hojas bien leídas "
+        "y escribe un reporte JSON con fallas y tiempos. Las hojas se asignan por el "
+        "orden del grupo (--grupo), por un CSV (--mapeo) o por su código QR (--qr)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('ruta', help="Carpeta o archivo .zip/.tar con las imágenes, PDF o TIFF.")
+        parser.add_argument('--simulacro', type=int, required=True, help="ID del simulacro.")
+        parser.add_argument('--fecha', required=True, help="Fecha de realización (AAAA-MM-DD).")
+        asignacion = parser.add_mutually_exclusive_group(required=True)
+        asignacion.add_argument('--grupo', type=int,
+                                help="ID del grupo: dos hojas por alumno, en orden de apellidos.")
+        asignacion.add_argument('--mapeo', metavar='ARCHIVO.csv',
+                                help="CSV con columnas archivo, identificacion, sesion y opcional pagina (desde 1).")
+        asignacion.add_argument('--qr', action='store_true',
+                                help="Hojas personalizadas: alumno y sesión se leen del QR.")
+        parser.add_argument('--detectar-sesion', action='store_true',
+                            help="Con --grupo: decidir S1/S2 por el formato de cada hoja "
+                                 "(requiere OMR_SESION_AUTOMATICA).")
+        parser.add_argument('--usuario', help="Usuario que queda como registrador.")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Procesos OMR en paralelo (por defecto OMR_MAX_WORKERS).")
+        parser.add_argument('--sin-calificar', action='store_true',
+                            help="Solo leer: el lote queda pendiente de revisión en la web.")
+        parser.add_argument('--reporte', metavar='ARCHIVO.json',
+                            help="Dónde escribir el reporte (por defecto, la salida estándar).")
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        try:
+            simulacro = Simulacro.objects.get(pk=options['simulacro'])
+        except Simulacro.DoesNotExist:
+            raise CommandError(f"No existe el simulacro {options['simulacro']}.")
+        registrador = None
+        if options['usuario']:
+            registrador = get_user_model().objects.filter(username=options['usuario']).first()
+            if registrador is None:
+                raise CommandError(f"No existe el usuario '{options['usuario']}'.")
+
+        if options['detectar_sesion'] and not settings.OMR_SESION_AUTOMATICA:
+            raise CommandError("La detección automática de sesión está desactivada (OMR_SESION_AUTOMATICA).")
+
+        archivos = self._archivos(options['ruta'])
+        if not archivos:
+            raise CommandError(f"No hay escaneos en {options['ruta']}.")
+        try:
+            hojas = hojas_de_archivos(archivos)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        grupo, alumnos, asignaciones = None, [], None
+        if options['grupo']:
+            grupo = Grupo.objects.filter(pk=options['grupo']).first()
+            if grupo is None:
+                raise CommandError(f"No existe el grupo {options['grupo']}.")
+            alumnos = list(Alumno.objects.filter(grupo_actual=grupo)
+                           .order_by('primer_apellido', 'segundo_apellido'))
+            if len(hojas) != len(alumnos) * 2:
+                raise CommandError(f"La cantidad de hojas ({len(hojas)}) no coincide con el doble "
+                                   f"de alumnos del grupo ({len(alumnos) * 2}).")
+            sesiones = ('', '') if options['detectar_sesion'] else ('S1', 'S2')
+            asignaciones = [(alumno, sesion) for alumno in alumnos for sesion in sesiones]
+        elif options['mapeo']:
+            asignaciones, alumnos = self._asignar_por_csv(options['mapeo'], hojas)
+        else:
+            asignaciones = [(None, '')] * len(hojas)
+
+        self._avisar(f"Encolando {len(hojas)} hojas de {len(archivos)} archivos...")
+        lote = encolar_lote(simulacro, hojas, asignaciones, options['fecha'], grupo=grupo,
+                            alumnos=alumnos, registrador=registrador)
+        for archivo in archivos:
+            archivo.close()
+
+        self._procesar(lote, options['workers'])
+        lote.refresh_from_db()
+        duracion_omr = time.perf_counter() - inicio
+
+        respuestas, pendientes = secuencias_leidas(lote)
+        calificados, errores = [], {}
+        if not options['sin_calificar']:
+            self._avisar(f"Calificando {len(respuestas)} alumnos...")
+            calificados, errores = calificar_lote(simulacro, respuestas, lote.fecha_realizacion, registrador)
+            if not pendientes and not errores:
+                lote.estado = LoteOMR.ESTADO_CALIFICADO
+                lote.fecha_calificacion = timezone.now()
+                lote.save(update_fields=['estado', 'fecha_calificacion'])
+
+        reporte = self._reporte(lote, calificados, {**pendientes, **errores}, duracion_omr,
+                                time.perf_counter() - inicio)
+        texto = json.dumps(reporte, indent=2, ensure_ascii=False, default=str)
+        if options['reporte']:
+            with open(options['reporte'], 'w', encoding='utf-8') as f:
+                f.write(texto)
+        else:
+            self.stdout.write(texto)
+        self._avisar(
+            f"Lote {lote.pk}: {reporte['hojas']} hojas, {len(reporte['hojas_con_error'])} con error, "
+            f"{len(calificados)} alumnos calificados, {len(reporte['alumnos_sin_calificar'])} sin calificar "
+            f"({reporte['tiempos']['total_s']}s).",
+            estilo=self.style.SUCCESS,
+        )
+
+    def _avisar(self, mensaje, estilo=None):
+        # El progreso va a stderr para que stdout quede solo con el reporte JSON
+        self.stderr.write(estilo(mensaje) if estilo else mensaje)
+
+    def _archivos(self, ruta):
+        """Escaneos de la carpeta o del comprimido, como File de Django, en orden de nombre."""
+        if os.path.isdir(ruta):
+            nombres = sorted(n for n in os.listdir(ruta) if es_escaneo(n))
+            return [File(open(os.path.join(ruta, n), 'rb'), name=n) for n in nombres]
+        if zipfile.is_zipfile(ruta):
+            with zipfile.ZipFile(ruta) as z:
+                nombres = sorted(n for n in z.namelist() if es_escaneo(n) and not n.endswith('/'))
+                return [ContentFile(z.read(n), name=os.path.basename(n)) for n in nombres]
+        if os.path.isfile(ruta) and tarfile.is_tarfile(ruta):
+            with tarfile.open(ruta) as t:
+                miembros = sorted((m for m in t.getmembers() if m.isfile() and es_escaneo(m.name)),
+                                  key=lambda m: m.name)
+                return [ContentFile(t.extractfile(m).read(), name=os.path.basename(m.name)) for m in miembros]
+        raise CommandError(f"{ruta} no es una carpeta ni un archivo .zip/.tar.")
+
+    def _asignar_por_csv(self, ruta, hojas):
+        """
+        Asignación de cada hoja según el CSV (archivo, identificacion, sesion,
+        pagina). Retorna (asignaciones, alumnos en el orden del CSV).
+        """
+        with open(ruta, newline='', encoding='utf-8-sig') as f:
+            filas = list(csv.DictReader(f))
+        if not filas or not {'archivo', 'identificacion'} <= set(filas[0]):
+            raise CommandError("El CSV debe tener al menos las columnas 'archivo' e 'identificacion'.")
+
+        por_documento = {
+            a.identificacion: a
+            for a in Alumno.objects.filter(identificacion__in={f['identificacion'].strip() for f in filas})
+        }
+        mapeo, alumnos = {}, {}
+        for n, fila in enumerate(filas, start=2):
+            alumno = por_documento.get(fila['identificacion'].strip())
+            if alumno is None:
+                raise CommandError(f"CSV línea {n}: no hay un alumno con identificación {fila['identificacion']}.")
+            sesion = (fila.get('sesion') or '').strip().upper()
+            if sesion not in ('', 'S1', 'S2'):
+                raise CommandError(f"CSV línea {n}: sesión '{sesion}' inválida (S1, S2 o vacía).")
+            if not sesion and not settings.OMR_SESION_AUTOMATICA:
+                raise CommandError(f"CSV línea {n}: falta la sesión (la detección automática está "
+                                   f"desactivada, OMR_SESION_AUTOMATICA).")
+            pagina = (fila.get('pagina') or '').strip()
+            mapeo[(fila['archivo'].strip(), int(pagina) - 1 if pagina else None)] = (alumno, sesion)
+            alumnos.setdefault(alumno.pk, alumno)
+
+        asignaciones, faltan = [], []
+        for archivo, pagina in hojas:
+            asignacion = mapeo.get((archivo.name, pagina))
+            if asignacion is None:
+                faltan.append(archivo.name + (f" (página {pagina + 1})" if pagina is not None else ''))
+            asignaciones.append(asignacion)
+        if faltan:
+            raise CommandError(f"{len(faltan)} hojas no aparecen en el CSV: {', '.join(faltan[:10])}")
+        return asignaciones, list(alumnos.values())
+
+    def _procesar(self, lote, workers):
+        """
+        Corre la cola hasta que el lote termine. Si hay un `procesar_omr`
+        corriendo, también toma tareas de este lote y aquí solo se espera.
+        """
+        workers = calcular_workers(lote.tareas.count(), workers or settings.OMR_MAX_WORKERS)
+        # Con un solo proceso las hojas se leen aquí mismo, como en procesar_hojas
+        with (crear_pool(workers) if workers > 1 else nullcontext()) as pool:
+            while LoteOMR.objects.filter(pk=lote.pk, estado=LoteOMR.ESTADO_PROCESANDO).exists():
+                if procesar_pendientes(max_workers=workers, pool=pool):
+                    terminadas, total = lote.progreso()
+                    self._avisar(f"  {terminadas}/{total} hojas")
+                else:
+                    time.sleep(1)
+
+    def _reporte(self, lote, calificados, sin_calificar, duracion_omr, duracion_total):
+        hojas_con_error = [
+            {'tarea': t.pk, 'archivo': t.nombre_original,
+             'pagina': t.pagina + 1 if t.pagina is not None else None,
+             'alumno': t.alumno_id, 'sesion': t.sesion, 'error': t.error}
+            for t in lote.tareas.exclude(error='')
+        ]
+        resumen = lote.resumen_metricas()
+        return {
+            'lote': lote.pk,
+            'simulacro': lote.simulacro_id,
+            'estado': lote.estado,
+            'hojas': resumen['hojas'],
+            'alumnos_calificados': sorted(r.alumno_id for r in calificados),
+            'alumnos_sin_calificar': [
+                {'alumno': alumno_id, 'motivo': motivo} for alumno_id, motivo in sorted(sin_calificar.items())
+            ],
+            'hojas_con_error': hojas_con_error,
+            'tiempos': {
+                'omr_s': round(duracion_omr, 2),
+                'total_s': round(duracion_total, 2),
+                'hojas_por_segundo': round(resumen['hojas'] / duracion_omr, 2) if duracion_omr else None,
+            },
+            'metricas': resumen,
+        }
@@ -0,0 +1,52 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from simulacros.cola_omr import liberar_tareas_colgadas, procesar_pendientes
+from simulacros.omr_paralelo import calcular_workers, crear_pool
+
+
+class Command(BaseCommand):
+    help = (
+        "Worker de la cola OMR: procesa las hojas subidas (TareaOMR pendientes) "
+        "en un pool de procesos. Se puede correr más de uno a la vez."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Procesos OMR en paralelo (por defecto OMR_MAX_WORKERS).")
+        parser.add_argument('--intervalo', type=float, default=3.0,
+                            help="Segundos de espera cuando la cola está vacía.")
+        parser.add_argument('--una-vez', action='store_true',
+                            help="Vaciar la cola y terminar en lugar de quedarse esperando.")
+        parser.add_argument('--minutos-colgada', type=int, default=30,
+                            help="Tareas en 'procesando' por más de estos minutos se reintentan.")
+
+    def handle(self, *args, **options):
+        max_workers = options['workers'] or settings.OMR_MAX_WORKERS
+        workers = calcular_workers(max_workers, max_workers)
+        self.stdout.write(f"Worker OMR iniciado con {workers} procesos.")
+
+        liberadas = liberar_tareas_colgadas(options['minutos_colgada'])
+        if liberadas:
+            self.stdout.write(self.style.WARNING(f"{liberadas} tareas colgadas devueltas a la cola."))
+
+        total = 0
+        with crear_pool(workers) as pool:
+            try:
+                while True:
+                    inicio = time.perf_counter()
+                    procesadas = procesar_pendientes(max_workers=workers, pool=pool)
+                    if procesadas:
+                        total += procesadas
+                        seg = time.perf_counter() - inicio
+                        self.stdout.write(f"{procesadas} hojas en {seg:.1f}s ({procesadas / seg:.1f} hojas/s)")
+                        continue
+                    if options['una_vez']:
+                        break
+                    time.sleep(options['intervalo'])
+            except KeyboardInterrupt:
+                self.stdout.write("Deteniendo worker OMR...")
+
+        self.stdout.write(self.style.SUCCESS(f"Total procesadas: {total} hojas."))
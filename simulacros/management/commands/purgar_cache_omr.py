@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Sum
+
+from simulacros import cache_omr
+from simulacros.models import CacheOMR
+
+
+class Command(BaseCommand):
+    help = (
+        "Limpia la caché de resultados OMR: borra las entradas de versiones "
+        "anteriores del OMR y recorta el resto a OMR_CACHE_MAX_MB (o a --max-mb), "
+        "empezando por las usadas hace más tiempo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--todo', action='store_true',
+                            help="Vaciar la caché completa.")
+        parser.add_argument('--max-mb', type=float, default=None,
+                            help="Tamaño al que se recorta (por defecto OMR_CACHE_MAX_MB).")
+
+    def handle(self, *args, **options):
+        if options['max_mb'] is not None and options['max_mb'] < 0:
+            raise CommandError("--max-mb no puede ser negativo.")
+        max_bytes = None if options['max_mb'] is None else int(options['max_mb'] * 2**20)
+
+        borradas, liberados = cache_omr.purgar(todo=options['todo'], max_bytes=max_bytes)
+        quedan = CacheOMR.objects.aggregate(entradas=Count('id'), total=Sum('tamano'))
+        self.stdout.write(self.style.SUCCESS(
+            f"{borradas} entradas borradas ({liberados / 2**20:.1f} MB). "
+            f"Quedan {quedan['entradas']} ({(quedan['total'] or 0) / 2**20:.1f} MB)."
+        ))
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from simulacros import cola_omr, recortes_omr
+
+
+class Command(BaseCommand):
+    help = (
+        "Borra los recortes de tiras guardados para la revisión OMR de los lotes "
+        "subidos hace más de OMR_RECORTES_DIAS días (o --dias), los escaneos de "
+        "los lotes calificados hace más de OMR_HOJAS_DIAS días (o --dias-hojas), "
+        "y los que quedaron de lotes eliminados."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=None,
+                            help="Días que se conservan los recortes (por defecto OMR_RECORTES_DIAS).")
+        parser.add_argument('--dias-hojas', type=int, default=None,
+                            help="Días que se conservan los escaneos tras calificar (por defecto OMR_HOJAS_DIAS).")
+
+    def handle(self, *args, **options):
+        dias = settings.OMR_RECORTES_DIAS if options['dias'] is None else options['dias']
+        dias_hojas = settings.OMR_HOJAS_DIAS if options['dias_hojas'] is None else options['dias_hojas']
+        if dias < 0 or dias_hojas < 0:
+            raise CommandError("--dias y --dias-hojas no pueden ser negativos.")
+        borrados = recortes_omr.purgar(dias)
+        self.stdout.write(self.style.SUCCESS(f"{borrados} recortes borrados (lotes de hace más de {dias} días)."))
+        hojas = cola_omr.purgar_hojas(dias_hojas)
+        self.stdout.write(self.style.SUCCESS(
+            f"{hojas} escaneos borrados (lotes calificados hace más de {dias_hojas} días)."))
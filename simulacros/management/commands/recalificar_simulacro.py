@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from simulacros.models import Simulacro
+from simulacros.recalificacion import COMPONENTES, TAMANO_BLOQUE, recalificar
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula los resultados guardados de un simulacro con su clave, cortes "
+        "y componentes actuales, a partir de las respuestas ya guardadas. Al "
+        "guardar esos campos en el admin se hace solo si el simulacro tiene "
+        "hasta MAX_RECALIFICAR_EN_LINEA resultados; esto sirve para "
+        "simulacros grandes o para corregir datos antiguos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('simulacro', type=int, help="ID del simulacro.")
+        parser.add_argument('--componentes', nargs='+', choices=COMPONENTES,
+                            help="Recalcular solo estos componentes (por defecto, todos).")
+        parser.add_argument('--bloque', type=int, default=TAMANO_BLOQUE,
+                            help="Resultados leídos y escritos por vuelta.")
+
+    def handle(self, *args, **options):
+        try:
+            simulacro = Simulacro.objects.get(pk=options['simulacro'])
+        except Simulacro.DoesNotExist:
+            raise CommandError(f"No existe el simulacro {options['simulacro']}.")
+
+        def progreso(hechos, total):
+            self.stdout.write(f"  {hechos}/{total} resultados")
+
+        cambiados = recalificar(simulacro, options['componentes'], progreso=progreso,
+                                tamano_bloque=options['bloque'])
+        self.stdout.write(self.style.SUCCESS(f"{cambiados} resultados de '{simulacro}' cambiaron."))
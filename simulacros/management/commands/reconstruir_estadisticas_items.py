@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from simulacros.estadisticas_items import reconstruir
+from simulacros.models import EstadisticaItem, Simulacro
+
+
+class Command(BaseCommand):
+    help = (
+        "Rehace desde cero las estadísticas por pregunta (EstadisticaItem) a "
+        "partir de los resultados guardados. Al calificar y al cambiar alumnos "
+        "de grupo se mantienen solas; esto sirve para resultados o alumnos "
+        "modificados por fuera de la aplicación (queryset.update, SQL directo)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--simulacro', type=int, help="ID de un simulacro (por defecto, todos).")
+
+    def handle(self, *args, **options):
+        simulacros = Simulacro.objects.order_by('pk')
+        if options['simulacro']:
+            simulacros = simulacros.filter(pk=options['simulacro'])
+            if not simulacros.exists():
+                raise CommandError(f"No existe el simulacro {options['simulacro']}.")
+
+        for simulacro in simulacros:
+            reconstruir(simulacro)
+            filas = EstadisticaItem.objects.filter(simulacro=simulacro).count()
+            self.stdout.write(f"  {simulacro}: {filas} filas")
+        self.stdout.write(self.style.SUCCESS("Estadísticas por pregunta reconstruidas."))
@@ -0,0 +1,100 @@
+import time
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from simulacros.carpeta_escaneos import (
+    ESPERA_DEFECTO, MAX_PENDIENTES_DEFECTO, CarpetaEscaneos, crear_observador,
+)
+from simulacros.cola_omr import liberar_tareas_colgadas, procesar_pendientes
+from simulacros.models import Simulacro
+from simulacros.omr_paralelo import calcular_workers, crear_pool
+
+
+class Command(BaseCommand):
+    help = (
+        "Vigila la carpeta donde los escáneres de red dejan los archivos y los "
+        "procesa sin pasar por la web: encola cada escaneo cuando termina de "
+        "escribirse, lo lee en un pool de procesos, califica a los alumnos con "
+        "sus dos hojas leídas y deja el archivo en procesados/ o fallidos/. "
+        "Las hojas deben llevar el QR del alumno."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('carpeta', help="Carpeta compartida donde escriben los escáneres.")
+        parser.add_argument('--simulacro', type=int, required=True, help="ID del simulacro.")
+        parser.add_argument('--fecha', default=None,
+                            help="Fecha de realización (AAAA-MM-DD); por defecto, el día en que se encola.")
+        parser.add_argument('--usuario', help="Usuario que queda como registrador.")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Procesos OMR en paralelo (por defecto OMR_MAX_WORKERS).")
+        parser.add_argument('--espera', type=float, default=ESPERA_DEFECTO,
+                            help="Segundos sin cambios para considerar que un archivo terminó de escribirse.")
+        parser.add_argument('--max-pendientes', type=int, default=MAX_PENDIENTES_DEFECTO,
+                            help="Archivos encolados a la vez; el resto espera en la carpeta.")
+        parser.add_argument('--intervalo', type=float, default=3.0,
+                            help="Segundos entre revisiones cuando no hay inotify o no hay trabajo.")
+        parser.add_argument('--una-vez', action='store_true',
+                            help="Procesar lo que ya está en la carpeta y terminar.")
+
+    def handle(self, *args, **options):
+        try:
+            simulacro = Simulacro.objects.get(pk=options['simulacro'])
+        except Simulacro.DoesNotExist:
+            raise CommandError(f"No existe el simulacro {options['simulacro']}.")
+        registrador = None
+        if options['usuario']:
+            registrador = get_user_model().objects.filter(username=options['usuario']).first()
+            if registrador is None:
+                raise CommandError(f"No existe el usuario '{options['usuario']}'.")
+
+        carpeta = CarpetaEscaneos(
+            options['carpeta'], simulacro, espera=options['espera'],
+            max_pendientes=options['max_pendientes'], fecha_realizacion=options['fecha'],
+            registrador=registrador,
+        )
+        observador = None if options['una_vez'] else crear_observador(carpeta.ruta)
+        max_workers = options['workers'] or settings.OMR_MAX_WORKERS
+        workers = calcular_workers(max_workers, max_workers)
+        self.stdout.write(
+            f"Vigilando {carpeta.ruta} ({'inotify' if observador else 'sondeo'}) "
+            f"para '{simulacro}' con {workers} procesos."
+        )
+
+        liberadas = liberar_tareas_colgadas()
+        if liberadas:
+            self.stdout.write(self.style.WARNING(f"{liberadas} tareas colgadas devueltas a la cola."))
+
+        # Con un solo proceso las hojas se leen aquí mismo, como en procesar_hojas
+        with (crear_pool(workers) if workers > 1 else nullcontext()) as pool:
+            try:
+                while True:
+                    informe = carpeta.revisar()
+                    self._informar(informe)
+                    if procesar_pendientes(max_workers=workers, pool=pool):
+                        continue
+                    if not carpeta.pendientes() and options['una_vez']:
+                        break
+                    if observador:
+                        # Despierta con el próximo archivo, o a tiempo de ver si
+                        # los que están escribiéndose ya terminaron
+                        observador.esperar(max(options['espera'], options['intervalo']))
+                    else:
+                        time.sleep(options['intervalo'])
+            except KeyboardInterrupt:
+                self.stdout.write("Deteniendo la vigilancia de escaneos...")
+            finally:
+                if observador:
+                    observador.cerrar()
+
+    def _informar(self, informe):
+        if informe['encolados']:
+            self.stdout.write(f"Encolados: {', '.join(informe['encolados'])}")
+        if informe['procesados'] or informe['calificados']:
+            self.stdout.write(self.style.SUCCESS(
+                f"Procesados: {len(informe['procesados'])} archivos, {informe['calificados']} alumnos calificados."
+            ))
+        for nombre in informe['fallidos']:
+            self.stdout.write(self.style.ERROR(f"Falló: {nombre} (ver fallidos/)"))
@@ -0,0 +1,61 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('academico', '0036_alter_alumno_tipo_programa'),
+        ('simulacros', '0007_simulacro_boost_max_simulacro_boost_min_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoteOMR',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha_realizacion', models.DateField(verbose_name='Fecha de realización')),
+                ('alumnos', models.JSONField(default=list, help_text='IDs de los alumnos en el orden en que se asignaron las hojas.', verbose_name='Alumnos en orden')),
+                ('estado', models.CharField(choices=[('procesando', 'Procesando'), ('revision', 'Pendiente de revisión'), ('calificado', 'Calificado')], default='procesando', max_length=20, verbose_name='Estado')),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_calificacion', models.DateTimeField(blank=True, null=True)),
+                ('grupo', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='lotes_omr', to='academico.grupo', verbose_name='Grupo')),
+                ('registrador', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='lotes_omr', to=settings.AUTH_USER_MODEL, verbose_name='Registrador')),
+                ('simulacro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lotes_omr', to='simulacros.simulacro', verbose_name='Simulacro')),
+            ],
+            options={
+                'verbose_name': 'Lote OMR',
+                'verbose_name_plural': 'Lotes OMR',
+                'ordering': ['-fecha_creacion'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TareaOMR',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sesion', models.CharField(choices=[('S1', 'Sesión 1'), ('S2', 'Sesión 2')], max_length=2, verbose_name='Sesión')),
+                ('orden', models.PositiveIntegerField(default=0, verbose_name='Orden en el lote')),
+                ('archivo', models.FileField(upload_to='omr/hojas/%Y/%m/%d/', verbose_name='Imagen escaneada')),
+                ('nombre_original', models.CharField(blank=True, max_length=255, verbose_name='Nombre del archivo')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('procesando', 'Procesando'), ('completada', 'Completada'), ('error', 'Error')], default='pendiente', max_length=20, verbose_name='Estado')),
+                ('tiras', models.JSONField(blank=True, default=list, verbose_name='Tiras extraídas')),
+                ('error', models.TextField(blank=True, verbose_name='Error')),
+                ('intentos', models.PositiveIntegerField(default=0, verbose_name='Intentos')),
+                ('fecha_inicio', models.DateTimeField(blank=True, null=True)),
+                ('fecha_fin', models.DateTimeField(blank=True, null=True)),
+                ('duracion', models.FloatField(blank=True, null=True, verbose_name='Duración (s)')),
+                ('alumno', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tareas_omr', to='academico.alumno', verbose_name='Alumno')),
+                ('lote', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tareas', to='simulacros.loteomr', verbose_name='Lote')),
+            ],
+            options={
+                'verbose_name': 'Tarea OMR',
+                'verbose_name_plural': 'Tareas OMR',
+                'ordering': ['lote', 'orden'],
+                'indexes': [models.Index(fields=['estado', 'fecha_inicio'], name='simulacros__estado_08af3e_idx')],
+            },
+        ),
+    ]
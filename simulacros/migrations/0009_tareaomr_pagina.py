@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulacros', '0008_lote_omr'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tareaomr',
+            name='pagina',
+            field=models.PositiveIntegerField(blank=True, help_text='Índice (desde 0) de la página dentro de un PDF/TIFF multipágina. Vacío si el archivo es una sola imagen.', null=True, verbose_name='Página'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulacros', '0009_tareaomr_pagina'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tareaomr',
+            name='metricas',
+            field=models.JSONField(blank=True, default=dict, help_text='Tiempos por etapa, motor usado, rectángulos y burbujas detectadas por tira.', verbose_name='Métricas OMR'),
+        ),
+    ]
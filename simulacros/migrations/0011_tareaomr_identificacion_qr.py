@@ -0,0 +1,25 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('academico', '0036_alter_alumno_tipo_programa'),
+        ('simulacros', '0010_tareaomr_metricas'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tareaomr',
+            name='alumno',
+            field=models.ForeignKey(blank=True, help_text='Vacío si la hoja se identifica por su código QR al procesarla.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tareas_omr', to='academico.alumno', verbose_name='Alumno'),
+        ),
+        migrations.AlterField(
+            model_name='tareaomr',
+            name='sesion',
+            field=models.CharField(blank=True, choices=[('S1', 'Sesión 1'), ('S2', 'Sesión 2')], max_length=2, verbose_name='Sesión'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.3 on 2026-10-18 13:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulacros', '0011_tareaomr_identificacion_qr'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tareaomr',
+            name='hash_contenido',
+            field=models.CharField(blank=True, db_index=True, help_text='Del archivo o de la página del PDF/TIFF; se calcula al procesarla.', max_length=64, verbose_name='SHA-256 de la hoja'),
+        ),
+        migrations.CreateModel(
+            name='CacheOMR',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash_contenido', models.CharField(max_length=64, verbose_name='SHA-256 de la hoja')),
+                ('modo', models.CharField(blank=True, help_text="Sesión con que se leyó, 'QR' si se identificó por código o vacío si se detectó la sesión.", max_length=2, verbose_name='Modo')),
+                ('version', models.CharField(max_length=60, verbose_name='Versión del OMR')),
+                ('tiras', models.JSONField(default=list, verbose_name='Tiras extraídas')),
+                ('metricas', models.JSONField(default=dict, verbose_name='Métricas OMR')),
+                ('tamano', models.PositiveIntegerField(default=0, verbose_name='Tamaño (bytes)')),
+                ('usos', models.PositiveIntegerField(default=0, verbose_name='Usos')),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('ultimo_uso', models.DateTimeField(auto_now_add=True, verbose_name='Último uso')),
+            ],
+            options={
+                'verbose_name': 'Caché OMR',
+                'verbose_name_plural': 'Caché OMR',
+                'indexes': [models.Index(fields=['ultimo_uso'], name='simulacros__ultimo__77297b_idx')],
+                'constraints': [models.UniqueConstraint(fields=('hash_contenido', 'modo', 'version'), name='cache_omr_hoja_unica')],
+            },
+        ),
+    ]
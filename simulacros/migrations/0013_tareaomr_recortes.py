@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 13:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulacros', '0012_cache_omr'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tareaomr',
+            name='recortes',
+            field=models.JSONField(blank=True, default=dict, help_text='Archivo de la imagen de cada tira, para la revisión (ver simulacros/recortes_omr.py).', verbose_name='Recortes de las tiras'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.3 on 2026-10-18 13:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('academico', '0036_alter_alumno_tipo_programa'),
+        ('simulacros', '0013_tareaomr_recortes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadisticaItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sesion', models.CharField(choices=[('S1', 'Sesión 1'), ('S2', 'Sesión 2')], max_length=2)),
+                ('item', models.PositiveSmallIntegerField(verbose_name='Pregunta')),
+                ('intentos', models.IntegerField(default=0, verbose_name='Alumnos con la sesión completa')),
+                ('correctas', models.IntegerField(default=0)),
+                ('blancos', models.IntegerField(default=0, verbose_name='En blanco o doble marca (Z)')),
+                ('opcion_a', models.IntegerField(default=0)),
+                ('opcion_b', models.IntegerField(default=0)),
+                ('opcion_c', models.IntegerField(default=0)),
+                ('opcion_d', models.IntegerField(default=0)),
+                ('opcion_e', models.IntegerField(default=0)),
+                ('opcion_f', models.IntegerField(default=0)),
+                ('opcion_g', models.IntegerField(default=0)),
+                ('opcion_h', models.IntegerField(default=0)),
+                ('grupo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='academico.grupo')),
+                ('simulacro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='estadisticas_items', to='simulacros.simulacro')),
+            ],
+            options={
+                'verbose_name': 'Estadística de pregunta',
+                'verbose_name_plural': 'Estadísticas de preguntas',
+                'unique_together': {('simulacro', 'grupo', 'sesion', 'item')},
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+from collections import Counter
+
+from django.db import migrations
+
+LETRAS = 'ABCDEFGH'
+
+
+def poblar(apps, schema_editor):
+    """
+    Llena EstadisticaItem con los resultados ya calificados, agrupados por el
+    grupo actual del alumno (lo mismo que estadisticas_items.reconstruir, con
+    los modelos históricos).
+    """
+    ResultadoSimulacro = apps.get_model('simulacros', 'ResultadoSimulacro')
+    Simulacro = apps.get_model('simulacros', 'Simulacro')
+    EstadisticaItem = apps.get_model('simulacros', 'EstadisticaItem')
+
+    simulacro_ids = ResultadoSimulacro.objects.values_list('simulacro_id', flat=True).distinct()
+    for simulacro in Simulacro.objects.filter(pk__in=simulacro_ids):
+        claves = {'S1': simulacro.soluciones_s1 or '', 'S2': simulacro.soluciones_s2 or ''}
+        conteos = {}
+        filas = ResultadoSimulacro.objects.filter(simulacro=simulacro).values_list(
+            'alumno__grupo_actual_id', 'respuestas_s1', 'respuestas_s2')
+        for grupo, s1, s2 in filas.iterator():
+            if not grupo:
+                continue
+            for sesion, respuestas in (('S1', s1 or ''), ('S2', s2 or '')):
+                clave = claves[sesion]
+                if not clave or len(respuestas) != len(clave):
+                    continue
+                for item, (respuesta, correcta) in enumerate(zip(respuestas, clave), 1):
+                    conteo = conteos.setdefault((grupo, sesion, item), Counter())
+                    conteo['intentos'] += 1
+                    if respuesta == 'Z':
+                        conteo['blancos'] += 1
+                    elif respuesta in LETRAS:
+                        conteo[f'opcion_{respuesta.lower()}'] += 1
+                        if respuesta == correcta:
+                            conteo['correctas'] += 1
+        EstadisticaItem.objects.bulk_create(
+            [EstadisticaItem(simulacro=simulacro, grupo_id=grupo, sesion=sesion, item=item, **conteo)
+             for (grupo, sesion, item), conteo in conteos.items()],
+            batch_size=500,
+        )
+
+
+def vaciar(apps, schema_editor):
+    apps.get_model('simulacros', 'EstadisticaItem').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulacros', '0014_estadisticaitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(poblar, vaciar),
+    ]
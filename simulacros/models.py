@@ -152,3 +152,255 @@ class ResultadoSimulacro(models.Model):
         if self.respuestas_s1 and self.respuestas_s2:
             return "Calificado"
         return "Incompleto"
+
+
+class EstadisticaItem(models.Model):
+    """
+    Conteo de las respuestas a una pregunta de un simulacro en un grupo. Se
+    mantiene al guardar resultados (ver estadisticas_items.py); las cifras de
+    una sede o del simulacro completo son la suma de sus grupos.
+    """
+    simulacro = models.ForeignKey(Simulacro, on_delete=models.CASCADE, related_name="estadisticas_items")
+    grupo = models.ForeignKey('academico.Grupo', on_delete=models.CASCADE, related_name="+")
+    sesion = models.CharField(max_length=2, choices=[('S1', 'Sesión 1'), ('S2', 'Sesión 2')])
+    item = models.PositiveSmallIntegerField(verbose_name="Pregunta")
+    intentos = models.IntegerField(default=0, verbose_name="Alumnos con la sesión completa")
+    correctas = models.IntegerField(default=0)
+    blancos = models.IntegerField(default=0, verbose_name="En blanco o doble marca (Z)")
+    opcion_a = models.IntegerField(default=0)
+    opcion_b = models.IntegerField(default=0)
+    opcion_c = models.IntegerField(default=0)
+    opcion_d = models.IntegerField(default=0)
+    opcion_e = models.IntegerField(default=0)
+    opcion_f = models.IntegerField(default=0)
+    opcion_g = models.IntegerField(default=0)
+    opcion_h = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Estadística de pregunta"
+        verbose_name_plural = "Estadísticas de preguntas"
+        unique_together = ('simulacro', 'grupo', 'sesion', 'item')
+
+    def __str__(self):
+        return f"{self.simulacro} {self.sesion}-{self.item} ({self.grupo_id})"
+
+
+class LoteOMR(models.Model):
+    """
+    Lote de hojas subidas para un grupo. Reemplaza al batch que antes se guardaba
+    en request.session: las hojas se procesan en segundo plano (comando
+    `procesar_omr`) y la revisión lee de aquí.
+    """
+    ESTADO_PROCESANDO = 'procesando'
+    ESTADO_REVISION = 'revision'
+    ESTADO_CALIFICADO = 'calificado'
+    ESTADOS = [
+        (ESTADO_PROCESANDO, 'Procesando'),
+        (ESTADO_REVISION, 'Pendiente de revisión'),
+        (ESTADO_CALIFICADO, 'Calificado'),
+    ]
+
+    simulacro = models.ForeignKey(
+        Simulacro,
+        on_delete=models.CASCADE,
+        related_name="lotes_omr",
+        verbose_name="Simulacro"
+    )
+    grupo = models.ForeignKey(
+        'academico.Grupo',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="lotes_omr",
+        verbose_name="Grupo"
+    )
+    fecha_realizacion = models.DateField(verbose_name="Fecha de realización")
+    alumnos = models.JSONField(
+        default=list,
+        verbose_name="Alumnos en orden",
+        help_text="IDs de los alumnos en el orden en que se asignaron las hojas."
+    )
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=ESTADO_PROCESANDO, verbose_name="Estado")
+    registrador = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="lotes_omr",
+        verbose_name="Registrador"
+    )
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_calificacion = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Lote OMR"
+        verbose_name_plural = "Lotes OMR"
+        ordering = ['-fecha_creacion']
+
+    def __str__(self):
+        return f"Lote {self.pk} - {self.simulacro} ({self.get_estado_display()})"
+
+    def progreso(self):
+        """Retorna (tareas terminadas, total de tareas)."""
+        total = self.tareas.count()
+        terminadas = self.tareas.filter(estado__in=TareaOMR.ESTADOS_FINALES).count()
+        return terminadas, total
+
+    def resumen_metricas(self):
+        """
+        Agrega las métricas OMR de las hojas terminadas del lote: duración,
+        milisegundos por etapa (promedio y p90), cuántas hojas salieron de la
+        caché, cuántas quedaron bajo los umbrales del control de calidad (y
+        cuántas se rechazaron por eso) o con avisos, cuántas cayeron al deskew
+        o a las coordenadas fijas, y las hojas más lentas.
+        """
+        tareas = list(
+            self.tareas.filter(estado__in=TareaOMR.ESTADOS_FINALES)
+            .values('id', 'orden', 'estado', 'duracion', 'metricas')
+        )
+        duraciones = sorted(t['duracion'] for t in tareas if t['duracion'])
+        etapas = {}
+        for t in tareas:
+            for etapa, seg in t['metricas'].get('tiempos', {}).items():
+                etapas.setdefault(etapa, []).append(seg * 1000)
+
+        return {
+            'hojas': len(tareas),
+            'errores': sum(t['estado'] == TareaOMR.ESTADO_ERROR for t in tareas),
+            'duracion': {
+                'promedio': round(sum(duraciones) / len(duraciones), 3) if duraciones else None,
+                'p50': _percentil(duraciones, 50),
+                'p90': _percentil(duraciones, 90),
+                'max': duraciones[-1] if duraciones else None,
+            },
+            'etapas_ms': {
+                etapa: {'promedio': round(sum(ms) / len(ms), 1), 'p90': round(_percentil(sorted(ms), 90), 1)}
+                for etapa, ms in etapas.items()
+            },
+            'desde_cache': sum(bool(t['metricas'].get('cache')) for t in tareas),
+            'rechazadas_calidad': sum(bool(t['metricas'].get('calidad', {}).get('motivos'))
+                                      and t['estado'] == TareaOMR.ESTADO_ERROR for t in tareas),
+            'bajo_umbral_calidad': sum(bool(t['metricas'].get('calidad', {}).get('motivos')) for t in tareas),
+            'avisos_calidad': sum(bool(t['metricas'].get('calidad', {}).get('avisos')) for t in tareas),
+            'deskew': sum(t['metricas'].get('normalizacion') == 'deskew' for t in tareas),
+            'fallback_coordenadas': sum(bool(t['metricas'].get('fallback_coordenadas')) for t in tareas),
+            'mas_lentas': [
+                {'tarea': t['id'], 'orden': t['orden'], 'duracion': t['duracion']}
+                for t in sorted(tareas, key=lambda t: t['duracion'] or 0, reverse=True)[:5]
+            ],
+        }
+
+
+def _percentil(ordenados, p):
+    """Percentil `p` (por rango más cercano) de una lista ya ordenada; None si está vacía."""
+    if not ordenados:
+        return None
+    return ordenados[min(len(ordenados) - 1, max(0, -(-p * len(ordenados) // 100) - 1))]
+
+
+class TareaOMR(models.Model):
+    """Una hoja (S1 o S2 de un alumno) pendiente o ya procesada por el OMR."""
+    ESTADO_PENDIENTE = 'pendiente'
+    ESTADO_PROCESANDO = 'procesando'
+    ESTADO_COMPLETADA = 'completada'
+    ESTADO_ERROR = 'error'
+    ESTADOS = [
+        (ESTADO_PENDIENTE, 'Pendiente'),
+        (ESTADO_PROCESANDO, 'Procesando'),
+        (ESTADO_COMPLETADA, 'Completada'),
+        (ESTADO_ERROR, 'Error'),
+    ]
+    ESTADOS_FINALES = (ESTADO_COMPLETADA, ESTADO_ERROR)
+
+    SESIONES = [('S1', 'Sesión 1'), ('S2', 'Sesión 2')]
+
+    lote = models.ForeignKey(LoteOMR, on_delete=models.CASCADE, related_name="tareas", verbose_name="Lote")
+    alumno = models.ForeignKey(
+        'academico.Alumno',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="tareas_omr",
+        verbose_name="Alumno",
+        help_text="Vacío si la hoja se identifica por su código QR al procesarla."
+    )
+    sesion = models.CharField(max_length=2, choices=SESIONES, blank=True, verbose_name="Sesión")
+    orden = models.PositiveIntegerField(default=0, verbose_name="Orden en el lote")
+    archivo = models.FileField(upload_to='omr/hojas/%Y/%m/%d/', verbose_name="Imagen escaneada")
+    nombre_original = models.CharField(max_length=255, blank=True, verbose_name="Nombre del archivo")
+    pagina = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="Página",
+        help_text="Índice (desde 0) de la página dentro de un PDF/TIFF multipágina. Vacío si el archivo es una sola imagen."
+    )
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=ESTADO_PENDIENTE, verbose_name="Estado")
+    tiras = models.JSONField(default=list, blank=True, verbose_name="Tiras extraídas")
+    error = models.TextField(blank=True, verbose_name="Error")
+    intentos = models.PositiveIntegerField(default=0, verbose_name="Intentos")
+    fecha_inicio = models.DateTimeField(null=True, blank=True)
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+    duracion = models.FloatField(null=True, blank=True, verbose_name="Duración (s)")
+    metricas = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name="Métricas OMR",
+        help_text="Tiempos por etapa, motor usado, rectángulos y burbujas detectadas por tira."
+    )
+    hash_contenido = models.CharField(
+        max_length=64,
+        blank=True,
+        db_index=True,
+        verbose_name="SHA-256 de la hoja",
+        help_text="Del archivo o de la página del PDF/TIFF; se calcula al procesarla."
+    )
+    recortes = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name="Recortes de las tiras",
+        help_text="Archivo de la imagen de cada tira, para la revisión (ver simulacros/recortes_omr.py)."
+    )
+
+    class Meta:
+        verbose_name = "Tarea OMR"
+        verbose_name_plural = "Tareas OMR"
+        ordering = ['lote', 'orden']
+        indexes = [models.Index(fields=['estado', 'fecha_inicio'])]
+
+    def __str__(self):
+        if self.alumno_id is None:
+            return f"{self.nombre_original or 'Hoja'} sin identificar ({self.get_estado_display()})"
+        return f"{self.alumno} - {self.sesion} ({self.get_estado_display()})"
+
+
+class CacheOMR(models.Model):
+    """
+    Resultado OMR de una hoja según el hash de su contenido. Si se vuelve a
+    subir la misma imagen con la misma versión del OMR, la cola lo toma de
+    aquí en lugar de procesarla (ver simulacros/cache_omr.py).
+    """
+    hash_contenido = models.CharField(max_length=64, verbose_name="SHA-256 de la hoja")
+    modo = models.CharField(
+        max_length=2,
+        blank=True,
+        verbose_name="Modo",
+        help_text="Sesión con que se leyó, 'QR' si se identificó por código o vacío si se detectó la sesión."
+    )
+    version = models.CharField(max_length=60, verbose_name="Versión del OMR")
+    tiras = models.JSONField(default=list, verbose_name="Tiras extraídas")
+    metricas = models.JSONField(default=dict, verbose_name="Métricas OMR")
+    tamano = models.PositiveIntegerField(default=0, verbose_name="Tamaño (bytes)")
+    usos = models.PositiveIntegerField(default=0, verbose_name="Usos")
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    ultimo_uso = models.DateTimeField(auto_now_add=True, verbose_name="Último uso")
+
+    class Meta:
+        verbose_name = "Caché OMR"
+        verbose_name_plural = "Caché OMR"
+        constraints = [
+            models.UniqueConstraint(fields=['hash_contenido', 'modo', 'version'], name='cache_omr_hoja_unica'),
+        ]
+        indexes = [models.Index(fields=['ultimo_uso'])]
+
+    def __str__(self):
+        return f"{self.hash_contenido[:12]} {self.modo or '?'} ({self.version})"
@@ -0,0 +1,211 @@
+"""
+omr_paralelo.py — Reparte el OMR de un lote de hojas entre varios procesos.
+
+Cada hoja (S1 o S2 de un alumno) es una unidad de trabajo independiente:
+procesar_hoja (normalización y lectura de las burbujas).
+Las hojas se envían a un ProcessPoolExecutor con un número acotado de
+procesos y los resultados se devuelven en el mismo orden de entrada.
+
+Si un proceso hijo muere (p. ej. sin memoria) el executor queda roto
+(BrokenProcessPool): PoolOMR lo recrea y las hojas que quedaron sin
+resultado vuelven marcadas con 'pool_roto' para que la cola las reintente.
+"""
+import multiprocessing
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+
+from .procesar_simulacro import procesar_hoja
+
+# Valores por defecto si el llamador no indica otra cosa
+MAX_WORKERS_DEFECTO = 4
+TIMEOUT_HOJA_DEFECTO = 60  # segundos
+
+
+class TiempoAgotadoHoja(Exception):
+    """La hoja superó el tiempo máximo de procesamiento permitido."""
+
+
+def _alarma(signum, frame):
+    raise TiempoAgotadoHoja("Tiempo de procesamiento agotado")
+
+
+def _inicializar_worker():
+    # Cada proceso ya es un hilo de trabajo: evitamos que OpenCV abra su propio
+    # pool de hilos por proceso y sature los núcleos.
+    cv2.setNumThreads(1)
+    if hasattr(signal, 'SIGALRM'):
+        signal.signal(signal.SIGALRM, _alarma)
+
+
+def _procesar_hoja_worker(fuente, modo, usuario, timeout_hoja, alineacion=None, con_recortes=False):
+    """
+    Ejecuta procesar_hoja dentro de un proceso del pool con un límite de tiempo.
+    Nunca lanza excepciones: el error se devuelve en el diccionario.
+    """
+    inicio = time.perf_counter()
+    metricas = {}
+    recortes = {} if con_recortes else None
+    usar_alarma = bool(timeout_hoja) and hasattr(signal, 'SIGALRM')
+    try:
+        if usar_alarma:
+            signal.setitimer(signal.ITIMER_REAL, timeout_hoja)
+        try:
+            tiras = procesar_hoja(fuente, modo, user=usuario, metricas=metricas, alineacion=alineacion,
+                                  recortes=recortes)
+        finally:
+            if usar_alarma:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        error = None
+    except TiempoAgotadoHoja:
+        tiras, error = [], f"Tiempo agotado ({timeout_hoja}s)"
+    except Exception as e:
+        tiras, error = [], str(e)
+
+    resultado = {
+        'tiras': tiras,
+        'error': error,
+        'duracion': round(time.perf_counter() - inicio, 3),
+        'metricas': _redondear_metricas(metricas),
+    }
+    if con_recortes:
+        resultado['recortes'] = recortes if error is None else {}
+    return resultado
+
+
+def _redondear_metricas(metricas):
+    """Copia de `metricas` con los tiempos en segundos redondeados (se guardan en JSON)."""
+    salida = dict(metricas)
+    salida['tiempos'] = {etapa: round(seg, 4) for etapa, seg in metricas.get('tiempos', {}).items()}
+    return salida
+
+
+def calcular_workers(n_hojas, max_workers=None):
+    """Número de procesos a usar: nunca más que hojas, núcleos ni el tope configurado."""
+    tope = max_workers or MAX_WORKERS_DEFECTO
+    return max(1, min(tope, os.cpu_count() or 1, n_hojas))
+
+
+def _executor(max_workers):
+    # 'spawn' en lugar de 'fork': el pool de hilos interno de OpenCV puede
+    # quedar bloqueado en el proceso hijo si se hace fork después de usarlo.
+    contexto = multiprocessing.get_context('spawn')
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=contexto,
+                               initializer=_inicializar_worker)
+
+
+class PoolOMR:
+    """
+    Pool de procesos OMR que sobrevive a la muerte de un proceso hijo: un
+    ProcessPoolExecutor roto ya no acepta trabajo, así que reiniciar() lo
+    cambia por uno nuevo con los mismos procesos.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._executor = _executor(max_workers)
+
+    def submit(self, *args, **kwargs):
+        return self._executor.submit(*args, **kwargs)
+
+    def reiniciar(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = _executor(self.max_workers)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        return False
+
+
+def crear_pool(max_workers):
+    """
+    Crea el pool de procesos OMR (PoolOMR). Los workers de larga duración
+    (comando procesar_omr) lo crean una sola vez y lo reutilizan entre bloques.
+    """
+    return PoolOMR(max_workers)
+
+
+def procesar_hojas(hojas, max_workers=None, timeout_hoja=TIMEOUT_HOJA_DEFECTO, user=None, pool=None,
+                   alineacion=None, con_recortes=False):
+    """
+    Procesa una lista de hojas [(fuente, modo), ...] en paralelo (modo None o
+    MODO_QR para identificar la hoja, ver extraer_tiras_hoja).
+
+    Si se pasa `pool`, se usa ese pool (y no se cierra); si no, se crea uno
+    temporal con a lo sumo `max_workers` procesos. `alineacion` elige cómo se
+    normaliza cada hoja ('contorno' o 'aruco', ver matriz_normalizacion).
+
+    Retorna una lista (en el mismo orden) de dicts:
+        {'tiras': [...], 'error': None | str, 'duracion': segundos,
+         'metricas': {'tiempos': {'normalizar': segundos, ...}, ...}}
+    (ver extraer_tiras_hoja para las claves de 'metricas'). Con `con_recortes`
+    cada dict trae además 'recortes': {'C1': bytes, ...}, la imagen de cada tira.
+    Las hojas que se quedaron sin leer porque murió un proceso del pool traen
+    'pool_roto': True.
+    """
+    if not hojas:
+        return []
+
+    # Solo se envía el nombre de usuario: los objetos de Django no deben cruzar procesos
+    usuario = getattr(user, 'username', None) or (str(user) if user else None)
+
+    if pool is not None:
+        return _recolectar(pool, hojas, usuario, timeout_hoja, alineacion, con_recortes)
+
+    workers = calcular_workers(len(hojas), max_workers)
+    if workers == 1:
+        # Sin pool para lotes de una hoja o máquinas de un núcleo.
+        # El timeout por alarma solo funciona en el hilo principal de un proceso
+        # dedicado, así que aquí no se aplica.
+        return [_procesar_hoja_worker(fuente, modo, usuario, None, alineacion, con_recortes)
+                for fuente, modo in hojas]
+
+    with crear_pool(workers) as pool:
+        return _recolectar(pool, hojas, usuario, timeout_hoja, alineacion, con_recortes)
+
+
+def _sin_resultado(error, pool_roto=False):
+    resultado = {'tiras': [], 'error': error, 'duracion': 0, 'metricas': {}}
+    if pool_roto:
+        resultado['pool_roto'] = True
+    return resultado
+
+
+def _recolectar(pool, hojas, usuario, timeout_hoja, alineacion=None, con_recortes=False):
+    """
+    Envía las hojas a `pool` y espera sus resultados. Si el pool está o queda
+    roto, se reinicia y las hojas sin resultado vuelven con 'pool_roto': no
+    son un error de la hoja, la cola las reintenta.
+    """
+    def enviar(fuente, modo):
+        return pool.submit(_procesar_hoja_worker, fuente, modo, usuario, timeout_hoja, alineacion, con_recortes)
+
+    try:
+        futuros = [enviar(fuente, modo) for fuente, modo in hojas]
+    except BrokenProcessPool:
+        # Quedó roto desde el bloque anterior: uno nuevo y se vuelve a enviar
+        pool.reiniciar()
+        futuros = [enviar(fuente, modo) for fuente, modo in hojas]
+
+    resultados, roto = [], False
+    for fut in futuros:
+        try:
+            resultados.append(fut.result())
+        except BrokenProcessPool as e:
+            roto = True
+            resultados.append(_sin_resultado(f"Fallo del proceso OMR: {e}", pool_roto=True))
+        except Exception as e:
+            resultados.append(_sin_resultado(f"Fallo del proceso OMR: {e}"))
+    if roto:
+        pool.reiniciar()
+    return resultados
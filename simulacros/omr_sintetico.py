@@ -0,0 +1,214 @@
+"""
+omr_sintetico.py — Hojas de respuesta sintéticas con respuestas conocidas.
+
+Dibuja hojas S1 y S2 con la misma distribución que asumen S1_CONF / S2_CONF
+(un rectángulo por tira) y PLANTILLA_S1 / PLANTILLA_S2 (un óvalo por opción),
+marca las respuestas y luego simula el escáner o la foto: rotación,
+perspectiva, desenfoque, sombras, ruido y marcas tenues o dobles.
+
+Lo usa el comando benchmark_omr para medir velocidad y exactitud del OMR sin
+depender de hojas reales.
+
+    rng = np.random.default_rng(7)
+    hoja = generar_hoja('S1', rng, NIVELES_RUIDO['leve'])
+    hoja.imagen   # BGR, tal como saldría del escáner
+    hoja.clave    # 'ABZD...' — lo que el OMR debería leer ('Z' = blanco o doble marca)
+
+Con `alumno_id` la hoja lleva el QR de identificación en el encabezado y con
+`aruco=True` los marcadores de las esquinas, como las hojas personalizadas de
+hojas_respuesta.py. El nivel 'foto' simula una foto de celular sobre una mesa
+clara, donde el borde del papel casi no contrasta con el fondo.
+"""
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+from .procesar_simulacro import (
+    DICCIONARIO_ARUCO, LADO_ARUCO, MARCADORES_ARUCO, NORM_H, NORM_W, S1_CONF, S2_CONF,
+    ZONA_QR, codificar_identificacion, compilar_plantilla, LETRAS_OPCIONES,
+)
+
+# Parámetros de cada nivel de ruido:
+#   blancos, dobles, tenues: probabilidad por pregunta
+#   rotacion (grados) y perspectiva (fracción del lado): desviación máxima
+#   desenfoque: sigma del blur gaussiano; ruido: sigma del ruido por píxel
+#   sombra: oscurecimiento máximo (0-1) de un degradado sobre la hoja
+#   resolucion: escala del escaneo respecto a NORM_W × NORM_H (2.0 ≈ 300 dpi)
+#   fondo: rango de gris del fondo alrededor de la hoja (tapa del escáner o mesa)
+NIVELES_RUIDO = {
+    'ninguno': {
+        'blancos': 0.05, 'dobles': 0.0, 'tenues': 0.0,
+        'rotacion': 0.0, 'perspectiva': 0.0, 'desenfoque': 0.0,
+        'ruido': 0.0, 'sombra': 0.0, 'resolucion': 1.0, 'fondo': (20, 60),
+    },
+    'leve': {
+        'blancos': 0.05, 'dobles': 0.02, 'tenues': 0.05,
+        'rotacion': 1.5, 'perspectiva': 0.005, 'desenfoque': 0.8,
+        'ruido': 6.0, 'sombra': 0.15, 'resolucion': 2.0, 'fondo': (20, 60),
+    },
+    'fuerte': {
+        'blancos': 0.08, 'dobles': 0.05, 'tenues': 0.15,
+        'rotacion': 4.0, 'perspectiva': 0.02, 'desenfoque': 1.6,
+        'ruido': 14.0, 'sombra': 0.40, 'resolucion': 2.4, 'fondo': (20, 60),
+    },
+    'foto': {
+        'blancos': 0.05, 'dobles': 0.02, 'tenues': 0.05,
+        'rotacion': 8.0, 'perspectiva': 0.05, 'desenfoque': 1.0,
+        'ruido': 8.0, 'sombra': 0.30, 'resolucion': 1.8, 'fondo': (200, 235),
+    },
+}
+
+# Intensidad del relleno: lápiz normal y marca tenue
+_TONO_MARCA = (30, 70)
+_TONO_TENUE = (140, 180)
+
+
+@dataclass
+class HojaSintetica:
+    modo: str
+    imagen: np.ndarray      # escaneo simulado (BGR)
+    clave: str              # respuestas esperadas, 'Z' en blancos y dobles marcas
+    marcas: list            # por pregunta: None, índice de la opción o tupla (doble marca)
+
+
+def _tiras_conf(modo):
+    if modo == 'S1':
+        return S1_CONF, ['c1', 'c2', 'c3', 'c4']
+    return S2_CONF, ['c1', 'c2a', 'c2b', 'c3']
+
+
+def dibujar_qr(img, texto):
+    """Dibuja en ZONA_QR el código QR de `texto` (con su zona de silencio)."""
+    x, y, lado = ZONA_QR
+    qr = cv2.QRCodeEncoder.create().encode(texto)
+    qr = cv2.copyMakeBorder(qr, 4, 4, 4, 4, cv2.BORDER_CONSTANT, value=255)
+    img[y:y + lado, x:x + lado] = cv2.resize(qr, (lado, lado), interpolation=cv2.INTER_NEAREST)[..., None]
+
+
+def dibujar_aruco(img):
+    """Dibuja los marcadores MARCADORES_ARUCO en las esquinas de la hoja."""
+    diccionario = cv2.aruco.getPredefinedDictionary(DICCIONARIO_ARUCO)
+    for id_marcador, (x, y) in MARCADORES_ARUCO.items():
+        marcador = cv2.aruco.generateImageMarker(diccionario, id_marcador, LADO_ARUCO)
+        img[y:y + LADO_ARUCO, x:x + LADO_ARUCO] = marcador[..., None]
+
+
+def dibujar_hoja(modo, marcas, tonos=None, alumno_id=None, aruco=False):
+    """
+    Hoja ya normalizada (NORM_W × NORM_H, BGR) con el formato impreso de la
+    sesión y las `marcas` rellenas. `marcas` tiene un elemento por pregunta:
+    None (en blanco), el índice de la opción o una tupla de índices.
+    `tonos` opcional: intensidad (0-255) del relleno de cada pregunta.
+    `alumno_id` opcional: agrega el QR de identificación; `aruco`: los
+    marcadores de alineación de las esquinas.
+    """
+    img = np.full((NORM_H, NORM_W, 3), 255, np.uint8)
+    negro = (0, 0, 0)
+
+    cv2.putText(img, "HOJA RESPUESTA SIMULACRO", (330, 90), cv2.FONT_HERSHEY_SIMPLEX, 1.4, negro, 3)
+    cv2.putText(img, f"SESION {modo[-1]}", (540, 150), cv2.FONT_HERSHEY_SIMPLEX, 1.0, negro, 2)
+    if alumno_id is not None:
+        dibujar_qr(img, codificar_identificacion(alumno_id, modo))
+    if aruco:
+        dibujar_aruco(img)
+
+    conf, claves = _tiras_conf(modo)
+    for k in claves:
+        cv2.rectangle(img, (conf[f'{k}_x_ini'], conf[f'{k}_y_ini']),
+                      (conf[f'{k}_x_fin'], conf[f'{k}_y_fin']), negro, 3)
+
+    pregunta = 0
+    for _etq, _n, centros, (ancho, alto) in compilar_plantilla(modo):
+        ejes = (ancho // 2, alto // 2)
+        ejes_relleno = (ancho // 2 - 2, alto // 2 - 2)
+        for fila in centros:
+            marca = marcas[pregunta]
+            elegidas = marca if isinstance(marca, tuple) else (() if marca is None else (marca,))
+            tono = int(tonos[pregunta]) if tonos is not None else _TONO_MARCA[0]
+            pregunta += 1
+
+            x_num = int(fila[0][0]) - ancho - 38
+            cv2.putText(img, str(pregunta), (x_num, int(fila[0][1]) + 6),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, negro, 1)
+            for j, (cx, cy) in enumerate(fila):
+                centro = (int(round(cx)), int(round(cy)))
+                cv2.ellipse(img, centro, ejes, 0, 0, 360, negro, 2)
+                if j in elegidas:
+                    cv2.ellipse(img, centro, ejes_relleno, 0, 0, 360, (tono, tono, tono), -1)
+    return img
+
+
+def _simular_escaneo(hoja, ruido, rng):
+    """Lleva la hoja normalizada a un escaneo/foto con los defectos de `ruido`."""
+    escala = ruido['resolucion']
+    ancho, alto = int(NORM_W * escala), int(NORM_H * escala)
+    margen_x, margen_y = int(ancho * 0.05), int(alto * 0.04)
+    lienzo = (ancho + 2 * margen_x, alto + 2 * margen_y)
+
+    # Esquinas de la hoja dentro del lienzo: rotación alrededor del centro y
+    # desplazamiento aleatorio de cada vértice (perspectiva)
+    vertices = np.array([[0, 0], [ancho, 0], [ancho, alto], [0, alto]], np.float32)
+    angulo = np.deg2rad(rng.uniform(-1, 1) * ruido['rotacion'])
+    rot = np.array([[np.cos(angulo), -np.sin(angulo)], [np.sin(angulo), np.cos(angulo)]], np.float32)
+    centro = np.array([ancho / 2, alto / 2], np.float32)
+    destino = (vertices - centro) @ rot.T + centro + (margen_x, margen_y)
+    destino = (destino + rng.uniform(-1, 1, (4, 2)) * ruido['perspectiva'] * ancho).astype(np.float32)
+
+    origen = np.array([[0, 0], [NORM_W, 0], [NORM_W, NORM_H], [0, NORM_H]], np.float32)
+    matriz = cv2.getPerspectiveTransform(origen, destino)
+    fondo = np.full((lienzo[1], lienzo[0], 3), int(rng.integers(*ruido.get('fondo', (20, 60)))), np.uint8)
+    img = cv2.warpPerspective(hoja, matriz, lienzo, dst=fondo, flags=cv2.INTER_LINEAR,
+                              borderMode=cv2.BORDER_TRANSPARENT)
+
+    if ruido['sombra']:
+        # Degradado lineal en una dirección al azar (sombra de la mano o del lomo)
+        direccion = rng.uniform(0, 2 * np.pi)
+        ys, xs = np.mgrid[0:lienzo[1], 0:lienzo[0]].astype(np.float32)
+        t = xs / lienzo[0] * np.cos(direccion) + ys / lienzo[1] * np.sin(direccion)
+        t = (t - t.min()) / max(t.max() - t.min(), 1e-6)
+        img = (img * (1 - ruido['sombra'] * t)[..., None]).astype(np.uint8)
+
+    if ruido['desenfoque']:
+        img = cv2.GaussianBlur(img, (0, 0), ruido['desenfoque'] * escala)
+
+    if ruido['ruido']:
+        ruido_px = rng.normal(0, ruido['ruido'], img.shape[:2]).astype(np.float32)
+        img = np.clip(img + ruido_px[..., None], 0, 255).astype(np.uint8)
+
+    return img
+
+
+def generar_hoja(modo, rng, ruido=None, alumno_id=None, aruco=False):
+    """
+    Genera una hoja `modo` ('S1' o 'S2') con respuestas al azar y el nivel de
+    `ruido` indicado (un dict de NIVELES_RUIDO; por defecto 'ninguno').
+    Con `alumno_id` la hoja lleva el QR de identificación y con `aruco` los
+    marcadores de alineación.
+    """
+    ruido = ruido or NIVELES_RUIDO['ninguno']
+    marcas, tonos, clave = [], [], []
+    for _etq, n_opciones, centros, _tam in compilar_plantilla(modo):
+        letras = LETRAS_OPCIONES[n_opciones]
+        for _fila in centros:
+            azar = rng.random()
+            if azar < ruido['blancos']:
+                marcas.append(None)
+                clave.append('Z')
+            elif azar < ruido['blancos'] + ruido['dobles']:
+                marcas.append(tuple(int(i) for i in rng.choice(n_opciones, 2, replace=False)))
+                clave.append('Z')
+            else:
+                opcion = int(rng.integers(n_opciones))
+                marcas.append(opcion)
+                clave.append(letras[opcion])
+            tenue = rng.random() < ruido['tenues']
+            tonos.append(rng.integers(*(_TONO_TENUE if tenue else _TONO_MARCA)))
+
+    hoja = dibujar_hoja(modo, marcas, tonos, alumno_id, aruco)
+    return HojaSintetica(modo, _simular_escaneo(hoja, ruido, rng), ''.join(clave), marcas)
+
+
+def generar_par(rng, ruido=None, alumno_id=None, aruco=False):
+    """Hojas S1 y S2 de un mismo alumno."""
+    return generar_hoja('S1', rng, ruido, alumno_id, aruco), generar_hoja('S2', rng, ruido, alumno_id, aruco)
@@ -5,12 +5,23 @@ procesar_simulacro.py — Pipeline OMR por tiras verticales.
 Uso:
     python3 procesar_simulacro.py S1 imagenes_muestra/SCAN0008_page-0031.jpg
     python3 procesar_simulacro.py S2 imagenes_muestra/SCAN0008_page-0032.jpg
+
+Los PDF/TIFF multipágina del escáner no hace falta partirlos: escaneos.py
+entrega sus páginas una a una a este mismo pipeline.
 """
+import base64
+import contextlib
+import functools
+import logging
+import time
+
 import cv2
 import numpy as np
 import os
 import sys
 
+logger = logging.getLogger('simulacros.omr')
+
 # ================================================================
 # CONSTANTES DE CORTE — Ajustar si los recortes no caen bien
 # Imagen estándar: 1275 x 1650 px
@@ -59,9 +70,52 @@ S2_CONF = {
     'c3_x_ini': 830, 'c3_x_fin': 1200, 
 }
 
+# === PLANTILLA DE BURBUJAS ===
+# Con la hoja normalizada a NORM_W × NORM_H cada burbuja cae siempre en el mismo
+# lugar. La usan las hojas que se imprimen o generan (hojas_respuesta,
+# omr_sintetico) y clasificar_sesion; la lectura sigue buscando los círculos
+# con contornos. Por tira:
+# x0, y0: centro de la primera burbuja (opción A de la primera pregunta)
+# dx, dy: separación entre opciones y entre preguntas
+# ancho, alto: tamaño del óvalo impreso
+PLANTILLA_S1 = {
+    'C1': {'x0': 166, 'y0': 289, 'dx': 52.5, 'dy': 38.67, 'filas': 30, 'opciones': 4, 'ancho': 26, 'alto': 22},
+    'C2': {'x0': 455, 'y0': 289, 'dx': 50.0, 'dy': 38.67, 'filas': 30, 'opciones': 4, 'ancho': 26, 'alto': 22},
+    'C3': {'x0': 745, 'y0': 289, 'dx': 50.0, 'dy': 38.33, 'filas': 30, 'opciones': 4, 'ancho': 26, 'alto': 22},
+    'C4': {'x0': 1037, 'y0': 289, 'dx': 55.0, 'dy': 38.67, 'filas': 30, 'opciones': 4, 'ancho': 26, 'alto': 22},
+}
+
+PLANTILLA_S2 = {
+    'C1': {'x0': 145, 'y0': 225, 'dx': 50.0, 'dy': 30.44, 'filas': 45, 'opciones': 4, 'ancho': 22, 'alto': 20},
+    'C2a': {'x0': 394, 'y0': 215, 'dx': 47.5, 'dy': 30.0, 'filas': 34, 'opciones': 4, 'ancho': 22, 'alto': 20},
+    'C2b': {'x0': 408, 'y0': 1235, 'dx': 46.9, 'dy': 30.0, 'filas': 10, 'opciones': 8, 'ancho': 22, 'alto': 20},
+    'C3': {'x0': 853, 'y0': 235, 'dx': 46.25, 'dy': 29.56, 'filas': 45, 'opciones': 8, 'ancho': 22, 'alto': 20},
+}
+
+# Versión de la lectura: subirla cuando un cambio del pipeline (plantillas,
+# umbrales, formato de las tiras) haga que la misma hoja se lea distinto, para
+# que la caché de resultados (cache_omr.py) no entregue lecturas viejas.
+VERSION_OMR = 2
+
+# Sesión automática: cada plantilla se puntúa por el contraste entre la tinta
+# en el contorno de sus burbujas y la de los huecos entre ellas (una de cada
+# PASO_FILAS_SESION filas, desplazamientos de 4 px). La hoja es de la sesión
+# ganadora si su contraste supera MIN_CONTRASTE_SESION y duplica al de la otra.
+# Solo se usa con OMR_SESION_AUTOMATICA, que sigue apagado hasta confirmarlo
+# con escaneos_referencia/.
+PASO_FILAS_SESION = 3
+MIN_CONTRASTE_SESION = 0.08
+
 # Umbral de relleno para considerar un círculo como marcado
 # Al evaluar solo el "adentro" del círculo, un valor más bajo detecta marcas tenues
 UMBRAL_MARCADO = 0.25
+# Ventaja mínima de la opción más llena sobre la segunda; si no la tiene es doble marca
+SEPARACION_MARCA = 0.10
+# Una pregunta cuya lectura cambiaría moviendo el relleno menos que esto
+# (ver margen_filas) se considera dudosa y pasa a revisión humana con el
+# recorte de sus burbujas; las demás no se muestran. Ajustado con hojas
+# sintéticas: confirmarlo con escaneos_referencia/.
+MARGEN_DUDA = 0.10
 
 # ================================================================
 
@@ -69,6 +123,69 @@ UMBRAL_MARCADO = 0.25
 NORM_W = 1275
 NORM_H = 1650
 
+# Lado mayor del nivel de la pirámide donde se busca el contorno de la hoja
+LADO_MAX_DETECCION = 1000
+
+# Alineación de la hoja: 'contorno' busca el borde del papel (escáner);
+# 'aruco' usa los marcadores impresos en las esquinas de las hojas
+# personalizadas (fotos de celular sobre una mesa, donde el borde del papel no
+# se distingue) y, si no los ve, vuelve al contorno.
+ALINEACION_OMR = 'contorno'
+# Marcadores DICT_4X4_50: id → esquina superior izquierda (x, y) en la hoja
+# normalizada, todos de LADO_ARUCO px. Bastan MIN_MARCADORES_ARUCO para la homografía.
+DICCIONARIO_ARUCO = cv2.aruco.DICT_4X4_50
+LADO_ARUCO = 56
+MARCADORES_ARUCO = {0: (20, 20), 1: (1199, 20), 2: (1199, 1574), 3: (20, 1574)}
+MIN_MARCADORES_ARUCO = 3
+
+# Control de calidad previo al OMR, sobre el nivel reducido de la pirámide.
+# Por debajo de los umbrales MIN_/MAX_ la hoja se rechaza sin leerla (hay que
+# volver a escanearla); entre esos y los AVISO_ se lee pero queda marcada.
+# Los umbrales aún no se han medido con escaneos reales: mientras
+# RECHAZAR_ILEGIBLES sea False, la hoja bajo un MIN_/MAX_ también se lee y
+# sus motivos solo quedan marcados en metricas['calidad'] para la revisión.
+#   nitidez:   varianza del laplaciano dentro de la hoja
+#   tinta:     gris del 1 % más oscuro de la hoja (sube si está sobreexpuesta)
+#   papel:     gris del percentil 95 (baja si está subexpuesta)
+#   cobertura: fracción del escaneo que ocupa la hoja
+#   proporción: ancho/alto de la hoja, si no llena todo el escaneo (recortes)
+CONTROL_CALIDAD = True
+RECHAZAR_ILEGIBLES = False
+MIN_NITIDEZ, AVISO_NITIDEZ = 8, 40
+MAX_TINTA, AVISO_TINTA = 150, 100
+MIN_PAPEL, AVISO_PAPEL = 60, 120
+MIN_COBERTURA = 0.40
+TOLERANCIA_PROPORCION = 0.10
+
+# Recortes de cada tira para la revisión (recortes_omr.py): escala respecto a
+# la hoja normalizada y calidad WebP (JPEG si OpenCV no trae WebP). A la mitad
+# las marcas tenues todavía se distinguen y una tira ocupa de 5 a 25 KB.
+ESCALA_RECORTE = 0.5
+CALIDAD_RECORTE = 30
+
+LETRAS_OPCIONES = {4: ['A', 'B', 'C', 'D'], 8: ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']}
+
+# Longitudes exactas esperadas por tira
+LONGITUDES_ESPERADAS = {
+    'S1': {'C1': 30, 'C2': 30, 'C3': 30, 'C4': 30},
+    'S2': {'C1': 45, 'C2a': 34, 'C2b': 10, 'C3': 45},
+}
+
+ETIQUETAS_S1 = ['C1', 'C2', 'C3', 'C4']
+ETIQUETAS_S2 = ['C1', 'C2a', 'C2b', 'C3']
+
+# Modos especiales de extraer_tiras_hoja: None detecta la sesión por el
+# formato de la hoja; MODO_QR además lee el alumno del código QR.
+MODO_QR = 'QR'
+
+# Identificación por QR: las hojas personalizadas (hojas_respuesta.py) llevan
+# en el encabezado "SIM:<alumno_id>:<S1|S2>". ZONA_QR es el cuadro (x, y, lado)
+# donde se imprime, en coordenadas de la hoja normalizada; se busca en toda la
+# franja superior hasta ALTO_ENCABEZADO (las tiras empiezan más abajo).
+PREFIJO_QR = 'SIM'
+ZONA_QR = (1010, 15, 170)
+ALTO_ENCABEZADO = 200
+
 
 def _ordenar_esquinas(pts):
     """
@@ -85,90 +202,200 @@ def _ordenar_esquinas(pts):
     ], dtype=np.float32)
 
 
-def normalizar_hoja(img, debug_dir=None, base=None):
+# Destino de la normalización: los 4 vértices del tamaño estándar
+_DESTINO_HOJA = np.array([
+    [0,      0     ],
+    [NORM_W, 0     ],
+    [NORM_W, NORM_H],
+    [0,      NORM_H],
+], dtype=np.float32)
+
+
+def _nivel_piramide(gray):
     """
-    Detecta los 4 vértices de la hoja escaneada y aplica warpPerspective
-    para producir SIEMPRE una imagen de NORM_W × NORM_H píxeles.
+    Baja el escaneo por la pirámide (pyrDown, mitad por nivel) hasta que el
+    lado mayor no supere LADO_MAX_DETECCION. Retorna (imagen_reducida, escala).
+    """
+    reducida, escala = gray, 1.0
+    while max(reducida.shape[:2]) > LADO_MAX_DETECCION:
+        reducida = cv2.pyrDown(reducida)
+        escala /= 2
+    return reducida, escala
+
 
-    Si no puede detectar la hoja (fondo sin contraste, imagen muy ruidosa),
-    cae en un simple recorte centrado con deskew para no romper el flujo.
+def _detectar_esquinas(gray):
+    """
+    Vértices [tl, tr, br, bl] de la hoja dentro del escaneo en gris, o None
+    si no se distingue la hoja del fondo.
 
-    Parámetros de debug opcionales:
-      debug_dir — carpeta donde guardar imagen diagnóstica
-      base      — prefijo del nombre de archivo
+    La hoja se busca en un nivel reducido de la pirámide (el contorno de una
+    hoja no necesita 300 dpi) y las esquinas encontradas se afinan a subpíxel
+    sobre el escaneo completo.
     """
-    h_img, w_img = img.shape[:2]
+    reducida, escala = _nivel_piramide(gray)
+    h_img, w_img = reducida.shape[:2]
 
-    # 1. Convertir a escala de grises y suavizar
-    gray  = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    blur  = cv2.GaussianBlur(gray, (5, 5), 0)
+    # 1. Suavizar
+    blur  = cv2.GaussianBlur(reducida, (5, 5), 0)
 
     # 2. Umbralización adaptativa para separar hoja del fondo
     #    El fondo del escáner suele ser negro/gris oscuro; la hoja es blanca.
     _, thresh = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
 
     # 3. Operaciones morfológicas para cerrar pequeños huecos
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (15, 15))
+    #    (15×15 en el escaneo completo, proporcional en el nivel reducido)
+    lado = max(3, int(round(15 * escala)) | 1)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (lado, lado))
     closed = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
 
     # 4. Encontrar contornos y quedarnos con el más grande (la hoja)
     contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     if not contours:
-        return _fallback_deskew(img)
+        return None
 
     hoja_cnt = max(contours, key=cv2.contourArea)
 
     # La hoja debe ocupar al menos el 40 % de la imagen
     if cv2.contourArea(hoja_cnt) < 0.40 * w_img * h_img:
-        return _fallback_deskew(img)
+        return None
 
     # 5. Aproximar a polígono cuadrilátero
     peri  = cv2.arcLength(hoja_cnt, True)
     approx = cv2.approxPolyDP(hoja_cnt, 0.02 * peri, True)
 
     if len(approx) == 4:
-        esquinas = _ordenar_esquinas(approx)
-    else:
-        # Si no sale exactamente 4 puntos, usamos el bounding rect
-        x, y, w, h = cv2.boundingRect(hoja_cnt)
-        esquinas = np.array([
-            [x,     y    ],
-            [x + w, y    ],
-            [x + w, y + h],
-            [x,     y + h],
-        ], dtype=np.float32)
-
-    # 6. Destino: los 4 vértices del tamaño estándar
-    dst = np.array([
-        [0,      0     ],
-        [NORM_W, 0     ],
-        [NORM_W, NORM_H],
-        [0,      NORM_H],
-    ], dtype=np.float32)
+        return _afinar_esquinas(gray, _ordenar_esquinas(approx) / escala, escala)
 
-    # 7. Perspectiva y warp
-    M   = cv2.getPerspectiveTransform(esquinas, dst)
-    out = cv2.warpPerspective(img, M, (NORM_W, NORM_H),
-                              flags=cv2.INTER_CUBIC,
-                              borderMode=cv2.BORDER_REPLICATE)
+    # Si no sale exactamente 4 puntos, usamos el bounding rect
+    x, y, w, h = cv2.boundingRect(hoja_cnt)
+    return np.array([
+        [x,     y    ],
+        [x + w, y    ],
+        [x + w, y + h],
+        [x,     y + h],
+    ], dtype=np.float32) / escala
+
+
+def _afinar_esquinas(gray, esquinas, escala):
+    """
+    Lleva las esquinas halladas en el nivel reducido a precisión subpíxel en
+    el escaneo completo. La ventana cubre el error del nivel reducido (unos
+    pocos píxeles por cada mitad de reducción); si el refinamiento se escapa
+    de ella (esquina doblada o sin contraste) se conserva la esquina gruesa.
+    """
+    if escala >= 1.0:
+        radio = 5
+    else:
+        radio = int(np.ceil(2 / escala)) + 2
+    finas = cv2.cornerSubPix(
+        gray, esquinas.reshape(-1, 1, 2).astype(np.float32).copy(), (radio, radio), (-1, -1),
+        (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01),
+    ).reshape(-1, 2)
+    movidas = np.linalg.norm(finas - esquinas, axis=1) > radio
+    finas[movidas] = esquinas[movidas]
+    return finas.astype(np.float32)
+
+
+@functools.lru_cache(maxsize=1)
+def _detector_aruco():
+    parametros = cv2.aruco.DetectorParameters()
+    parametros.cornerRefinementMethod = cv2.aruco.CORNER_REFINE_SUBPIX
+    # En el nivel reducido cada marcador mide ~30 px: dos ventanas de umbral
+    # (en vez de tres) y descartar de entrada los contornos que no pueden ser
+    # un marcador deja la detección en unos pocos milisegundos.
+    parametros.adaptiveThreshWinSizeMin = 13
+    parametros.adaptiveThreshWinSizeMax = 33
+    parametros.adaptiveThreshWinSizeStep = 20
+    parametros.minMarkerPerimeterRate = 0.05
+    parametros.maxMarkerPerimeterRate = 0.5
+    return cv2.aruco.ArucoDetector(cv2.aruco.getPredefinedDictionary(DICCIONARIO_ARUCO), parametros)
+
+
+def _puntos_aruco(gray):
+    """
+    Esquinas de los marcadores ArUco de la hoja en el escaneo y su posición
+    en la hoja normalizada: (origen (N, 2), destino (N, 2)), o None si se ven
+    menos de MIN_MARCADORES_ARUCO. Se buscan en el nivel reducido de la
+    pirámide, como el contorno de la hoja: a resolución completa la detección
+    cuesta cien veces más.
+    """
+    reducida, escala = _nivel_piramide(gray)
+    esquinas, ids, _rechazados = _detector_aruco().detectMarkers(reducida)
+    vistos = {}
+    for marcador, id_marcador in zip(esquinas, [] if ids is None else ids.ravel()):
+        if int(id_marcador) in MARCADORES_ARUCO:
+            vistos[int(id_marcador)] = marcador.reshape(4, 2) / escala
+    if len(vistos) < MIN_MARCADORES_ARUCO:
+        return None
+
+    destino = []
+    for id_marcador in vistos:
+        x, y = MARCADORES_ARUCO[id_marcador]
+        # Mismo orden que detectMarkers: tl, tr, br, bl
+        destino.append([[x, y], [x + LADO_ARUCO, y], [x + LADO_ARUCO, y + LADO_ARUCO], [x, y + LADO_ARUCO]])
+    origen = _afinar_esquinas(gray, np.concatenate(list(vistos.values())).astype(np.float32), escala)
+    return origen, np.array(destino, np.float32).reshape(-1, 2)
+
+
+def matriz_normalizacion(gray, alineacion=None):
+    """
+    Matriz de perspectiva 3×3 que lleva el escaneo (en gris) a NORM_W × NORM_H.
+    `alineacion`: 'contorno' o 'aruco' (por defecto ALINEACION_OMR).
+    Retorna (matriz, esquinas, metodo): `metodo` es 'aruco', 'perspectiva'
+    (contorno de la hoja) o 'deskew' (fallback, `esquinas` None).
+    """
+    if (alineacion or ALINEACION_OMR) == 'aruco':
+        puntos = _puntos_aruco(gray)
+        if puntos is not None:
+            # Homografía por mínimos cuadrados sobre las 4 esquinas de cada marcador
+            matriz, _mascara = cv2.findHomography(*puntos, 0)
+            esquinas = cv2.perspectiveTransform(_DESTINO_HOJA[None], np.linalg.inv(matriz))[0]
+            return matriz, esquinas, 'aruco'
 
-    # 8. Debug opcional: guardar imagen con esquinas marcadas
-    if debug_dir and base:
-        diag = img.copy()
-        for pt in esquinas.astype(int):
-            cv2.circle(diag, tuple(pt), 12, (0, 0, 255), -1)
-        cv2.polylines(diag, [esquinas.astype(int)], True, (0, 255, 0), 3)
-        cv2.imwrite(os.path.join(debug_dir, f"{base}_normalizacion.jpg"), diag)
+    esquinas = _detectar_esquinas(gray)
+    if esquinas is None:
+        return _matriz_deskew(gray), None, 'deskew'
+    return cv2.getPerspectiveTransform(esquinas, _DESTINO_HOJA), esquinas, 'perspectiva'
 
-    return out
 
+def aplicar_normalizacion(plano, matriz):
+    """
+    Aplica la matriz de matriz_normalizacion a un plano (gris o color) del escaneo.
 
-def _fallback_deskew(img):
+    Si la hoja ocupa en el escaneo casi el doble (o más) del tamaño estándar, como
+    en un escaneo a 300 dpi o una foto de celular, primero se baja por la
+    pirámide: el único warp interpola sobre menos píxeles y sin aliasing.
+    """
+    esquinas = cv2.perspectiveTransform(_DESTINO_HOJA[None], np.linalg.inv(matriz))[0]
+    ancho = min(np.linalg.norm(esquinas[1] - esquinas[0]), np.linalg.norm(esquinas[2] - esquinas[3]))
+    alto = min(np.linalg.norm(esquinas[3] - esquinas[0]), np.linalg.norm(esquinas[2] - esquinas[1]))
+    while ancho >= 1.8 * NORM_W and alto >= 1.8 * NORM_H:
+        # El píxel (x, y) del nivel reducido es el (2x, 2y) del anterior
+        plano = cv2.pyrDown(plano)
+        matriz = matriz @ np.diag([2.0, 2.0, 1.0])
+        ancho, alto = ancho / 2, alto / 2
+    # Con la reducción hecha por la pirámide, la interpolación lineal basta y
+    # cuesta la mitad que la cúbica sobre los 2 Mpx de salida.
+    return cv2.warpPerspective(plano, matriz, (NORM_W, NORM_H),
+                               flags=cv2.INTER_LINEAR,
+                               borderMode=cv2.BORDER_REPLICATE)
+
+
+def _guardar_debug_esquinas(img, esquinas, debug_dir, base):
+    """Guarda el escaneo con las esquinas detectadas marcadas."""
+    diag = img.copy()
+    for pt in esquinas.astype(int):
+        cv2.circle(diag, tuple(pt), 12, (0, 0, 255), -1)
+    cv2.polylines(diag, [esquinas.astype(int)], True, (0, 255, 0), 3)
+    cv2.imwrite(os.path.join(debug_dir, f"{base}_normalizacion.jpg"), diag)
+
+
+def _matriz_deskew(gray):
     """
     Fallback: corrección de ángulo leve con HoughLines cuando no se detecta
-    el contorno de la hoja. Devuelve la imagen lo más centrada posible en NORM_W×NORM_H.
+    el contorno de la hoja. Rota la imagen completa y la escala a NORM_W×NORM_H
+    para que las coordenadas sigan funcionando (en una sola matriz).
     """
-    gray  = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     edges = cv2.Canny(gray, 50, 150, apertureSize=3)
     lines = cv2.HoughLines(edges, 1, np.pi / 180, 200)
     angle = 0.0
@@ -181,31 +408,224 @@ def _fallback_deskew(img):
         if angles:
             angle = float(np.median(angles))
 
-    h, w = img.shape[:2]
+    h, w = gray.shape[:2]
+    rotacion = np.eye(3)
     if abs(angle) >= 0.3:
-        M   = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
-        img = cv2.warpAffine(img, M, (w, h),
-                             flags=cv2.INTER_CUBIC,
-                             borderMode=cv2.BORDER_REPLICATE)
+        rotacion[:2] = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
+    escala = np.diag([NORM_W / w, NORM_H / h, 1.0])
+    return escala @ rotacion
+
+
+class HojaIlegible(ValueError):
+    """La hoja no pasó el control de calidad; `motivos` lista por qué."""
 
-    # Redimensionar al tamaño estándar para que las coordenadas sigan funcionando
-    return cv2.resize(img, (NORM_W, NORM_H), interpolation=cv2.INTER_AREA)
+    def __init__(self, motivos):
+        self.motivos = motivos
+        super().__init__("Volver a escanear: " + "; ".join(motivos))
 
 
-def hacer_tiras(img, modo, user=None):
+def evaluar_calidad(gray):
     """
-    Detecta los 4 grandes rectángulos que envuelven a cada columna de opciones.
-    Devuelve la imagen recortada. Si la detección dinámica falla, utiliza las
-    coordenadas fijas (S1_CONF, S2_CONF) como fallback robusto.
+    Control rápido (unos milisegundos) de un escaneo en gris antes del OMR:
+    nitidez, exposición y cuánto del escaneo ocupa la hoja, medidos en el
+    nivel reducido de la pirámide. Retorna un dict con las medidas y las
+    listas 'motivos' (la hoja se debe rechazar) y 'avisos' (se puede leer,
+    pero conviene revisarla); ver los umbrales en CONTROL_CALIDAD.
+    """
+    reducida, _escala = _nivel_piramide(gray)
+    h_img, w_img = reducida.shape[:2]
+
+    # La hoja: envolvente de las regiones claras grandes. En una hoja cortada
+    # las tiras llegan al borde del escaneo y parten el papel en varios
+    # pedazos, así que no basta el contorno más grande de _detectar_esquinas.
+    blur = cv2.GaussianBlur(reducida, (5, 5), 0)
+    _, thresh = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    pedazos = [c for c in contours if cv2.contourArea(c) >= 0.01 * w_img * h_img]
+    if pedazos:
+        hoja_cnt = cv2.convexHull(np.concatenate(pedazos))
+        cobertura = cv2.contourArea(hoja_cnt) / (w_img * h_img)
+        x, y, w, h = cv2.boundingRect(hoja_cnt)
+    else:
+        cobertura, (x, y, w, h) = 0.0, (0, 0, w_img, h_img)
+
+    # Medidas dentro de la hoja, sin su borde (el salto hoja/fondo no es nitidez)
+    zona = reducida[y + h // 10:y + h - h // 10, x + w // 10:x + w - w // 10]
+    if zona.size == 0:
+        zona = reducida
+    acumulado = cv2.calcHist([zona], [0], None, [256], [0, 256]).ravel().cumsum()
+    acumulado /= acumulado[-1]
+    tinta = int(np.searchsorted(acumulado, 0.01))
+    papel = int(np.searchsorted(acumulado, 0.95))
+    _media, desviacion = cv2.meanStdDev(cv2.Laplacian(zona, cv2.CV_32F))
+    nitidez = float(desviacion[0, 0]) ** 2
+
+    calidad = {
+        'nitidez': round(nitidez, 1), 'tinta': tinta, 'papel': papel,
+        'cobertura': round(cobertura, 3), 'motivos': [], 'avisos': [],
+    }
+    motivos, avisos = calidad['motivos'], calidad['avisos']
+
+    if nitidez < MIN_NITIDEZ:
+        motivos.append(f"desenfocada (nitidez {nitidez:.0f} < {MIN_NITIDEZ})")
+    elif nitidez < AVISO_NITIDEZ:
+        avisos.append(f"poco nítida (nitidez {nitidez:.0f})")
+
+    if papel < MIN_PAPEL:
+        motivos.append(f"subexpuesta (papel {papel} < {MIN_PAPEL})")
+    elif papel < AVISO_PAPEL:
+        avisos.append(f"oscura (papel {papel})")
+    if tinta > MAX_TINTA:
+        motivos.append(f"sobreexpuesta (tinta {tinta} > {MAX_TINTA})")
+    elif tinta > AVISO_TINTA:
+        avisos.append(f"marcas claras (tinta {tinta})")
+
+    if cobertura < MIN_COBERTURA:
+        motivos.append(f"la hoja ocupa solo el {cobertura:.0%} de la imagen")
+    elif (x, y, w, h) != (0, 0, w_img, h_img):
+        # Si la hoja llena todo el escaneo no se ven sus bordes y la proporción
+        # sería la de la imagen; si no, una hoja cortada no tiene forma de carta.
+        (_cx, _cy), lados, _angulo = cv2.minAreaRect(hoja_cnt)
+        proporcion = min(lados) / max(lados)
+        calidad['proporcion'] = round(proporcion, 3)
+        if abs(proporcion - NORM_W / NORM_H) > TOLERANCIA_PROPORCION:
+            motivos.append(f"recortada (proporción {proporcion:.2f}, una carta es {NORM_W / NORM_H:.2f})")
+
+    return calidad
+
+
+def codificar_identificacion(alumno_id, sesion):
+    """Texto del QR de la hoja de `alumno_id` para la `sesion` ('S1' o 'S2')."""
+    return f"{PREFIJO_QR}:{int(alumno_id)}:{sesion}"
+
+
+def decodificar_identificacion(texto):
+    """(alumno_id, sesion) a partir del texto del QR, o None si no es de una hoja."""
+    partes = (texto or '').strip().split(':')
+    if len(partes) != 3 or partes[0] != PREFIJO_QR or not partes[1].isdigit() or partes[2] not in ('S1', 'S2'):
+        return None
+    return int(partes[1]), partes[2]
+
+
+@functools.lru_cache(maxsize=1)
+def _detector_qr():
+    # Uno por proceso: crear el detector cuesta más que leer una franja
+    return cv2.QRCodeDetector()
+
+
+def _enfocar(plano):
+    """Máscara de enfoque: devuelve el contraste a los módulos de un QR desenfocado."""
+    return cv2.addWeighted(plano, 2.0, cv2.GaussianBlur(plano, (0, 0), 2), -1.0, 0)
+
+
+def leer_identificacion(gray):
+    """
+    Busca el QR de identificación en el encabezado de la hoja YA normalizada:
+    primero alrededor de ZONA_QR, luego al doble de resolución (módulos de
+    pocos píxeles) y por último en toda la franja superior.
+    Retorna (alumno_id, sesion) o None.
+    """
+    franja = _enfocar(gray[:ALTO_ENCABEZADO])
+    zona = franja[:, max(0, ZONA_QR[0] - 100):]
+    for plano in (zona, cv2.resize(zona, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC), franja):
+        texto, _puntos, _recta = _detector_qr().detectAndDecode(plano)
+        if texto:
+            return decodificar_identificacion(texto)
+    return None
+
+
+class ContextoHoja:
+    """
+    Planos de UNA hoja que comparten todas las etapas del OMR, calculados una
+    sola vez: el escaneo se pasa a gris y se normaliza, y sobre la hoja
+    normalizada se calculan (al primer uso) la binaria del threshold adaptativo
+    y su imagen integral. Las etapas recortan de aquí en lugar de recalcular.
+    Con CONTROL_CALIDAD y RECHAZAR_ILEGIBLES, un escaneo que no pasa
+    evaluar_calidad lanza HojaIlegible antes de normalizarse.
+
+    `metricas` reúne lo que cada etapa reporta de la hoja (ver extraer_tiras_hoja);
+    `tiempos` (= metricas['tiempos']) acumula los segundos de cada etapa.
+    `alineacion`: ver matriz_normalizacion.
+    """
+
+    def __init__(self, escaneo=None, metricas=None, alineacion=None):
+        self.escaneo = escaneo
+        self.metricas = {} if metricas is None else metricas
+        self.tiempos = self.metricas.setdefault('tiempos', {})
+        self.matriz = None
+        self.esquinas = None
+        self.gray = None
+        if escaneo is not None:
+            with self.medir('gris'):
+                gray = cv2.cvtColor(escaneo, cv2.COLOR_BGR2GRAY) if escaneo.ndim == 3 else escaneo
+            if CONTROL_CALIDAD:
+                # Antes de normalizar: una hoja ilegible no gasta el resto del pipeline
+                with self.medir('calidad'):
+                    self.metricas['calidad'] = evaluar_calidad(gray)
+                if RECHAZAR_ILEGIBLES and self.metricas['calidad']['motivos']:
+                    raise HojaIlegible(self.metricas['calidad']['motivos'])
+            with self.medir('normalizar'):
+                self.matriz, self.esquinas, metodo = matriz_normalizacion(gray, alineacion)
+                self.gray = aplicar_normalizacion(gray, self.matriz)
+            self.metricas['normalizacion'] = metodo
+
+
+    @classmethod
+    def desde_normalizada(cls, img, metricas=None):
+        """Contexto de una imagen que ya está en NORM_W × NORM_H."""
+        ctx = cls(metricas=metricas)
+        ctx.gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+        ctx.img = img
+        return ctx
+
+    @contextlib.contextmanager
+    def medir(self, etapa):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.tiempos[etapa] = self.tiempos.get(etapa, 0.0) + time.perf_counter() - inicio
+
+    @functools.cached_property
+    def img(self):
+        """Hoja normalizada en color; solo la usan los recortes de debug."""
+        return aplicar_normalizacion(self.escaneo, self.matriz)
+
+    @functools.cached_property
+    def binaria(self):
+        with self.medir('binarizar'):
+            return binarizar(self.gray)
+
+    @functools.cached_property
+    def integral(self):
+        binaria = self.binaria
+        with self.medir('integral'):
+            return cv2.integral(binaria)
+
+
+def cortar_tiras(ctx, modo, user=None):
+    """
+    Recorta las tiras de la sesión sobre un ContextoHoja, sin volver a
+    binarizar. Retorna [(tira_gris, tira_binaria, n_opciones, etiqueta), ...],
+    recortes (vistas, sin copia) de los planos compartidos de la hoja.
+    """
+    binaria = ctx.binaria
+    with ctx.medir('tiras'):
+        ubicadas = ubicar_tiras(binaria, modo, user=user, metricas=ctx.metricas)
+    return [
+        (ctx.gray[y1:y2, x1:x2], ctx.binaria[y1:y2, x1:x2], n_opciones, etiqueta)
+        for (x1, y1, x2, y2), n_opciones, etiqueta in ubicadas
+    ]
+
+
+def ubicar_tiras(imgThresh, modo, user=None, metricas=None):
+    """
+    Ubica las 4 tiras de la sesión sobre la binaria de la hoja normalizada.
+    Retorna [((x1, y1, x2, y2), n_opciones, etiqueta), ...].
+
+    Si se pasa `metricas`, se anotan ahí los rectángulos detectados y si se
+    usaron las coordenadas fijas de S1_CONF / S2_CONF.
     """
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    
-    # Threshold adaptativo para resaltar trazos negros (como los rectángulos) sobre fondo blanco
-    imgThresh = cv2.adaptiveThreshold(
-        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-        cv2.THRESH_BINARY_INV, 51, 10
-    )
-    
     # Unir líneas rotas por el escáner o deterioro
     kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5))
     imgThresh_closed = cv2.morphologyEx(imgThresh, cv2.MORPH_CLOSE, kernel)
@@ -240,7 +660,6 @@ def hacer_tiras(img, modo, user=None):
                         })
 
     # Ordenar candidatos de izquierda a derecha, y de arriba a abajo si están apilados (ej. 2a y 2b)
-    import functools
     def cmp_rects(r1, r2):
         if abs(r1['x'] - r2['x']) > 100:
             return r1['x'] - r2['x']
@@ -318,16 +737,21 @@ def hacer_tiras(img, modo, user=None):
     candidatos = sorted(candidatos, key=functools.cmp_to_key(cmp_rects))
 
     username_str = getattr(user, 'username', None) or (str(user) if user and str(user) else 'Nadie')
-    print(f"  📐 Rectángulos detectados por usuario [{username_str}]: {len(candidatos)} (esperados: 4)")
+    logger.debug("Rectángulos detectados por usuario [%s]: %d (esperados: 4)", username_str, len(candidatos))
     for i, r in enumerate(candidatos):
-        print(f"     #{i+1}: x={r['x']}, y={r['y']}, w={r['w']}, h={r['h']}, area={r['area']}")
+        logger.debug("  #%d: x=%d, y=%d, w=%d, h=%d, area=%d", i + 1, r['x'], r['y'], r['w'], r['h'], r['area'])
+
+    fallback = len(candidatos) < 4
+    if metricas is not None:
+        metricas['rectangulos'] = len(candidatos)
+        metricas['fallback_coordenadas'] = fallback
 
     tiras_out = []
 
     # ======== FALLBACK A COORDENADAS FIJAS SI NO ENCONTRÓ LOS 4 ========
-    if len(candidatos) < 4:
-        print(f"⚠️ ADVERTENCIA: Solo se encontraron {len(candidatos)} rectángulos dinámicos.")
-        print(f"✅ Usando coordenadas de fallback para {modo} en su lugar.")
+    if fallback:
+        logger.warning("Solo se encontraron %d rectángulos de tira [%s]; usando coordenadas fijas de %s.",
+                       len(candidatos), username_str, modo)
         
         if modo == 'S1':
             keys = ['c1', 'c2', 'c3', 'c4']
@@ -339,8 +763,7 @@ def hacer_tiras(img, modo, user=None):
         for k in keys:
             y_ini, y_fin = conf[f'{k}_y_ini'], conf[f'{k}_y_fin']
             x_ini, x_fin = conf[f'{k}_x_ini'], conf[f'{k}_x_fin']
-            tira = img[y_ini:y_fin, x_ini:x_fin]
-            tiras_out.append(tira)
+            tiras_out.append((x_ini, y_ini, x_fin, y_fin))
     else:
         # Si hay más de 4 (raro después del filtro IoU), quedarse con los 4 primeros
         if len(candidatos) > 4:
@@ -352,12 +775,11 @@ def hacer_tiras(img, modo, user=None):
             # Recorte directo 2D (sin deformar, la hoja ya está recta)
             pad = 12
             y1 = max(0, y - pad)
-            y2 = min(img.shape[0], y + h + pad)
+            y2 = min(imgThresh.shape[0], y + h + pad)
             x1 = max(0, x - pad)
-            x2 = min(img.shape[1], x + w + pad)
+            x2 = min(imgThresh.shape[1], x + w + pad)
             
-            tira = img[y1:y2, x1:x2]
-            tiras_out.append(tira)
+            tiras_out.append((x1, y1, x2, y2))
 
     # Retornar con las configuraciones según el modo
     if modo == 'S1':
@@ -378,16 +800,18 @@ def hacer_tiras(img, modo, user=None):
     raise ValueError(f"Modo desconocido: '{modo}'. Usa 'S1' o 'S2'.")
 
 
-def encontrar_circulos_en_tira(tira, n_opciones=4):
+def encontrar_circulos_en_tira(tira, n_opciones=4, binaria=None):
     """
     Detecta contornos de círculos en una tira ya recortada.
+    Si se pasa `binaria` (el recorte de la binaria de la hoja, ver cortar_tiras)
+    no se vuelve a umbralizar la tira.
     Retorna: (imgThresh, lista_de_contornos, imagen_debug)
     """
-    gray = cv2.cvtColor(tira, cv2.COLOR_BGR2GRAY)
-    imgThresh = cv2.adaptiveThreshold(
-        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-        cv2.THRESH_BINARY_INV, 51, 10
-    )
+    if binaria is None:
+        gray = cv2.cvtColor(tira, cv2.COLOR_BGR2GRAY) if tira.ndim == 3 else tira
+        imgThresh = binarizar(gray)
+    else:
+        imgThresh = binaria
     # Usamos RETR_LIST para que el marco exterior del rectángulo no oculte los círculos
     contours, _ = cv2.findContours(imgThresh, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
 
@@ -420,7 +844,7 @@ def encontrar_circulos_en_tira(tira, n_opciones=4):
             if not es_duplicado:
                 candidatos.append({'c': c, 'w': w, 'h': h, 'x': x, 'y': y, 'cx': cx, 'cy': cy, 'area': area})
 
-    img_debug = tira.copy()
+    img_debug = tira.copy() if tira.ndim == 3 else cv2.cvtColor(tira, cv2.COLOR_GRAY2BGR)
     if not candidatos:
         return imgThresh, [], img_debug
 
@@ -443,115 +867,310 @@ def encontrar_circulos_en_tira(tira, n_opciones=4):
     return imgThresh, validos, img_debug
 
 
-def evaluar_tira(contours, imgThresh, n_opciones):
+def evaluar_tira(contours, imgThresh, n_opciones, detalle=False):
     """
     Dado el conjunto de círculos detectados en UNA tira vertical de una sola
     columna de preguntas, determina la letra marcada en cada fila.
+
+    Todas las burbujas se procesan como arrays: agrupación en filas, opción
+    más cercana, relleno (razones_relleno) y decisión (decidir_filas).
+
+    Con `detalle` retorna (letras, razones, cajas): la matriz filas × opciones
+    de rellenos y la caja (x1, y1, x2, y2) de cada fila dentro de la tira.
     """
-    LETRAS = {4: ['A', 'B', 'C', 'D'], 8: ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']}
-    letras = LETRAS[n_opciones]
+    letras = LETRAS_OPCIONES[n_opciones]
 
     if not contours:
+        return ([], np.zeros((0, n_opciones)), np.zeros((0, 4), np.int64)) if detalle else []
+
+    cajas = np.array([cv2.boundingRect(c) for c in contours], dtype=np.int64)
+    x, y, w, h = cajas.T
+    cX, cY = x + w // 2, y + h // 2
+
+    # Agrupar en filas por coordenada Y: nueva fila cuando el salto respecto
+    # a la burbuja anterior supera el 70 % de la altura de la primera
+    orden = np.argsort(cY, kind='stable')
+    x, y, w, h, cX, cY = x[orden], y[orden], w[orden], h[orden], cX[orden], cY[orden]
+    tol_y = h[0] * 0.70
+    fila = np.concatenate(([0], np.cumsum(np.abs(np.diff(cY)) >= tol_y)))
+    n_filas = int(fila[-1]) + 1
+    por_fila = np.bincount(fila, minlength=n_filas)
+
+    # Centros X esperados para cada opción: mediana de las filas completas
+    completas = np.flatnonzero(por_fila[fila] == n_opciones)
+    if completas.size:
+        completas = completas[np.lexsort((cX[completas], fila[completas]))]
+        centros = np.median(cX[completas].reshape(-1, n_opciones), axis=0)
+    else:
+        mn, mx = cX.min(), cX.max()
+        sp = (mx - mn) / (n_opciones - 1) if mx > mn else 1
+        centros = mn + sp * np.arange(n_opciones)
+    opcion = np.argmin(np.abs(cX[:, None] - centros[None, :]), axis=1)
+
+    # Recortamos el borde (15%) para evaluar SOLO el interior del círculo
+    # Esto evita que la línea negra del propio círculo sume píxeles oscuros
+    m_x, m_y = (w * 0.15).astype(np.int64), (h * 0.15).astype(np.int64)
+    razones = razones_relleno(imgThresh, np.stack([x + m_x, y + m_y, w - 2 * m_x, h - 2 * m_y], axis=1))
+
+    # Matriz filas × opciones; si dos contornos caen en la misma opción se toma el más lleno.
+    # Las filas con menos de 2 burbujas son ruido y se descartan.
+    matriz = np.zeros((n_filas, n_opciones))
+    np.maximum.at(matriz, (fila, opcion), razones)
+    validas = por_fila >= 2
+    respuestas = decidir_filas(matriz[validas], letras)
+    if not detalle:
+        return respuestas
+
+    cajas = np.empty((n_filas, 4), np.int64)
+    cajas[:, :2] = np.iinfo(np.int64).max
+    cajas[:, 2:] = 0
+    np.minimum.at(cajas[:, 0], fila, x)
+    np.minimum.at(cajas[:, 1], fila, y)
+    np.maximum.at(cajas[:, 2], fila, x + w)
+    np.maximum.at(cajas[:, 3], fila, y + h)
+    return respuestas, matriz[validas], cajas[validas]
+
+
+def decidir_filas(razones, letras):
+    """
+    Letra marcada en cada fila de la matriz `razones` (filas × opciones).
+    Una fila vale 'Z' si está en blanco o tiene doble marca.
+    """
+    razones = np.asarray(razones, dtype=np.float64)
+    if razones.size == 0:
         return []
+    ordenadas = np.sort(razones, axis=1)
+    mejor = ordenadas[:, -1]
+    segundo = ordenadas[:, -2] if razones.shape[1] > 1 else np.zeros_like(mejor)
 
-    burbujas = []
-    for c in contours:
-        x, y, w, h = cv2.boundingRect(c)
-        burbujas.append({'x': x, 'y': y, 'w': w, 'h': h,
-                         'cX': x + w // 2, 'cY': y + h // 2})
-
-    # Agrupar en filas por coordenada Y
-    burbujas = sorted(burbujas, key=lambda b: b['cY'])
-    tol_y = burbujas[0]['h'] * 0.70
-    filas, fila = [], [burbujas[0]]
-    for b in burbujas[1:]:
-        if abs(b['cY'] - fila[-1]['cY']) < tol_y:
-            fila.append(b)
-        else:
-            filas.append(fila)
-            fila = [b]
-    filas.append(fila)
-
-    # Centros X esperados para cada opción
-    filas_ok = [f for f in filas if len(f) == n_opciones]
-    if filas_ok:
-        for f in filas_ok:
-            f.sort(key=lambda b: b['cX'])
-        centros = [np.median([f[i]['cX'] for f in filas_ok]) for i in range(n_opciones)]
+    # Criterio de marcado:
+    # 1. La opción más oscura debe superar el UMBRAL_MARCADO mínimo.
+    # 2. Debe ser significativamente más oscura que la segunda opción (+10%);
+    #    si hay dos muy parecidas de oscuras, es una doble marca.
+    marcada = (mejor >= UMBRAL_MARCADO) & (mejor > segundo + SEPARACION_MARCA)
+    return np.where(marcada, np.asarray(letras)[np.argmax(razones, axis=1)], 'Z').tolist()
+
+
+def margen_filas(razones):
+    """
+    Confianza de decidir_filas en cada fila: cuánto tendría que cambiar el
+    relleno para que la lectura cambie. Es la distancia del criterio más
+    ajustado a su umbral (UMBRAL_MARCADO para la opción más llena,
+    SEPARACION_MARCA para su ventaja sobre la segunda), marcada o no.
+    """
+    razones = np.asarray(razones, dtype=np.float64)
+    if razones.size == 0:
+        return np.zeros(len(razones))
+    ordenadas = np.sort(razones, axis=1)
+    mejor = ordenadas[:, -1]
+    segundo = ordenadas[:, -2] if razones.shape[1] > 1 else np.zeros_like(mejor)
+    return np.abs(np.minimum(mejor - UMBRAL_MARCADO, mejor - segundo - SEPARACION_MARCA))
+
+
+def sumar_rects(integral, x1, y1, x2, y2):
+    """
+    Píxeles encendidos y área de los rectángulos [x1, x2) × [y1, y2) sobre la
+    imagen integral de una binaria 0/255 (cuatro lecturas por rectángulo).
+    Las coordenadas se recortan a los bordes de la imagen, como un slice.
+    """
+    alto, ancho = integral.shape[0] - 1, integral.shape[1] - 1
+    x1 = np.clip(x1, 0, ancho).astype(np.intp)
+    x2 = np.clip(x2, 0, ancho).astype(np.intp)
+    y1 = np.clip(y1, 0, alto).astype(np.intp)
+    y2 = np.clip(y2, 0, alto).astype(np.intp)
+    x2, y2 = np.maximum(x2, x1), np.maximum(y2, y1)
+    suma = (integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]) / 255.0
+    return suma, (x2 - x1) * (y2 - y1)
+
+
+def razones_relleno(binaria, rects, integral=None):
+    """
+    Fracción de píxeles encendidos de `binaria` dentro de cada rectángulo,
+    todas en una sola operación. `rects` es un array (..., 4) de (x, y, w, h);
+    retorna un array con la forma (...). Un rectángulo vacío vale 0.
+
+    Si se evalúan varios grupos de rectángulos sobre la misma binaria, se
+    puede pasar `integral` (cv2.integral(binaria)) para no recalcularla.
+    """
+    if integral is None:
+        integral = cv2.integral(binaria)
+    rects = np.asarray(rects)
+    x, y, w, h = (rects[..., i] for i in range(4))
+    suma, area = sumar_rects(integral, x, y, x + w, y + h)
+    return suma / np.maximum(area, 1)
+
+
+# ================================================================
+# PLANTILLA DE BURBUJAS
+# ================================================================
+
+@functools.lru_cache(maxsize=None)
+def compilar_plantilla(modo):
+    """
+    Convierte PLANTILLA_S1 / PLANTILLA_S2 en el mapa de coordenadas de la sesión:
+    una tupla de (etiqueta, n_opciones, centros, (ancho, alto)), donde `centros`
+    es un array (filas, opciones, 2) con el centro x, y de cada burbuja.
+    Se calcula una sola vez por proceso.
+    """
+    if modo == 'S1':
+        plantilla, etiquetas = PLANTILLA_S1, ETIQUETAS_S1
+    elif modo == 'S2':
+        plantilla, etiquetas = PLANTILLA_S2, ETIQUETAS_S2
     else:
-        xs = [b['cX'] for b in burbujas]
-        mn, mx = min(xs), max(xs)
-        sp = (mx - mn) / (n_opciones - 1) if mx > mn else 1
-        centros = [mn + sp * i for i in range(n_opciones)]
+        raise ValueError(f"Modo desconocido: '{modo}'. Usa 'S1' o 'S2'.")
 
-    # Evaluar cada fila
-    respuestas = []
-    for fila in filas:
-        if len(fila) < 2:
-            continue
-        opciones = []
-        for b in fila:
-            idx = min(range(n_opciones), key=lambda i: abs(b['cX'] - centros[i]))
-            
-            # Recortamos el borde (15%) para evaluar SOLO el interior del círculo
-            # Esto evita que la línea negra del propio círculo sume píxeles oscuros
-            m_x = int(b['w'] * 0.15)
-            m_y = int(b['h'] * 0.15)
-            roi = imgThresh[b['y']+m_y : b['y']+b['h']-m_y, b['x']+m_x : b['x']+b['w']-m_x]
-            
-            if roi.size > 0:
-                ratio = cv2.countNonZero(roi) / roi.size
-            else:
-                ratio = 0
-            opciones.append((idx, ratio))
-
-        # Ordenar opciones de la más oscura a la más clara
-        opciones.sort(key=lambda x: x[1], reverse=True)
-        mejor_idx, mejor_ratio = opciones[0]
-        segundo_ratio = opciones[1][1] if len(opciones) > 1 else 0
-
-        # Criterio de marcado:
-        # 1. La opción más oscura debe superar el UMBRAL_MARCADO mínimo.
-        # 2. Debe ser significativamente más oscura que la segunda opción (+10%).
-        if mejor_ratio >= UMBRAL_MARCADO:
-            if (mejor_ratio > segundo_ratio + 0.10):
-                respuestas.append(letras[mejor_idx] if mejor_idx < len(letras) else '?')
-            else:
-                # Si hay dos muy parecidas de oscuras, es una doble marca
-                respuestas.append('Z')
-        else:
-            # Si ninguna supera el umbral, está en blanco
-            respuestas.append('Z')
+    mapa = []
+    for etiqueta in etiquetas:
+        t = plantilla[etiqueta]
+        xs = t['x0'] + t['dx'] * np.arange(t['opciones'])
+        ys = t['y0'] + t['dy'] * np.arange(t['filas'])
+        centros = np.stack(np.meshgrid(xs, ys), axis=-1).astype(np.float32)
+        centros.setflags(write=False)
+        mapa.append((etiqueta, t['opciones'], centros, (t['ancho'], t['alto'])))
+    return tuple(mapa)
+
+
+def _rect_centrado(cx, cy, semi_w, semi_h):
+    """Esquinas (x1, y1, x2, y2) de los rectángulos con centro (cx, cy) y semiejes dados."""
+    return (np.rint(cx - semi_w), np.rint(cy - semi_h),
+            np.rint(cx + semi_w), np.rint(cy + semi_h))
+
+
+def _tinta_en_contorno(integral, centros, tam, desp):
+    """
+    Para cada desplazamiento candidato (K, 2), la densidad de tinta en el
+    anillo de cada burbuja: entre el interior (70 %) y un margen alrededor
+    (130 %) del óvalo. Retorna un array (K, n_burbujas).
+    """
+    ancho, alto = tam
+    cx = centros[..., 0].ravel()[None, :] + desp[:, 0:1]
+    cy = centros[..., 1].ravel()[None, :] + desp[:, 1:2]
+    s_ext, a_ext = sumar_rects(integral, *_rect_centrado(cx, cy, ancho * 0.65, alto * 0.65))
+    s_int, a_int = sumar_rects(integral, *_rect_centrado(cx, cy, ancho * 0.35, alto * 0.35))
+    return (s_ext - s_int) / np.maximum(a_ext - a_int, 1)
+
+
+_PASOS_SESION = np.arange(-8, 9, 4)
+_DESP_SESION = np.array([(dx, dy) for dy in _PASOS_SESION for dx in _PASOS_SESION], dtype=np.float32)
+
+
+def clasificar_sesion(integral):
+    """
+    Decide si la hoja normalizada es S1 o S2 por su formato, antes de cortar
+    tiras: en la plantilla correcta el contorno de las burbujas tiene tinta y
+    los huecos entre burbujas vecinas no (las tiras de 8 opciones y la
+    separación entre filas de S2 no caen sobre los óvalos de S1, y al revés).
+    Cuesta unos pocos milisegundos sobre la integral ya calculada.
+    Retorna (sesion o None si no hay un ganador claro, {'S1': contraste, 'S2': contraste}).
+    """
+    puntajes = {}
+    for modo in ('S1', 'S2'):
+        contrastes = []
+        for _etq, _n, centros, tam in compilar_plantilla(modo):
+            centros = centros[::PASO_FILAS_SESION]
+            anillo = _tinta_en_contorno(integral, centros, tam, _DESP_SESION).mean(axis=1)
+            mejor = int(np.argmax(anillo))
+            huecos = (centros[:, :-1] + centros[:, 1:]) / 2
+            contrastes.append(anillo[mejor] - _tinta_en_contorno(integral, huecos, tam, _DESP_SESION[mejor:mejor + 1]).mean())
+        puntajes[modo] = round(float(np.mean(contrastes)), 4)
+
+    ganadora, otra = sorted(puntajes, key=puntajes.get, reverse=True)
+    if puntajes[ganadora] < MIN_CONTRASTE_SESION or puntajes[otra] > puntajes[ganadora] / 2:
+        return None, puntajes
+    return ganadora, puntajes
+
+
+def binarizar(gray):
+    """Mismo threshold adaptativo que usan cortar_tiras y encontrar_circulos_en_tira."""
+    return cv2.adaptiveThreshold(
+        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY_INV, 51, 10
+    )
 
-    return respuestas
 
+def cargar_imagen(fuente):
+    """
+    Decodifica una hoja escaneada a una imagen BGR sin pasar por archivos temporales.
+
+    `fuente` puede ser:
+      - una ruta en disco (str / PathLike) → cv2.imread
+      - bytes, bytearray o memoryview con el archivo codificado (JPG, PNG...)
+      - un archivo abierto o subido a Django (InMemoryUploadedFile, File, BytesIO)
+      - un ndarray ya decodificado (se retorna tal cual)
+
+    Los buffers se decodifican con cv2.imdecode directamente sobre la memoria
+    recibida (np.frombuffer no copia los datos).
+    """
+    if isinstance(fuente, np.ndarray):
+        return fuente
+
+    if isinstance(fuente, (str, os.PathLike)):
+        img = cv2.imread(os.fspath(fuente))
+        if img is None:
+            raise ValueError(f"No se pudo cargar: {fuente}")
+        return img
+
+    if isinstance(fuente, (bytes, bytearray, memoryview)):
+        datos = fuente
+    elif hasattr(fuente, 'temporary_file_path'):
+        # Django ya volcó a disco los archivos grandes: leer esa copia directamente
+        return cargar_imagen(fuente.temporary_file_path())
+    else:
+        archivo = getattr(fuente, 'file', fuente)
+        if hasattr(archivo, 'getbuffer'):
+            # BytesIO (InMemoryUploadedFile): vista sobre el buffer, sin copia
+            datos = archivo.getbuffer()
+        elif hasattr(archivo, 'read'):
+            if hasattr(archivo, 'seek'):
+                archivo.seek(0)
+            datos = archivo.read()
+        else:
+            raise TypeError(f"Fuente de imagen no soportada: {type(fuente).__name__}")
 
-def procesar_imagen(image_path, modo, debug=False, user=None):
-    img = cv2.imread(image_path)
+    img = cv2.imdecode(np.frombuffer(datos, dtype=np.uint8), cv2.IMREAD_COLOR)
     if img is None:
-        raise ValueError(f"No se pudo cargar la imagen: {image_path}")
+        nombre = getattr(fuente, 'name', None) or 'buffer en memoria'
+        raise ValueError(f"No se pudo decodificar la imagen: {nombre}")
+    return img
+
+
+def procesar_imagen(image_path, modo, debug=False, user=None, metricas=None, alineacion=None):
+    """
+    Procesa una sola hoja y retorna la lista plana de respuestas.
+    `image_path` acepta cualquier fuente soportada por
+    cargar_imagen; `metricas` y `alineacion`: ver extraer_tiras_hoja.
+    """
+    metricas = {} if metricas is None else metricas
+    inicio = time.perf_counter()
+    img = cargar_imagen(image_path)
+    tiempos = metricas.setdefault('tiempos', {})
+    tiempos['decodificar'] = tiempos.get('decodificar', 0.0) + time.perf_counter() - inicio
 
     if debug:
         print(f"  Imagen cargada: {img.shape[1]}x{img.shape[0]}px")
         # Relativo al archivo .py, sin importar desde dónde se corra
         debug_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cv_prototypes", "tiras")
         os.makedirs(debug_dir, exist_ok=True)
-        base = os.path.basename(image_path).replace('.jpg', '').replace('.png', '')
+        nombre = image_path if isinstance(image_path, (str, os.PathLike)) else getattr(image_path, 'name', None)
+        base = os.path.basename(os.fspath(nombre)).replace('.jpg', '').replace('.png', '') if nombre else 'hoja'
     else:
         debug_dir = None
         base = None
 
     # Normalizar perspectiva: detecta la hoja y la estira a NORM_W × NORM_H siempre
-    img = normalizar_hoja(img, debug_dir=debug_dir, base=base)
+    ctx = ContextoHoja(img, metricas=metricas, alineacion=alineacion)
     if debug:
-        print(f"  Hoja normalizada a {img.shape[1]}x{img.shape[0]}px")
-
-    tiras = hacer_tiras(img, modo, user=user)
+        if ctx.esquinas is not None:
+            _guardar_debug_esquinas(img, ctx.esquinas, debug_dir, base)
+        print(f"  Hoja normalizada a {ctx.gray.shape[1]}x{ctx.gray.shape[0]}px")
 
     secuencia = []
-    for num, (tira_img, n_opciones, etiqueta) in enumerate(tiras, start=1):
-        imgThresh, circulos, debug_img = encontrar_circulos_en_tira(tira_img, n_opciones)
-        respuestas = evaluar_tira(circulos, imgThresh, n_opciones)
+    for num, (tira_img, tira_bin, n_opciones, etiqueta) in enumerate(cortar_tiras(ctx, modo, user=user), start=1):
+        with ctx.medir('circulos'):
+            imgThresh, circulos, debug_img = encontrar_circulos_en_tira(tira_img, n_opciones, binaria=tira_bin)
+        ctx.metricas.setdefault('burbujas', {})[etiqueta] = len(circulos)
+        with ctx.medir('evaluar'):
+            respuestas = evaluar_tira(circulos, imgThresh, n_opciones)
         secuencia.extend(respuestas)
 
         if debug:
@@ -566,23 +1185,151 @@ def procesar_imagen(image_path, modo, debug=False, user=None):
             print(f"  [{etiqueta}] {len(circulos)} círculos → {len(respuestas)} respuestas: {''.join(respuestas)}")
             print(f"    Guardado: {nombre_corte}  |  {nombre_deteccion}")
 
+    if debug:
+        print("  Tiempos por etapa: " + ", ".join(f"{k}={v * 1000:.1f}ms" for k, v in ctx.tiempos.items()))
+
     return secuencia
 
 
-# Longitudes exactas esperadas por tira
-LONGITUDES_ESPERADAS = {
-    'S1': {'C1': 30, 'C2': 30, 'C3': 30, 'C4': 30},
-    'S2': {'C1': 45, 'C2a': 34, 'C2b': 10, 'C3': 45},
-}
+def extraer_tiras_hoja(img, modo, user=None, metricas=None, alineacion=None, recortes=None):
+    """
+    Pipeline completo de UNA hoja ya cargada en memoria. La hoja se pasa a
+    gris, se normaliza y se binariza una sola vez (ContextoHoja). `modo` es
+    'S1', 'S2', None (la sesión se detecta por el formato, clasificar_sesion)
+    o MODO_QR (sesión y alumno se leen del QR del encabezado); si no se puede
+    determinar la sesión se lanza ValueError. Luego cada tira pasa por
+cortar_tiras → encontrar_circulos_en_tira → evaluar_tira.
+
+    `alineacion` ('contorno' o 'aruco', por defecto ALINEACION_OMR) decide
+    cómo se normaliza la hoja (ver matriz_normalizacion). Si se pasa el dict
+    `recortes`, queda con la imagen comprimida de cada tira de la hoja
+    normalizada ({'C1': bytes, ...}, ver codificar_recorte).
+
+    Si se pasa el dict `metricas`, cada etapa deja ahí lo que midió:
+        'tiempos'               segundos por etapa ({'normalizar': 0.03, ...})
+        'calidad'               medidas, motivos y avisos de evaluar_calidad
+        'normalizacion'         'aruco', 'perspectiva' o 'deskew' (no se hallaron esquinas)
+        'rectangulos'           rectángulos de tira hallados por contornos
+        'fallback_coordenadas'  si se usaron las coordenadas fijas de S1_CONF/S2_CONF
+        'burbujas'              círculos detectados por tira
+        'identificacion'        {'alumno': id, 'sesion': 'S1'} leídos del QR (MODO_QR)
+        'sesion_detectada'      {'sesion': 'S1', 'puntajes': {...}} (modo None)
+
+    Retorna la lista de tiras de la sesión `modo`, cada una con la forma
+    {'etiqueta': 'C1', 'secuencia': 'ABCD...', 'esperado': 30, 'ok': True,
+     'razones': [[0.02, 0.81, ...], ...],
+     'margenes': [0.46, ...], 'dudosas': [{'fila': 7, 'recorte': '...'}]}:
+    el relleno de cada opción y el margen (margen_filas) de cada fila, y las
+    filas con margen menor a MARGEN_DUDA con el recorte de sus burbujas
+    (recortar_fila). Si la hoja no pasa el control de calidad y
+    RECHAZAR_ILEGIBLES está activo, lanza HojaIlegible (un ValueError) con
+    los motivos.
+    """
+    ctx = ContextoHoja(img, metricas=metricas, alineacion=alineacion)
+
+    if modo == MODO_QR:
+        with ctx.medir('identificar'):
+            identificacion = leer_identificacion(ctx.gray)
+        if identificacion is None:
+            raise ValueError("No se encontró el código QR de identificación en la hoja.")
+        ctx.metricas['identificacion'] = {'alumno': identificacion[0], 'sesion': identificacion[1]}
+        modo = identificacion[1]
+    elif modo is None:
+        integral = ctx.integral
+        with ctx.medir('sesion'):
+            modo, puntajes = clasificar_sesion(integral)
+        ctx.metricas['sesion_detectada'] = {'sesion': modo, 'puntajes': puntajes}
+        if modo is None:
+            raise ValueError("No se pudo determinar por el formato si la hoja es de la sesión 1 o 2.")
+    etiquetas = ETIQUETAS_S1 if modo == 'S1' else ETIQUETAS_S2
+
+    # Por tira: (respuestas, razones, plano, cajas), con la caja de cada fila
+    # en `plano` para recortar las preguntas dudosas
+    leidas = []
+    tiras_img = []
+    burbujas = ctx.metricas['burbujas'] = {}
+    for etiqueta, (tira_img, tira_bin, n_opciones, _etq) in zip(etiquetas, cortar_tiras(ctx, modo, user=user)):
+        tiras_img.append(tira_img)
+        with ctx.medir('circulos'):
+            imgThresh, circulos, _ = encontrar_circulos_en_tira(tira_img, n_opciones, binaria=tira_bin)
+        burbujas[etiqueta] = len(circulos)
+        with ctx.medir('evaluar'):
+            respuestas, razones, cajas = evaluar_tira(circulos, imgThresh, n_opciones, detalle=True)
+        leidas.append((respuestas, razones, tira_img, cajas))
+
+    salida = []
+    with ctx.medir('dudosas'):
+        for etiqueta, (respuestas, razones, plano, cajas) in zip(etiquetas, leidas):
+            esperado = LONGITUDES_ESPERADAS[modo][etiqueta]
+            seq = ''.join(respuestas)
+            margenes = margen_filas(razones)
+            salida.append({
+                'etiqueta': etiqueta,
+                'secuencia': seq,
+                'esperado': esperado,
+                'ok': len(seq) == esperado,
+                'razones': np.round(razones, 3).tolist(),
+                'margenes': np.round(margenes, 3).tolist(),
+                'dudosas': [
+                    {'fila': int(i), 'recorte': recortar_fila(plano, cajas[i])}
+                    for i in np.flatnonzero(margenes < MARGEN_DUDA)
+                ],
+            })
+    if recortes is not None:
+        with ctx.medir('recortes'):
+            recortes.update((etiqueta, codificar_recorte(tira_img)) for etiqueta, tira_img in zip(etiquetas, tiras_img))
+    return salida
+
+
+def codificar_recorte(plano):
+    """
+    Imagen comprimida (WebP, o JPEG si este OpenCV no trae WebP) de una tira,
+    reducida a ESCALA_RECORTE: lo que guarda recortes_omr.py para revisarla.
+    """
+    reducida = cv2.resize(plano, None, fx=ESCALA_RECORTE, fy=ESCALA_RECORTE, interpolation=cv2.INTER_AREA)
+    ok, buf = cv2.imencode('.webp', reducida, [cv2.IMWRITE_WEBP_QUALITY, CALIDAD_RECORTE])
+    if not ok:
+        ok, buf = cv2.imencode('.jpg', reducida, [cv2.IMWRITE_JPEG_QUALITY, 70])
+    return buf.tobytes()
 
-ETIQUETAS_S1 = ['C1', 'C2', 'C3', 'C4']
-ETIQUETAS_S2 = ['C1', 'C2a', 'C2b', 'C3']
+
+def recortar_fila(plano, caja, margen=6):
+    """
+    JPEG en base64 de la fila de burbujas `caja` (x1, y1, x2, y2) de `plano`,
+    con `margen` px alrededor: lo que ve quien revisa una pregunta dudosa.
+    """
+    alto, ancho = plano.shape[:2]
+    x1, y1, x2, y2 = np.rint(caja).astype(int)
+    recorte = plano[max(y1 - margen, 0):min(y2 + margen, alto), max(x1 - margen, 0):min(x2 + margen, ancho)]
+    if recorte.size == 0:
+        return ''
+    _ok, buf = cv2.imencode('.jpg', recorte, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    return base64.b64encode(buf).decode('ascii')
 
 
-def extraer_tiras_individuales(path_s1, path_s2, user=None):
+def procesar_hoja(fuente, modo, user=None, metricas=None, alineacion=None, recortes=None):
+    """
+    Decodifica una hoja (ruta, bytes o archivo, ver cargar_imagen) y la pasa
+    por extraer_tiras_hoja. Es la unidad de trabajo que se reparte entre
+    procesos en omr_paralelo. `modo`, `metricas`, `alineacion` y `recortes`:
+    ver extraer_tiras_hoja.
+    """
+    metricas = {} if metricas is None else metricas
+    inicio = time.perf_counter()
+    img = cargar_imagen(fuente)
+    tiempos = metricas.setdefault('tiempos', {})
+    tiempos['decodificar'] = tiempos.get('decodificar', 0.0) + time.perf_counter() - inicio
+    return extraer_tiras_hoja(img, modo, user=user, metricas=metricas, alineacion=alineacion,
+                              recortes=recortes)
+
+
+def extraer_tiras_individuales(path_s1, path_s2, user=None, metricas=None, alineacion=None):
     """
     Procesa las dos imágenes de un alumno y devuelve las secuencias
     desglosadas por tira (sin concatenar), junto con el estado de cada una.
+    Cada imagen puede ser una ruta o un buffer en memoria (ver cargar_imagen).
+    Si se pasa `metricas`, queda con las de cada hoja en metricas['s1'] y
+    metricas['s2']; `alineacion`: ver extraer_tiras_hoja.
 
     Retorna:
         dict con estructura:
@@ -599,48 +1346,17 @@ def extraer_tiras_individuales(path_s1, path_s2, user=None):
         }
     """
     resultado = {'s1': [], 's2': [], 'error': None}
+    metricas = {} if metricas is None else metricas
 
     try:
-        img_s1 = cv2.imread(path_s1)
-        if img_s1 is None:
-            raise ValueError(f"No se pudo cargar: {path_s1}")
-        img_s1 = normalizar_hoja(img_s1)
-        tiras_s1 = hacer_tiras(img_s1, 'S1', user=user)
-
-        for i, (tira_img, n_opciones, _etq) in enumerate(tiras_s1):
-            imgThresh, circulos, _ = encontrar_circulos_en_tira(tira_img, n_opciones)
-            respuestas = evaluar_tira(circulos, imgThresh, n_opciones)
-            etiqueta = ETIQUETAS_S1[i]
-            esperado = LONGITUDES_ESPERADAS['S1'][etiqueta]
-            seq = ''.join(respuestas)
-            resultado['s1'].append({
-                'etiqueta': etiqueta,
-                'secuencia': seq,
-                'esperado': esperado,
-                'ok': len(seq) == esperado,
-            })
+        resultado['s1'] = procesar_hoja(path_s1, 'S1', user=user, alineacion=alineacion,
+                                        metricas=metricas.setdefault('s1', {}))
     except Exception as e:
         resultado['error'] = f"S1: {e}"
 
     try:
-        img_s2 = cv2.imread(path_s2)
-        if img_s2 is None:
-            raise ValueError(f"No se pudo cargar: {path_s2}")
-        img_s2 = normalizar_hoja(img_s2)
-        tiras_s2 = hacer_tiras(img_s2, 'S2', user=user)
-
-        for i, (tira_img, n_opciones, _etq) in enumerate(tiras_s2):
-            imgThresh, circulos, _ = encontrar_circulos_en_tira(tira_img, n_opciones)
-            respuestas = evaluar_tira(circulos, imgThresh, n_opciones)
-            etiqueta = ETIQUETAS_S2[i]
-            esperado = LONGITUDES_ESPERADAS['S2'][etiqueta]
-            seq = ''.join(respuestas)
-            resultado['s2'].append({
-                'etiqueta': etiqueta,
-                'secuencia': seq,
-                'esperado': esperado,
-                'ok': len(seq) == esperado,
-            })
+        resultado['s2'] = procesar_hoja(path_s2, 'S2', user=user, alineacion=alineacion,
+                                        metricas=metricas.setdefault('s2', {}))
     except Exception as e:
         err_prev = resultado.get('error') or ''
         resultado['error'] = (err_prev + ' | ' if err_prev else '') + f"S2: {e}"
@@ -650,7 +1366,6 @@ def extraer_tiras_individuales(path_s1, path_s2, user=None):
 
 
 
-
 if __name__ == "__main__":
     if len(sys.argv) < 3:
         print("Uso: python3 procesar_simulacro.py <S1|S2> <imagen.jpg>")
@@ -664,6 +1379,7 @@ if __name__ == "__main__":
         sys.exit(1)
 
     TOTAL = {'S1': 120, 'S2': 134}
+    logging.basicConfig(level=logging.DEBUG, format="  %(message)s")
 
     print(f"\n{'='*60}")
     print(f"  MODO: {modo}  |  Imagen: {imagen}")
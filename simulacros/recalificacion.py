@@ -0,0 +1,152 @@
+"""
+recalificacion.py — Recalificación de un simulacro cuando se corrige su configuración.
+
+Si se corrige una clave errada (soluciones_s1/s2), los puntos de corte o el
+orden de componentes de un simulacro ya calificado, los ResultadoSimulacro
+guardados quedan desactualizados. Aquí se recalculan a partir de las
+respuestas que ya tienen guardadas, sin volver a subir las hojas:
+
+  - componentes_afectados compara la configuración anterior con la nueva:
+    si solo cambiaron letras de la clave, se afectan únicamente los
+    componentes de esas preguntas; si cambiaron cortes, componentes o la
+    longitud de la clave, todos los de la sesión.
+  - recalificar recorre los resultados por bloques, recalcula con la matriz
+    de la cohorte (calculos.calificar_cohorte) solo los componentes
+    afectados, reutiliza los puntajes guardados de los demás para el global
+    y escribe con bulk_update solo los resultados que cambiaron. Los puntajes
+    modificados se vuelven a generar únicamente para esos resultados. Al
+    final se actualizan los aciertos de las estadísticas por pregunta.
+
+SimulacroAdmin.save_model la dispara al guardar cambios en esos campos si el
+simulacro tiene hasta MAX_RECALIFICAR_EN_LINEA resultados; con más, la
+petición no alcanzaría a terminar y el admin solo indica el comando
+`recalificar_simulacro`, que la corre a mano con progreso.
+"""
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from .calculos import (
+    PESOS_COMPONENTES, calcular_puntaje_icfes_cohorte, calificar_cohorte, componente_por_pregunta,
+    modificar_puntajes,
+)
+from .calificacion import cortes_sesion
+from .estadisticas_items import actualizar_correctas
+from .models import ResultadoSimulacro
+
+# Campos del Simulacro que cambian la calificación
+CAMPOS_CLAVE = ('soluciones_s1', 'soluciones_s2', 'puntos_corte_s1', 'puntos_corte_s2',
+                'componentes_s1', 'componentes_s2')
+
+COMPONENTES = ('matematicas', 'lectura', 'sociales', 'naturales', 'ingles')
+
+CAMPOS_PUNTAJE = (
+    ['puntaje_global'] + [f'puntaje_{comp}' for comp in COMPONENTES]
+    + ['puntaje_global_modificado'] + [f'puntaje_{comp}_modificado' for comp in COMPONENTES]
+    + ['fecha_calificacion']
+)
+
+# Resultados leídos y escritos por vuelta
+TAMANO_BLOQUE = 1000
+
+# Hasta cuántos resultados recalifica el admin dentro de la petición
+MAX_RECALIFICAR_EN_LINEA = 2000
+
+
+def configuracion(simulacro):
+    """Lo que define la calificación de cada sesión: {'S1': (clave, cortes, componentes), 'S2': ...}."""
+    return {
+        'S1': (simulacro.soluciones_s1, cortes_sesion(simulacro.puntos_corte_s1),
+               list(simulacro.get_componentes_s1())),
+        'S2': (simulacro.soluciones_s2, cortes_sesion(simulacro.puntos_corte_s2),
+               list(simulacro.get_componentes_s2())),
+    }
+
+
+def componentes_afectados(anterior, nueva):
+    """Componentes cuyo puntaje puede cambiar al pasar de la configuración `anterior` a `nueva`."""
+    afectados = set()
+    for sesion in ('S1', 'S2'):
+        clave_a, cortes_a, comps_a = anterior[sesion]
+        clave_n, cortes_n, comps_n = nueva[sesion]
+        if (len(clave_a), sorted(cortes_a), comps_a) != (len(clave_n), sorted(cortes_n), comps_n):
+            afectados.update(comps_a + comps_n)
+            continue
+        por_pregunta = componente_por_pregunta(len(clave_n), cortes_n, comps_n)
+        afectados.update(por_pregunta[i] for i, (a, n) in enumerate(zip(clave_a, clave_n)) if a != n)
+    return afectados
+
+
+def recalificar(simulacro, afectados=None, progreso=None, tamano_bloque=TAMANO_BLOQUE):
+    """
+    Recalcula los componentes `afectados` (por defecto, todos los del
+    simulacro) de cada resultado guardado del simulacro. `progreso(hechos,
+    total)` se llama después de cada bloque. Retorna cuántos resultados cambiaron.
+    """
+    config = configuracion(simulacro)
+    del_simulacro = set(config['S1'][2] + config['S2'][2])
+    afectados = del_simulacro if afectados is None else set(afectados)
+    if not afectados:
+        return 0
+
+    resultados = ResultadoSimulacro.objects.filter(simulacro=simulacro).order_by('pk')
+    total = resultados.count()
+    hechos = cambiados = 0
+    ultimo = 0
+    while True:
+        bloque = list(resultados.filter(pk__gt=ultimo)[:tamano_bloque])
+        if not bloque:
+            break
+        ultimo = bloque[-1].pk
+        por_guardar = _recalificar_bloque(simulacro, config, bloque, afectados, del_simulacro)
+        with transaction.atomic():
+            ResultadoSimulacro.objects.bulk_update(por_guardar, CAMPOS_PUNTAJE, batch_size=500)
+        hechos += len(bloque)
+        cambiados += len(por_guardar)
+        if progreso:
+            progreso(hechos, total)
+    actualizar_correctas(simulacro)
+    return cambiados
+
+
+def _recalificar_bloque(simulacro, config, bloque, afectados, del_simulacro):
+    """Resultados de `bloque` cuyos puntajes reales cambian, ya con los nuevos valores asignados."""
+    parciales = []
+    for sesion, campo in (('S1', 'respuestas_s1'), ('S2', 'respuestas_s2')):
+        clave, cortes, comps = config[sesion]
+        if afectados & set(comps):
+            parciales.append(calificar_cohorte([getattr(r, campo) for r in bloque], clave, cortes, comps))
+    consolidados = {}
+    for comp in afectados & del_simulacro:
+        partes = [p[comp] for p in parciales if comp in p]
+        consolidados[comp] = {clave: sum(p[clave] for p in partes) for clave in ('buenas', 'totales')}
+    nuevos = calcular_puntaje_icfes_cohorte(consolidados)
+
+    # Global con los componentes recalculados y los guardados de los demás;
+    # uno que ya no está en el simulacro queda en 0
+    puntajes = {}
+    for comp in COMPONENTES:
+        if comp not in del_simulacro:
+            puntajes[comp] = np.zeros(len(bloque), np.int64)
+        elif comp in afectados:
+            puntajes[comp] = nuevos[comp]
+        else:
+            puntajes[comp] = np.array([getattr(r, f'puntaje_{comp}') for r in bloque])
+    suma = sum(puntajes[comp] * PESOS_COMPONENTES.get(comp, 1) for comp in COMPONENTES)
+    puntajes['global'] = np.rint(suma / sum(PESOS_COMPONENTES.values()) * 5).astype(np.int64)
+
+    ahora = timezone.now()
+    por_guardar = []
+    for i, resultado in enumerate(bloque):
+        if all(getattr(resultado, f'puntaje_{comp}') == puntajes[comp][i] for comp in ('global',) + COMPONENTES):
+            continue
+        reales = {comp: int(puntajes[comp][i]) for comp in del_simulacro}
+        reales['global'] = int(puntajes['global'][i])
+        # SE PASA EL SIMULACRO COMPLETO PARA SOPORTAR LOS PARÁMETROS CONFIGURABLES DESDE EL ADMIN
+        modificados = modificar_puntajes(reales, simulacro)
+        for comp in ('global',) + COMPONENTES:
+            setattr(resultado, f'puntaje_{comp}', reales.get(comp, 0))
+            setattr(resultado, f'puntaje_{comp}_modificado', modificados.get(comp, 0))
+        resultado.fecha_calificacion = ahora
+        por_guardar.append(resultado)
+    return por_guardar
@@ -0,0 +1,107 @@
+"""
+recortes_omr.py — Recortes de las tiras para la página de revisión.
+
+Al procesar cada hoja, la cola guarda junto al lote una imagen comprimida de
+cada tira de la hoja ya normalizada (codificar_recorte: WebP de 5 a 25 KB).
+Así quien revisa puede mirar las filas con problemas sin volver a escanear:
+la vista RecorteTiraView los entrega bajo demanda y con cabeceras de caché
+(el recorte guardado de una tarea no cambia).
+
+Los archivos van en omr/recortes/<lote>/ y sus nombres en TareaOMR.recortes
+({'C1': nombre, ...}). Una hoja que sale de la caché de resultados copia los
+recortes de la tarea que la leyó antes, si todavía existen. El comando
+`purgar_recortes_omr` borra los de lotes con más de OMR_RECORTES_DIAS días
+y los que quedaron de lotes eliminados. Con OMR_RECORTES_DIAS = 0 no se guardan.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .models import LoteOMR, TareaOMR
+
+CARPETA = 'omr/recortes'
+
+
+def habilitados():
+    return settings.OMR_RECORTES_DIAS > 0
+
+
+def tipo_contenido(nombre):
+    return 'image/webp' if nombre.endswith('.webp') else 'image/jpeg'
+
+
+def guardar(tarea, recortes):
+    """
+    Guarda los recortes {'C1': bytes, ...} de `tarea` (reemplaza los que
+    tuviera) y deja sus nombres en tarea.recortes; no llama a save().
+    """
+    borrar(tarea)
+    nombres = {}
+    for etiqueta, datos in recortes.items():
+        extension = 'webp' if datos[:4] == b'RIFF' and datos[8:12] == b'WEBP' else 'jpg'
+        nombre = f"{CARPETA}/{tarea.lote_id}/{tarea.pk}_{etiqueta}.{extension}"
+        nombres[etiqueta] = default_storage.save(nombre, ContentFile(datos))
+    tarea.recortes = nombres
+
+
+def copiar_de_anterior(tarea):
+    """
+    Para una hoja que salió de la caché: copia los recortes de la última
+    tarea con el mismo contenido. Retorna False si no hay de dónde copiar.
+    """
+    anterior = (
+        TareaOMR.objects.filter(hash_contenido=tarea.hash_contenido)
+        .exclude(pk=tarea.pk).exclude(recortes={})
+        .order_by('-pk').first()
+    )
+    if anterior is None:
+        return False
+    recortes = {}
+    for etiqueta, nombre in anterior.recortes.items():
+        try:
+            with default_storage.open(nombre, 'rb') as f:
+                recortes[etiqueta] = f.read()
+        except OSError:
+            return False
+    guardar(tarea, recortes)
+    return True
+
+
+def borrar(tarea):
+    """Borra los archivos de los recortes de `tarea` y vacía tarea.recortes; no llama a save()."""
+    for nombre in tarea.recortes.values():
+        default_storage.delete(nombre)
+    tarea.recortes = {}
+
+
+def purgar(dias=None):
+    """
+    Borra los recortes de los lotes creados hace más de `dias` (por defecto
+    OMR_RECORTES_DIAS) y las carpetas de lotes que ya no existen.
+    Retorna la cantidad de archivos borrados.
+    """
+    dias = settings.OMR_RECORTES_DIAS if dias is None else dias
+    limite = timezone.now() - timedelta(days=dias)
+    borrados = 0
+    vencidas = TareaOMR.objects.filter(lote__fecha_creacion__lt=limite).exclude(recortes={})
+    for tarea in vencidas.only('id', 'recortes').iterator():
+        borrados += len(tarea.recortes)
+        borrar(tarea)
+        tarea.save(update_fields=['recortes'])
+
+    try:
+        carpetas, _archivos = default_storage.listdir(CARPETA)
+    except FileNotFoundError:
+        return borrados
+    existentes = {str(pk) for pk in LoteOMR.objects.values_list('pk', flat=True)}
+    for carpeta in carpetas:
+        if carpeta in existentes:
+            continue
+        _sub, archivos = default_storage.listdir(f"{CARPETA}/{carpeta}")
+        for archivo in archivos:
+            default_storage.delete(f"{CARPETA}/{carpeta}/{archivo}")
+        borrados += len(archivos)
+    return borrados
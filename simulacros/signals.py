@@ -0,0 +1,31 @@
+"""
+signals.py — Reacciones a cambios en modelos de otras apps.
+
+Al cambiar un alumno de grupo (retiro, limbo, edición), sus aportes a las
+estadísticas por pregunta pasan del grupo anterior al nuevo, para que los
+informes filtrados por sede o grupo cuenten lo mismo que sus resultados.
+"""
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+
+from academico.models import Alumno
+
+from .estadisticas_items import mover_alumno
+
+
+@receiver(pre_save, sender=Alumno)
+def recordar_grupo_anterior(sender, instance, update_fields=None, raw=False, **kwargs):
+    instance._grupo_anterior_id = None
+    if raw or instance.pk is None or (update_fields is not None and 'grupo_actual' not in update_fields):
+        return
+    instance._grupo_anterior_id = (
+        Alumno.objects.filter(pk=instance.pk).values_list('grupo_actual_id', flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Alumno)
+def mover_estadisticas_de_grupo(sender, instance, created=False, raw=False, **kwargs):
+    anterior = getattr(instance, '_grupo_anterior_id', None)
+    if raw or created or anterior is None or anterior == instance.grupo_actual_id:
+        return
+    mover_alumno(instance.pk, anterior, instance.grupo_actual_id)
@@ -0,0 +1,129 @@
+"""
+similitud.py — Detección de patrones de respuesta sospechosamente parecidos.
+
+Dos alumnos que aciertan las mismas preguntas no dicen mucho; dos que se
+equivocan en las mismas preguntas marcando la misma opción errada, sí. Por
+cada pareja se cuentan esas coincidencias en errores y se comparan con las
+que se esperarían si respondieran por su cuenta:
+
+  - las respuestas erradas de cada alumno se empacan en un bitset (una marca
+    por pregunta y opción, np.packbits), y las coincidencias de una pareja
+    son el popcount (np.bitwise_count) del AND de sus bitsets;
+  - en cada pregunta donde ambos fallaron, la probabilidad de que coincidan
+    por azar es m = Σ (proporción de cada opción errada)², tomada de todos los
+    alumnos del simulacro. Lo esperado es la suma de m y la varianza la suma de
+    m·(1 − m) sobre esas preguntas (productos de matrices);
+  - se reportan las parejas cuyo índice z = (coincidencias − esperadas) / σ
+    pasa de UMBRAL_Z y que tienen al menos MINIMO_COINCIDENCIAS.
+
+Las parejas se comparan dentro de cada bloque (salón o grupo, o todo el
+simulacro) y por trozos de filas, para no armar de una vez la matriz completa.
+"""
+import numpy as np
+
+from .calculos import empaquetar_respuestas
+from .models import ResultadoSimulacro
+
+LETRAS = 'ABCDEFGH'
+_CODIGOS = np.frombuffer(LETRAS.encode('ascii'), np.uint8)
+
+UMBRAL_Z = 5.0
+MINIMO_COINCIDENCIAS = 8
+# Tope aproximado de palabras de 64 bits que se cruzan por trozo
+_PALABRAS_POR_TROZO = 4_000_000
+
+BLOQUES = {
+    'salon': 'alumno__grupo_actual__salon_id',
+    'grupo': 'alumno__grupo_actual_id',
+    'todos': None,
+}
+
+
+def _bitsets(marcas):
+    """Bitset por alumno (una marca por pregunta y opción) como matriz uint64 (alumnos × palabras)."""
+    n, k = marcas.shape
+    unos = (marcas[:, None, :] == _CODIGOS[None, :, None]).reshape(n, len(_CODIGOS) * k)
+    empacados = np.packbits(unos, axis=1)
+    relleno = -empacados.shape[1] % 8
+    empacados = np.pad(empacados, ((0, 0), (0, relleno)))
+    return np.ascontiguousarray(empacados).view(np.uint64)
+
+
+def _sesion(respuestas, clave):
+    """(bitsets de errores, bitsets de respuestas, errores como 0/1, probabilidad m de coincidir por azar)."""
+    marcas, validas = empaquetar_respuestas(respuestas, len(clave))
+    marcas[~validas] = 0
+    codigos_clave = np.frombuffer(clave.encode('ascii', 'replace'), np.uint8)
+    respondidas = np.isin(marcas, _CODIGOS)
+    erradas = respondidas & (marcas != codigos_clave)
+
+    errores = np.where(erradas, marcas, 0)
+    conteo = (errores[:, None, :] == _CODIGOS[None, :, None]).sum(axis=0)  # opción × pregunta
+    total = conteo.sum(axis=0)
+    proporciones = np.divide(conteo, total, out=np.zeros(conteo.shape), where=total > 0)
+    m = (proporciones ** 2).sum(axis=0)
+    return _bitsets(errores), _bitsets(np.where(respondidas, marcas, 0)), erradas.astype(np.float64), m
+
+
+def similitudes(respuestas, claves, bloques=None, umbral_z=UMBRAL_Z, minimo=MINIMO_COINCIDENCIAS):
+    """
+    Parejas sospechosas entre los alumnos de `respuestas` ([(s1, s2), ...]),
+    con `claves` = (clave_s1, clave_s2). Si se dan `bloques` (una etiqueta por
+    alumno), solo se comparan alumnos con la misma etiqueta. Retorna dicts
+    {'a', 'b' (índices), 'coincidencias', 'esperadas', 'z', 'iguales'},
+    de mayor a menor z.
+    """
+    sesiones = [_sesion([r[i] or '' for r in respuestas], clave) for i, clave in enumerate(claves)]
+    bits_error = np.hstack([s[0] for s in sesiones])
+    bits_todo = np.hstack([s[1] for s in sesiones])
+    erradas = np.hstack([s[2] for s in sesiones])
+    m = np.concatenate([s[3] for s in sesiones])
+    ponderadas, varianzas = erradas * m, erradas * (m * (1 - m))
+
+    if bloques is None:
+        bloques = [0] * len(respuestas)
+    por_bloque = {}
+    for i, bloque in enumerate(bloques):
+        por_bloque.setdefault(bloque, []).append(i)
+
+    parejas = []
+    for indices in por_bloque.values():
+        indices = np.array(indices)
+        trozo = max(1, _PALABRAS_POR_TROZO // max(1, len(indices) * bits_error.shape[1]))
+        for inicio in range(0, len(indices) - 1, trozo):
+            filas = indices[inicio:inicio + trozo]
+            coincidencias = np.bitwise_count(bits_error[filas][:, None, :] & bits_error[indices][None, :, :]).sum(axis=2)
+            esperadas = ponderadas[filas] @ erradas[indices].T
+            sigma = np.sqrt(varianzas[filas] @ erradas[indices].T)
+            z = np.divide(coincidencias - esperadas, sigma, out=np.zeros(sigma.shape), where=sigma > 0)
+            # Cada pareja una vez: solo contra los que van después en el bloque
+            despues = np.arange(len(indices))[None, :] > np.arange(inicio, inicio + len(filas))[:, None]
+            for f, c in zip(*np.nonzero(despues & (coincidencias >= minimo) & (z >= umbral_z))):
+                a, b = filas[f], indices[c]
+                parejas.append({
+                    'a': int(a), 'b': int(b),
+                    'coincidencias': int(coincidencias[f, c]),
+                    'esperadas': float(esperadas[f, c]),
+                    'z': float(z[f, c]),
+                    'iguales': int(np.bitwise_count(bits_todo[a] & bits_todo[b]).sum()),
+                })
+    parejas.sort(key=lambda p: p['z'], reverse=True)
+    return parejas
+
+
+def buscar_copias(simulacro, por='salon', umbral_z=UMBRAL_Z, minimo=MINIMO_COINCIDENCIAS):
+    """
+    Parejas sospechosas entre los resultados guardados del simulacro, comparando
+    dentro de cada salón, grupo o en todo el simulacro (`por`, ver BLOQUES).
+    Cada pareja trae 'alumno_a' y 'alumno_b' (ids) además de lo de similitudes().
+    """
+    campo_bloque = BLOQUES[por]
+    campos = ['alumno_id', 'respuestas_s1', 'respuestas_s2'] + ([campo_bloque] if campo_bloque else [])
+    filas = list(ResultadoSimulacro.objects.filter(simulacro=simulacro).order_by('alumno_id').values_list(*campos))
+    parejas = similitudes(
+        [(f[1], f[2]) for f in filas], (simulacro.soluciones_s1, simulacro.soluciones_s2),
+        bloques=[f[3] for f in filas] if campo_bloque else None, umbral_z=umbral_z, minimo=minimo,
+    )
+    for pareja in parejas:
+        pareja['alumno_a'], pareja['alumno_b'] = filas[pareja['a']][0], filas[pareja['b']][0]
+    return parejas
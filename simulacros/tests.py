@@ -1,3 +1,1447 @@
-from django.test import TestCase
+import re
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from academico.models import Alumno
+from simulacros.models import Simulacro, LoteOMR, TareaOMR, CacheOMR
+
+
+def _hoja_en_blanco():
+    """
+    JPEG de una hoja vacía del tamaño estándar, para ejercitar el pipeline.
+    Queda bajo los umbrales del control de calidad (no tiene tinta), pero con
+    los valores por defecto igual se lee.
+    """
+    img = np.full((1650, 1275, 3), 255, np.uint8)
+    ok, buf = cv2.imencode('.jpg', img)
+    return buf.tobytes()
+
+
+def _hoja_marcada(modo, marcas):
+    """
+    Hoja normalizada dibujada sobre la plantilla: un óvalo por burbuja y
+    relleno en el índice de `marcas` (None = pregunta en blanco).
+    """
+    from simulacros.procesar_simulacro import NORM_H, NORM_W, compilar_plantilla
+
+    img = np.full((NORM_H, NORM_W, 3), 255, np.uint8)
+    marcas = iter(marcas)
+    for _etq, _n, centros, (ancho, alto) in compilar_plantilla(modo):
+        for fila in centros:
+            marca = next(marcas)
+            for j, (cx, cy) in enumerate(fila):
+                centro = (int(cx), int(cy))
+                cv2.ellipse(img, centro, (ancho // 2, alto // 2), 0, 0, 360, (0, 0, 0), 2)
+                if marca == j:
+                    cv2.ellipse(img, centro, (ancho // 2 - 2, alto // 2 - 2), 0, 0, 360, (40, 40, 40), -1)
+    return img
+
+
+def _lectura(hoja):
+    """Secuencia que el OMR lee de una hoja sintética (no siempre es hoja.clave)."""
+    from simulacros.procesar_simulacro import extraer_tiras_hoja
+
+    return ''.join(t['secuencia'] for t in extraer_tiras_hoja(hoja.imagen, hoja.modo))
+
+
+_RECHAZAR_ILEGIBLES = mock.patch('simulacros.procesar_simulacro.RECHAZAR_ILEGIBLES', True)
+
+
+def _evaluar_tira_en_bucle(contornos, binaria, n_opciones):
+    """evaluar_tira original, burbuja por burbuja, como referencia de la versión vectorizada."""
+    from simulacros.procesar_simulacro import LETRAS_OPCIONES, SEPARACION_MARCA, UMBRAL_MARCADO
+
+    letras = LETRAS_OPCIONES[n_opciones]
+    burbujas = []
+    for c in contornos:
+        x, y, w, h = cv2.boundingRect(c)
+        burbujas.append({'x': x, 'y': y, 'w': w, 'h': h, 'cX': x + w // 2, 'cY': y + h // 2})
+    burbujas.sort(key=lambda b: b['cY'])
+    tol_y = burbujas[0]['h'] * 0.70
+    filas, fila = [], [burbujas[0]]
+    for b in burbujas[1:]:
+        if abs(b['cY'] - fila[-1]['cY']) < tol_y:
+            fila.append(b)
+        else:
+            filas.append(fila)
+            fila = [b]
+    filas.append(fila)
+
+    filas_ok = [f for f in filas if len(f) == n_opciones]
+    if filas_ok:
+        for f in filas_ok:
+            f.sort(key=lambda b: b['cX'])
+        centros = [np.median([f[i]['cX'] for f in filas_ok]) for i in range(n_opciones)]
+    else:
+        xs = [b['cX'] for b in burbujas]
+        mn, mx = min(xs), max(xs)
+        sp = (mx - mn) / (n_opciones - 1) if mx > mn else 1
+        centros = [mn + sp * i for i in range(n_opciones)]
+
+    respuestas = []
+    for fila in filas:
+        if len(fila) < 2:
+            continue
+        opciones = []
+        for b in fila:
+            idx = min(range(n_opciones), key=lambda i: abs(b['cX'] - centros[i]))
+            m_x, m_y = int(b['w'] * 0.15), int(b['h'] * 0.15)
+            roi = binaria[b['y'] + m_y:b['y'] + b['h'] - m_y, b['x'] + m_x:b['x'] + b['w'] - m_x]
+            opciones.append((idx, cv2.countNonZero(roi) / roi.size if roi.size else 0))
+        opciones.sort(key=lambda o: o[1], reverse=True)
+        mejor_idx, mejor = opciones[0]
+        segundo = opciones[1][1] if len(opciones) > 1 else 0
+        respuestas.append(letras[mejor_idx] if mejor >= UMBRAL_MARCADO and mejor > segundo + SEPARACION_MARCA
+                          else 'Z')
+    return respuestas
+
+
+class SimulacroTestMixin:
+    def crear_datos_base(self):
+        from ubicaciones.models import Departamento, Municipio, Sede, Salon
+        from academico.models import Grupo
+
+        self.depto = Departamento.objects.create(nombre="Santander")
+        self.muni = Municipio.objects.create(nombre="Bucaramanga", departamento=self.depto)
+        self.sede = Sede.objects.create(nombre="Centro", municipio=self.muni)
+        self.salon = Salon.objects.create(numero=101, capacidad_sillas=30, sede=self.sede)
+        self.grupo = Grupo.objects.create(salon=self.salon, codigo="SANTBUCCEN01")
+        self.alumno = Alumno.objects.create(
+            nombres="Juan",
+            primer_apellido="Perez",
+            identificacion="123456789",
+            municipio=self.muni,
+            grupo_actual=self.grupo
+        )
+        self.simulacro = Simulacro.objects.create(
+            nombre="Simulacro 1",
+            soluciones_s1="A" * 120,
+            soluciones_s2="B" * 134,
+            puntos_corte_s1=[30, 60, 90],
+            puntos_corte_s2=[45, 79, 124],
+        )
+
+
+class ColaOMRTests(SimulacroTestMixin, TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        self.crear_datos_base()
+
+    def test_worker_procesa_tareas_y_deja_lote_en_revision(self):
+        """Las hojas encoladas se procesan y el lote pasa a revisión al terminar todas."""
+        from simulacros.cola_omr import procesar_pendientes
+
+        with override_settings(MEDIA_ROOT=self.media):
+            lote = LoteOMR.objects.create(
+                simulacro=self.simulacro, grupo=self.grupo,
+                fecha_realizacion='2026-05-01', alumnos=[self.alumno.id],
+            )
+            for orden, sesion in enumerate(('S1', 'S2')):
+                TareaOMR.objects.create(
+                    lote=lote, alumno=self.alumno, sesion=sesion, orden=orden,
+                    archivo=SimpleUploadedFile(f'hoja_{sesion}.jpg', _hoja_en_blanco()),
+                )
+
+            with self.assertLogs('simulacros.omr', 'INFO') as registro:
+                procesadas = procesar_pendientes(max_workers=1)
+
+        self.assertEqual(procesadas, 2)
+        lote.refresh_from_db()
+        self.assertEqual(lote.estado, LoteOMR.ESTADO_REVISION)
+        for tarea in lote.tareas.all():
+            self.assertEqual(tarea.estado, TareaOMR.ESTADO_COMPLETADA)
+            self.assertEqual(len(tarea.tiras), 4)
+            self.assertEqual(tarea.intentos, 1)
+            self.assertIn('normalizar', tarea.metricas['tiempos'])
+
+        eventos = [r.omr['evento'] for r in registro.records if hasattr(r, 'omr')]
+        self.assertEqual(eventos, ['omr_hoja', 'omr_hoja', 'omr_lote'])
+        resumen = lote.resumen_metricas()
+        self.assertEqual(resumen['hojas'], 2)
+        self.assertIn('normalizar', resumen['etapas_ms'])
+
+    def test_proceso_muerto_devuelve_las_hojas_a_la_cola(self):
+        """Un pool roto se reinicia y sus hojas se reintentan hasta MAX_INTENTOS."""
+        from concurrent.futures import Future
+        from concurrent.futures.process import BrokenProcessPool
+        from simulacros.cola_omr import MAX_INTENTOS, procesar_pendientes
+
+        class PoolRoto:
+            reinicios = 0
+
+            def submit(self, *args):
+                futuro = Future()
+                futuro.set_exception(BrokenProcessPool("un proceso hijo murió"))
+                return futuro
+
+            def reiniciar(self):
+                self.reinicios += 1
+
+        with override_settings(MEDIA_ROOT=self.media):
+            lote = LoteOMR.objects.create(simulacro=self.simulacro, fecha_realizacion='2026-05-01',
+                                          alumnos=[self.alumno.id])
+            tarea = TareaOMR.objects.create(lote=lote, alumno=self.alumno, sesion='S1',
+                                            archivo=SimpleUploadedFile('hoja.jpg', _hoja_en_blanco()))
+            pool = PoolRoto()
+            with self.assertLogs('simulacros.omr', 'INFO'):
+                self.assertEqual(procesar_pendientes(max_workers=2, pool=pool), 1)
+            tarea.refresh_from_db()
+            self.assertEqual((tarea.estado, tarea.intentos, tarea.error), (TareaOMR.ESTADO_PENDIENTE, 1, ''))
+            self.assertEqual(pool.reinicios, 1)
+
+            with self.assertLogs('simulacros.omr', 'INFO'):
+                for _intento in range(MAX_INTENTOS - 1):
+                    procesar_pendientes(max_workers=2, pool=pool)
+        tarea.refresh_from_db()
+        self.assertEqual(tarea.estado, TareaOMR.ESTADO_ERROR)
+        self.assertEqual(tarea.intentos, MAX_INTENTOS)
+        self.assertIn('demasiadas veces', tarea.error)
+        lote.refresh_from_db()
+        self.assertEqual(lote.estado, LoteOMR.ESTADO_REVISION)
+
+    def test_tarea_ya_reclamada_no_se_procesa_dos_veces(self):
+        from simulacros.cola_omr import reclamar_tareas
+
+        with override_settings(MEDIA_ROOT=self.media):
+            lote = LoteOMR.objects.create(
+                simulacro=self.simulacro, fecha_realizacion='2026-05-01', alumnos=[self.alumno.id],
+            )
+            TareaOMR.objects.create(
+                lote=lote, alumno=self.alumno, sesion='S1',
+                archivo=SimpleUploadedFile('hoja.jpg', _hoja_en_blanco()),
+            )
+        self.assertEqual(len(reclamar_tareas(10)), 1)
+        self.assertEqual(reclamar_tareas(10), [])
+
+    def test_reencolar_omite_hojas_purgadas_y_no_reabre_sus_lotes(self):
+        from django.contrib.admin.sites import site
+        from django.core.files.storage import default_storage
+        from django.test import RequestFactory
+
+        with override_settings(MEDIA_ROOT=self.media):
+            tareas = {}
+            for estado in (LoteOMR.ESTADO_REVISION, LoteOMR.ESTADO_CALIFICADO, LoteOMR.ESTADO_CALIFICADO):
+                lote = LoteOMR.objects.create(simulacro=self.simulacro, fecha_realizacion='2026-05-01',
+                                              alumnos=[self.alumno.id], estado=estado)
+                tareas[lote] = TareaOMR.objects.create(
+                    lote=lote, alumno=self.alumno, sesion='S1', estado=TareaOMR.ESTADO_ERROR, intentos=3,
+                    error='falló', archivo=SimpleUploadedFile('hoja.jpg', _hoja_en_blanco()),
+                )
+            vigente, purgada, borrada = tareas.values()
+            TareaOMR.objects.filter(pk=purgada.pk).update(archivo='')
+            default_storage.delete(borrada.archivo.name)
+
+            admin_tarea = site._registry[TareaOMR]
+            with mock.patch.object(admin_tarea, 'message_user') as mensaje:
+                admin_tarea.reencolar(RequestFactory().post('/'), TareaOMR.objects.all())
+
+        self.assertEqual(mensaje.call_args_list[0].args[1], '1 tareas reencoladas.')
+        self.assertIn('2 tareas no se reencolaron', mensaje.call_args_list[1].args[1])
+        for tarea, estado_tarea, estado_lote in (
+            (vigente, TareaOMR.ESTADO_PENDIENTE, LoteOMR.ESTADO_PROCESANDO),
+            (purgada, TareaOMR.ESTADO_ERROR, LoteOMR.ESTADO_CALIFICADO),
+            (borrada, TareaOMR.ESTADO_ERROR, LoteOMR.ESTADO_CALIFICADO),
+        ):
+            tarea.refresh_from_db()
+            self.assertEqual(tarea.estado, estado_tarea)
+            self.assertEqual(tarea.lote.estado, estado_lote)
+
+    def test_hoja_repetida_sale_de_la_cache(self):
+        """Volver a subir los mismos bytes no pasa la hoja otra vez por el OMR."""
+        from simulacros import cola_omr
+        from simulacros.omr_sintetico import generar_hoja
+
+        jpg = cv2.imencode('.jpg', generar_hoja('S1', np.random.default_rng(8)).imagen)[1].tobytes()
+        with override_settings(MEDIA_ROOT=self.media):
+            for _intento in range(2):
+                lote = LoteOMR.objects.create(simulacro=self.simulacro, fecha_realizacion='2026-05-01',
+                                              alumnos=[self.alumno.id])
+                TareaOMR.objects.create(lote=lote, alumno=self.alumno, sesion='S1',
+                                        archivo=SimpleUploadedFile('hoja.jpg', jpg))
+                with self.assertLogs('simulacros.omr', 'INFO'), \
+                        mock.patch.object(cola_omr, 'procesar_hojas', wraps=cola_omr.procesar_hojas) as procesar:
+                    cola_omr.procesar_pendientes(max_workers=1)
+
+        self.assertEqual(procesar.call_args.args[0], [])
+        primera, segunda = TareaOMR.objects.order_by('id')
+        self.assertEqual(primera.hash_contenido, segunda.hash_contenido)
+        self.assertEqual(segunda.tiras, primera.tiras)
+        self.assertTrue(segunda.metricas['cache'])
+        self.assertEqual(CacheOMR.objects.get().usos, 1)
+        # Los recortes de la revisión se copian de la primera lectura
+        self.assertEqual(set(segunda.recortes), set(primera.recortes))
+        self.assertNotEqual(segunda.recortes, primera.recortes)
+
+    def test_recortes_de_tiras_se_sirven_y_se_purgan(self):
+        import io
+        from datetime import timedelta
+        from django.contrib.auth import get_user_model
+        from django.core.files.storage import default_storage
+        from django.core.management import call_command
+        from django.urls import reverse
+        from django.utils import timezone
+        from simulacros.cola_omr import procesar_pendientes
+        from simulacros.omr_sintetico import generar_hoja
+
+        jpg = cv2.imencode('.jpg', generar_hoja('S2', np.random.default_rng(4)).imagen)[1].tobytes()
+        self.client.force_login(get_user_model().objects.create_user(username='staff', password='x'))
+        with override_settings(MEDIA_ROOT=self.media):
+            lote = LoteOMR.objects.create(simulacro=self.simulacro, fecha_realizacion='2026-05-01',
+                                          alumnos=[self.alumno.id])
+            TareaOMR.objects.create(lote=lote, alumno=self.alumno, sesion='S2',
+                                    archivo=SimpleUploadedFile('hoja.jpg', jpg))
+            with self.assertLogs('simulacros.omr', 'INFO'):
+                procesar_pendientes(max_workers=1)
+
+            tarea = lote.tareas.get()
+            self.assertEqual(list(tarea.recortes), ['C1', 'C2a', 'C2b', 'C3'])
+            for nombre in tarea.recortes.values():
+                self.assertLess(default_storage.size(nombre), 30 * 1024)
+
+            url = reverse('simulacros:recorte_tira', args=[tarea.id, 'C1'])
+            respuesta = self.client.get(url)
+            self.assertEqual(respuesta.status_code, 200)
+            self.assertIn('max-age', respuesta['Cache-Control'])
+            self.assertEqual(cv2.imdecode(np.frombuffer(b''.join(respuesta.streaming_content), np.uint8),
+                                          cv2.IMREAD_GRAYSCALE).ndim, 2)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=respuesta['ETag']).status_code, 304)
+
+            call_command('purgar_recortes_omr', stdout=io.StringIO())
+            self.assertEqual(len(lote.tareas.get().recortes), 4)
+            LoteOMR.objects.filter(pk=lote.pk).update(fecha_creacion=timezone.now() - timedelta(days=61))
+            call_command('purgar_recortes_omr', stdout=io.StringIO())
+            self.assertEqual(lote.tareas.get().recortes, {})
+            self.assertFalse(any(default_storage.exists(n) for n in tarea.recortes.values()))
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+            # El escaneo completo se guarda hasta OMR_HOJAS_DIAS después de calificar el lote
+            self.assertTrue(default_storage.exists(tarea.archivo.name))
+            huerfano = default_storage.save('omr/hojas/2020/01/01/huerfano.jpg', SimpleUploadedFile('h.jpg', jpg))
+            call_command('purgar_recortes_omr', stdout=io.StringIO())
+            self.assertTrue(default_storage.exists(tarea.archivo.name))
+            self.assertFalse(default_storage.exists(huerfano))
+            LoteOMR.objects.filter(pk=lote.pk).update(estado=LoteOMR.ESTADO_CALIFICADO,
+                                                      fecha_calificacion=timezone.now() - timedelta(days=31))
+            call_command('purgar_recortes_omr', stdout=io.StringIO())
+            self.assertFalse(default_storage.exists(tarea.archivo.name))
+            self.assertEqual(lote.tareas.get().archivo.name, '')
+
+    def test_purgar_cache_recorta_las_menos_usadas(self):
+        import io
+        from django.core.management import call_command
+        from simulacros import cache_omr
+
+        version = cache_omr.version_cache()
+        cache_omr.guardar([(f'{i:064x}', 'S1', [], {'relleno': 'x' * 1000}) for i in range(4)], version)
+        CacheOMR.objects.create(hash_contenido='f' * 64, modo='S1', version='vieja', tamano=10)
+        cache_omr.buscar([(f'{3:064x}', 'S1')], version)
+
+        call_command('purgar_cache_omr', max_mb=1200 / 2**20, stdout=io.StringIO())
+        self.assertEqual(list(CacheOMR.objects.values_list('hash_contenido', flat=True)), [f'{3:064x}'])
+        call_command('purgar_cache_omr', todo=True, stdout=io.StringIO())
+        self.assertFalse(CacheOMR.objects.exists())
+
+
+    def test_calificar_escaneos_de_una_carpeta(self):
+        """El comando lee, califica y reporta una carpeta sin pasar por la web."""
+        import io
+        import json
+        import os
+        from django.core.management import call_command
+        from simulacros.models import ResultadoSimulacro
+        from simulacros.omr_sintetico import generar_par
+
+        carpeta = os.path.join(self.media, 'escaneos')
+        os.makedirs(carpeta)
+        s1, s2 = generar_par(np.random.default_rng(21))
+        for nombre, hoja in (('01.jpg', s1), ('02.jpg', s2)):
+            cv2.imwrite(os.path.join(carpeta, nombre), hoja.imagen)
+        ruta_reporte = os.path.join(self.media, 'reporte.json')
+
+        with override_settings(MEDIA_ROOT=self.media), self.assertLogs('simulacros.omr', 'INFO'):
+            call_command('calificar_escaneos', carpeta, simulacro=self.simulacro.pk, fecha='2026-05-01',
+                         grupo=self.grupo.pk, workers=1, reporte=ruta_reporte, stderr=io.StringIO())
+
+        resultado = ResultadoSimulacro.objects.get(alumno=self.alumno, simulacro=self.simulacro)
+        self.assertEqual((resultado.respuestas_s1, resultado.respuestas_s2), (_lectura(s1), _lectura(s2)))
+        with open(ruta_reporte, encoding='utf-8') as f:
+            reporte = json.load(f)
+        self.assertEqual(reporte['estado'], LoteOMR.ESTADO_CALIFICADO)
+        self.assertEqual(reporte['hojas'], 2)
+        self.assertEqual(reporte['alumnos_calificados'], [self.alumno.pk])
+        self.assertEqual((reporte['alumnos_sin_calificar'], reporte['hojas_con_error']), ([], []))
+
+    def test_vigilar_escaneos_procesa_la_carpeta_y_retoma(self):
+        """Cada archivo termina en procesados/ o fallidos/; lo que quedó en en_proceso/ se retoma."""
+        import io
+        import os
+        from django.core.management import call_command
+        from simulacros.models import ResultadoSimulacro
+        from simulacros.omr_sintetico import generar_par
+
+        carpeta = os.path.join(self.media, 'escaner')
+        # La S2 quedó en en_proceso/ sin lote, como si el comando se hubiera caído al encolarla
+        os.makedirs(os.path.join(carpeta, 'en_proceso'))
+        s1, s2 = generar_par(np.random.default_rng(22), alumno_id=self.alumno.id)
+        cv2.imwrite(os.path.join(carpeta, 'scan_001.jpg'), s1.imagen)
+        cv2.imwrite(os.path.join(carpeta, 'en_proceso', 'scan_002.jpg'), s2.imagen)
+        with open(os.path.join(carpeta, 'scan_003.pdf'), 'wb') as f:
+            f.write(b'no es un pdf')
+
+        salida = io.StringIO()
+        with override_settings(MEDIA_ROOT=self.media), self.assertLogs('simulacros.omr', 'INFO'):
+            call_command('vigilar_escaneos', carpeta, simulacro=self.simulacro.pk, fecha='2026-05-01',
+                         una_vez=True, espera=0, workers=1, stdout=salida)
+
+        lote = LoteOMR.objects.get()
+        self.assertEqual(lote.estado, LoteOMR.ESTADO_CALIFICADO)
+        self.assertEqual(sorted(os.listdir(os.path.join(carpeta, 'procesados'))),
+                         [f'{lote.pk}__scan_001.jpg', f'{lote.pk}__scan_002.jpg'])
+        self.assertEqual(sorted(os.listdir(os.path.join(carpeta, 'fallidos'))),
+                         ['scan_003.pdf', 'scan_003.pdf.error.txt'])
+        self.assertEqual(os.listdir(os.path.join(carpeta, 'en_proceso')), [])
+        resultado = ResultadoSimulacro.objects.get(alumno=self.alumno, simulacro=self.simulacro)
+        self.assertEqual((resultado.respuestas_s1, resultado.respuestas_s2), (_lectura(s1), _lectura(s2)))
+        self.assertIn('1 alumnos calificados', salida.getvalue())
+
+
+class IdentificacionQRTests(SimulacroTestMixin, TestCase):
+    def setUp(self):
+        self.crear_datos_base()
+
+    def _jpg_con_qr(self, modo, alumno_id, rng):
+        from simulacros.omr_sintetico import NIVELES_RUIDO, generar_hoja
+
+        hoja = generar_hoja(modo, rng, NIVELES_RUIDO['leve'], alumno_id=alumno_id)
+        return cv2.imencode('.jpg', hoja.imagen, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+    def test_lee_alumno_y_sesion_del_qr(self):
+        from simulacros.procesar_simulacro import MODO_QR, decodificar_identificacion, procesar_hoja
+
+        metricas = {}
+        tiras = procesar_hoja(self._jpg_con_qr('S2', 42, np.random.default_rng(1)), MODO_QR, metricas=metricas)
+        self.assertEqual(metricas['identificacion'], {'alumno': 42, 'sesion': 'S2'})
+        self.assertEqual([t['etiqueta'] for t in tiras], ['C1', 'C2a', 'C2b', 'C3'])
+        self.assertIsNone(decodificar_identificacion('https://example.com'))
+        with self.assertRaises(ValueError):
+            procesar_hoja(_hoja_en_blanco(), MODO_QR)
+
+    def test_cola_asigna_hojas_por_qr_en_cualquier_orden(self):
+        from simulacros.cola_omr import procesar_pendientes
+
+        rng = np.random.default_rng(2)
+        archivos = [
+            ('b.jpg', self._jpg_con_qr('S2', self.alumno.id, rng)),
+            ('a.jpg', self._jpg_con_qr('S1', self.alumno.id, rng)),
+            ('c.jpg', _hoja_en_blanco()),
+        ]
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        with override_settings(MEDIA_ROOT=media):
+            lote = LoteOMR.objects.create(simulacro=self.simulacro, grupo=self.grupo, fecha_realizacion='2026-05-01')
+            for orden, (nombre, datos) in enumerate(archivos):
+                TareaOMR.objects.create(lote=lote, orden=orden, nombre_original=nombre,
+                                        archivo=SimpleUploadedFile(nombre, datos))
+            with self.assertLogs('simulacros.omr', 'INFO'):
+                procesar_pendientes(max_workers=1)
+
+        asignadas = {t.nombre_original: (t.alumno_id, t.sesion, t.estado) for t in lote.tareas.all()}
+        self.assertEqual(asignadas['a.jpg'], (self.alumno.id, 'S1', TareaOMR.ESTADO_COMPLETADA))
+        self.assertEqual(asignadas['b.jpg'], (self.alumno.id, 'S2', TareaOMR.ESTADO_COMPLETADA))
+        self.assertEqual(asignadas['c.jpg'], (None, '', TareaOMR.ESTADO_ERROR))
+
+    def test_pdf_de_hojas_personalizadas(self):
+        from django.contrib.auth import get_user_model
+        from django.urls import reverse
+
+        usuario = get_user_model().objects.create_user(username='staff', password='x')
+        self.client.force_login(usuario)
+        respuesta = self.client.get(reverse('simulacros:descargar_hojas_respuesta', args=[self.grupo.id]))
+        self.assertEqual(respuesta['Content-Type'], 'application/pdf')
+        self.assertEqual(len(re.findall(rb'/Type /Page\b', respuesta.content)), 2)
+
+
+class SesionAutomaticaTests(SimulacroTestMixin, TestCase):
+    def test_clasifica_sesion_por_formato(self):
+        from simulacros.omr_sintetico import NIVELES_RUIDO, generar_hoja
+        from simulacros.procesar_simulacro import ContextoHoja, clasificar_sesion
+
+        rng = np.random.default_rng(4)
+        for modo in ('S1', 'S2', 'S2', 'S1'):
+            hoja = generar_hoja(modo, rng, NIVELES_RUIDO['fuerte'])
+            sesion, _puntajes = clasificar_sesion(ContextoHoja(hoja.imagen).integral)
+            self.assertEqual(sesion, modo)
+        en_blanco = cv2.imdecode(np.frombuffer(_hoja_en_blanco(), np.uint8), cv2.IMREAD_COLOR)
+        self.assertIsNone(clasificar_sesion(ContextoHoja(en_blanco).integral)[0])
+
+    @override_settings(OMR_SESION_AUTOMATICA=True)
+    def test_cola_asigna_sesion_detectada(self):
+        from simulacros.cola_omr import procesar_pendientes
+        from simulacros.omr_sintetico import generar_hoja
+
+        self.crear_datos_base()
+        rng = np.random.default_rng(5)
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        with override_settings(MEDIA_ROOT=media):
+            lote = LoteOMR.objects.create(simulacro=self.simulacro, grupo=self.grupo,
+                                          fecha_realizacion='2026-05-01', alumnos=[self.alumno.id])
+            # S2 antes que S1: el orden dentro del par ya no importa
+            for orden, modo in enumerate(('S2', 'S1')):
+                jpg = cv2.imencode('.jpg', generar_hoja(modo, rng).imagen)[1].tobytes()
+                TareaOMR.objects.create(lote=lote, alumno=self.alumno, orden=orden,
+                                        archivo=SimpleUploadedFile(f'{orden}.jpg', jpg))
+            with self.assertLogs('simulacros.omr', 'INFO'):
+                procesar_pendientes(max_workers=1)
+
+        self.assertEqual(list(lote.tareas.values_list('sesion', 'estado')),
+                         [('S2', TareaOMR.ESTADO_COMPLETADA), ('S1', TareaOMR.ESTADO_COMPLETADA)])
+
+    def test_apagada_por_defecto(self):
+        """Sin OMR_SESION_AUTOMATICA la opción no aparece y una hoja sin sesión no se adivina."""
+        from django.contrib.auth import get_user_model
+        from django.urls import reverse
+        from simulacros.cola_omr import procesar_pendientes
+
+        self.crear_datos_base()
+        self.client.force_login(get_user_model().objects.create_user(username='staff', password='x'))
+        respuesta = self.client.get(reverse('simulacros:grupo_calificar_simulacro', args=[self.grupo.id]))
+        self.assertNotContains(respuesta, 'detectar_sesion')
+
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        with override_settings(MEDIA_ROOT=media):
+            lote = LoteOMR.objects.create(simulacro=self.simulacro, grupo=self.grupo,
+                                          fecha_realizacion='2026-05-01', alumnos=[self.alumno.id])
+            tarea = TareaOMR.objects.create(lote=lote, alumno=self.alumno, orden=0,
+                                            archivo=SimpleUploadedFile('0.jpg', _hoja_en_blanco()))
+            with self.assertLogs('simulacros.omr', 'INFO'):
+                procesar_pendientes(max_workers=1)
+
+        tarea.refresh_from_db()
+        self.assertEqual((tarea.sesion, tarea.estado), ('', TareaOMR.ESTADO_ERROR))
+        self.assertIn('OMR_SESION_AUTOMATICA', tarea.error)
+        self.assertNotIn('sesion_detectada', tarea.metricas)
+
+
+class ControlCalidadTests(SimulacroTestMixin, TestCase):
+    def test_detecta_desenfoque_exposicion_y_recorte(self):
+        from simulacros.omr_sintetico import NIVELES_RUIDO, generar_hoja
+        from simulacros.procesar_simulacro import evaluar_calidad
+
+        hoja = generar_hoja('S1', np.random.default_rng(3), NIVELES_RUIDO['leve'])
+        gray = cv2.cvtColor(hoja.imagen, cv2.COLOR_BGR2GRAY)
+        self.assertEqual(evaluar_calidad(gray)['motivos'], [])
+
+        alto = gray.shape[0]
+        casos = {
+            'desenfocada': cv2.GaussianBlur(gray, (0, 0), 16),
+            'sobreexpuesta': cv2.convertScaleAbs(gray, alpha=0.3, beta=190),
+            'subexpuesta': cv2.convertScaleAbs(gray, alpha=0.15),
+            'recortada': gray[alto // 5:],
+        }
+        for motivo, imagen in casos.items():
+            with self.subTest(motivo):
+                self.assertTrue(evaluar_calidad(imagen)['motivos'][0].startswith(motivo))
+
+    def _lote_con_hoja_desenfocada(self):
+        """Lote con la S1 escaneada con ruido leve y la S2 muy desenfocada, ya procesado."""
+        from simulacros.cola_omr import procesar_pendientes
+        from simulacros.omr_sintetico import NIVELES_RUIDO, generar_hoja
+
+        self.crear_datos_base()
+        rng = np.random.default_rng(6)
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        with override_settings(MEDIA_ROOT=media):
+            lote = LoteOMR.objects.create(simulacro=self.simulacro, grupo=self.grupo,
+                                          fecha_realizacion='2026-05-01', alumnos=[self.alumno.id])
+            for orden, modo in enumerate(('S1', 'S2')):
+                imagen = generar_hoja(modo, rng, NIVELES_RUIDO['leve']).imagen
+                if modo == 'S2':
+                    imagen = cv2.GaussianBlur(imagen, (0, 0), 16)
+                TareaOMR.objects.create(lote=lote, alumno=self.alumno, sesion=modo, orden=orden,
+                                        archivo=SimpleUploadedFile(f'{modo}.jpg', cv2.imencode('.jpg', imagen)[1].tobytes()))
+            with self.assertLogs('simulacros.omr', 'INFO'):
+                procesar_pendientes(max_workers=1)
+        return lote
+
+    def test_por_defecto_la_hoja_bajo_umbral_se_lee_y_queda_marcada(self):
+        """Con los umbrales sin medir, el control de calidad solo marca: la hoja se lee igual."""
+        from django.contrib.auth import get_user_model
+        from django.urls import reverse
+
+        lote = self._lote_con_hoja_desenfocada()
+        s1, s2 = lote.tareas.order_by('orden')
+        self.assertEqual((s1.estado, s1.metricas['calidad']['motivos']), (TareaOMR.ESTADO_COMPLETADA, []))
+        self.assertEqual(len(''.join(t['secuencia'] for t in s1.tiras)), 120)
+        self.assertEqual(s2.estado, TareaOMR.ESTADO_COMPLETADA)
+        self.assertTrue(s2.metricas['calidad']['motivos'][0].startswith('desenfocada'))
+        self.assertIn('normalizar', s2.metricas['tiempos'])
+        resumen = lote.resumen_metricas()
+        self.assertEqual((resumen['rechazadas_calidad'], resumen['bajo_umbral_calidad']), (0, 1))
+
+        self.client.force_login(get_user_model().objects.create_user(username='staff', password='x'))
+        respuesta = self.client.get(reverse('simulacros:revisar_simulacro', args=[lote.id]))
+        self.assertNotContains(respuesta, 'Rechazada:')
+        self.assertContains(respuesta, 'desenfocada')
+
+    @_RECHAZAR_ILEGIBLES
+    def test_hoja_rechazada_no_se_lee_y_se_muestra_en_revision(self):
+        from django.contrib.auth import get_user_model
+        from django.urls import reverse
+
+        lote = self._lote_con_hoja_desenfocada()
+        s1, s2 = lote.tareas.order_by('orden')
+        self.assertEqual(s1.estado, TareaOMR.ESTADO_COMPLETADA)
+        self.assertEqual(s2.estado, TareaOMR.ESTADO_ERROR)
+        self.assertIn('desenfocada', s2.error)
+        self.assertNotIn('normalizar', s2.metricas['tiempos'])
+        self.assertEqual(lote.resumen_metricas()['rechazadas_calidad'], 1)
+
+        self.client.force_login(get_user_model().objects.create_user(username='staff', password='x'))
+        respuesta = self.client.get(reverse('simulacros:revisar_simulacro', args=[lote.id]))
+        self.assertContains(respuesta, 'Rechazada:')
+        self.assertContains(respuesta, 'desenfocada')
+
+
+class RevisionDudosasTests(SimulacroTestMixin, TestCase):
+    def test_revision_muestra_solo_preguntas_dudosas(self):
+        """La página de revisión pide solo la pregunta con poco margen y aplica la corrección."""
+        from django.contrib.auth import get_user_model
+        from django.urls import reverse
+        from simulacros.models import ResultadoSimulacro
+        from simulacros.procesar_simulacro import compilar_plantilla, extraer_tiras_hoja
+
+        self.crear_datos_base()
+        lote = LoteOMR.objects.create(simulacro=self.simulacro, grupo=self.grupo, estado=LoteOMR.ESTADO_REVISION,
+                                      fecha_realizacion='2026-05-01', alumnos=[self.alumno.id])
+        leidas = {}
+        for orden, modo in enumerate(('S1', 'S2')):
+            plantilla = compilar_plantilla(modo)
+            marcas = [None if i == 2 else 0 for i in range(sum(len(c) for _e, _n, c, _t in plantilla))]
+            img = _hoja_marcada(modo, marcas)
+            if modo == 'S1':
+                # Pregunta 3: apenas un punto en la opción B
+                cx, cy = plantilla[0][2][2][1]
+                cv2.ellipse(img, (int(cx), int(cy)), (4, 3), 0, 0, 360, (40, 40, 40), -1)
+            tiras = extraer_tiras_hoja(img, modo)
+            leidas[modo] = ''.join(t['secuencia'] for t in tiras)
+            TareaOMR.objects.create(lote=lote, alumno=self.alumno, sesion=modo, orden=orden,
+                                    estado=TareaOMR.ESTADO_COMPLETADA, tiras=tiras)
+
+        s1 = lote.tareas.get(sesion='S1').tiras
+        self.assertEqual([len(t['dudosas']) for t in s1], [1, 0, 0, 0])
+        self.assertEqual(s1[0]['dudosas'][0]['fila'], 2)
+        self.assertTrue(s1[0]['dudosas'][0]['recorte'])
+        self.assertFalse(any(t['dudosas'] for t in lote.tareas.get(sesion='S2').tiras))
+
+        self.client.force_login(get_user_model().objects.create_user(username='staff', password='x'))
+        url = reverse('simulacros:revisar_simulacro', args=[lote.id])
+        respuesta = self.client.get(url, {'todas': '0'})
+        campo = f's1_{self.alumno.id}_C1_2'
+        self.assertContains(respuesta, 'pregunta 3')
+        self.assertContains(respuesta, f'name="{campo}"')
+        self.assertContains(respuesta, '<select', count=1)
+        self.assertNotContains(respuesta, '<textarea')
+
+        self.client.post(url, {campo: 'Z'})
+        resultado = ResultadoSimulacro.objects.get(alumno=self.alumno, simulacro=self.simulacro)
+        self.assertEqual(resultado.respuestas_s1, leidas['S1'][:2] + 'Z' + leidas['S1'][3:])
+        self.assertEqual(resultado.respuestas_s2, leidas['S2'])
+
+    def test_ver_todas_alcanza_lecturas_erradas_con_margen_alto(self):
+        """
+        Una pregunta mal leída con margen de sobra no queda como dudosa, pero
+        "ver todas" (lo que se muestra por defecto) deja corregirla.
+        """
+        from django.contrib.auth import get_user_model
+        from django.urls import reverse
+        from simulacros.models import ResultadoSimulacro
+        from simulacros.procesar_simulacro import compilar_plantilla, extraer_tiras_hoja
+
+        self.crear_datos_base()
+        lote = LoteOMR.objects.create(simulacro=self.simulacro, grupo=self.grupo, estado=LoteOMR.ESTADO_REVISION,
+                                      fecha_realizacion='2026-05-01', alumnos=[self.alumno.id])
+        leidas = {}
+        for orden, modo in enumerate(('S1', 'S2')):
+            n = sum(len(c) for _e, _n, c, _t in compilar_plantilla(modo))
+            # Todas marcadas en la opción B: se leen sin dudas
+            tiras = extraer_tiras_hoja(_hoja_marcada(modo, [1] * n), modo)
+            self.assertFalse(any(t['dudosas'] for t in tiras))
+            leidas[modo] = ''.join(t['secuencia'] for t in tiras)
+            TareaOMR.objects.create(lote=lote, alumno=self.alumno, sesion=modo, orden=orden,
+                                    estado=TareaOMR.ESTADO_COMPLETADA, tiras=tiras)
+        c1 = lote.tareas.get(sesion='S1').tiras[0]['secuencia']
+
+        self.client.force_login(get_user_model().objects.create_user(username='staff', password='x'))
+        url = reverse('simulacros:revisar_simulacro', args=[lote.id])
+        self.assertNotContains(self.client.get(url, {'todas': '0'}), '<textarea')
+        respuesta = self.client.get(url)
+        campo = f's1_{self.alumno.id}_C1_todas'
+        self.assertContains(respuesta, f'name="{campo}"')
+        self.assertContains(respuesta, '<textarea', count=8)
+        self.assertContains(respuesta, 'Ver solo las dudosas')
+
+        # La hoja tenía una D en la pregunta 5 que el OMR leyó como B
+        self.client.post(url, {campo: c1[:4] + 'D' + c1[5:]})
+        resultado = ResultadoSimulacro.objects.get(alumno=self.alumno, simulacro=self.simulacro)
+        self.assertEqual(resultado.respuestas_s1, leidas['S1'][:4] + 'D' + leidas['S1'][5:])
+        self.assertEqual(resultado.respuestas_s2, leidas['S2'])
+
+    def test_confirmar_lote_grande_usa_pocas_consultas(self):
+        """
+        Confirmar la revisión califica todo el lote en un solo bulk_create
+        y actualiza las estadísticas por pregunta con un número fijo de consultas.
+        """
+        from django.contrib.auth import get_user_model
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from django.urls import reverse
+        from simulacros.calificacion import puntajes_alumno
+        from simulacros.models import ResultadoSimulacro
+        from simulacros.procesar_simulacro import compilar_plantilla, extraer_tiras_hoja
+
+        self.crear_datos_base()
+        alumnos = [self.alumno] + [
+            Alumno.objects.create(nombres=f"Alumno {i}", primer_apellido="Gomez", identificacion=str(1000 + i),
+                                  municipio=self.muni, grupo_actual=self.grupo)
+            for i in range(24)
+        ]
+        lote = LoteOMR.objects.create(simulacro=self.simulacro, grupo=self.grupo, estado=LoteOMR.ESTADO_REVISION,
+                                      fecha_realizacion='2026-05-01', alumnos=[a.id for a in alumnos])
+        tiras = {}
+        for modo in ('S1', 'S2'):
+            n = sum(len(c) for _e, _n, c, _t in compilar_plantilla(modo))
+            tiras[modo] = extraer_tiras_hoja(_hoja_marcada(modo, [0] * n), modo)
+        TareaOMR.objects.bulk_create([
+            TareaOMR(lote=lote, alumno=alumno, sesion=modo, estado=TareaOMR.ESTADO_COMPLETADA, tiras=tiras[modo])
+            for alumno in alumnos for modo in ('S1', 'S2')
+        ])
+        # Un resultado previo se actualiza en lugar de duplicarse
+        ResultadoSimulacro.objects.create(alumno=self.alumno, simulacro=self.simulacro, respuestas_s1='',
+                                          respuestas_s2='', fecha_realizacion='2026-04-01')
+
+        self.client.force_login(get_user_model().objects.create_user(username='staff', password='x'))
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.post(reverse('simulacros:revisar_simulacro', args=[lote.id]))
+
+        self.assertLess(len(consultas), 20)
+        self.assertEqual(ResultadoSimulacro.objects.filter(simulacro=self.simulacro).count(), 25)
+        self.assertEqual(self.simulacro.estadisticas_items.get(sesion='S1', item=1).intentos, 25)
+        previo = ResultadoSimulacro.objects.get(alumno=self.alumno)
+        self.assertEqual(previo.respuestas_s1, 'A' * 120)
+        puntajes, _modificados = puntajes_alumno(self.simulacro, 'A' * 120, 'A' * 134)
+        self.assertEqual(previo.puntaje_global, puntajes['global'])
+        lote.refresh_from_db()
+        self.assertEqual(lote.estado, LoteOMR.ESTADO_CALIFICADO)
+
+
+class RecalificacionTests(SimulacroTestMixin, TestCase):
+    def test_corregir_clave_recalifica_solo_el_componente_afectado(self):
+        import io
+        from django.contrib.admin.sites import site
+        from django.core.management import call_command
+        from django.test import RequestFactory
+        from simulacros.calificacion import calificar_lote, puntajes_cohorte
+        from simulacros.models import ResultadoSimulacro
+
+        self.crear_datos_base()
+        rng = np.random.default_rng(3)
+        alumnos = [self.alumno] + [
+            Alumno.objects.create(nombres=f"Alumno {i}", primer_apellido="Diaz", identificacion=str(2000 + i),
+                                  municipio=self.muni, grupo_actual=self.grupo)
+            for i in range(5)
+        ]
+        respuestas = {
+            a.id: (''.join(rng.choice(list('AB'), 120)), ''.join(rng.choice(list('AB'), 134))) for a in alumnos
+        }
+        calificar_lote(self.simulacro, respuestas, '2026-05-01')
+        antes = {r.alumno_id: r for r in ResultadoSimulacro.objects.all()}
+
+        # La pregunta 5 de S1 (matemáticas) tenía la clave errada
+        self.simulacro.soluciones_s1 = 'AAAAB' + 'A' * 115
+        admin_simulacro = site._registry[Simulacro]
+        with mock.patch.object(admin_simulacro, 'message_user') as mensaje:
+            admin_simulacro.save_model(RequestFactory().post('/'), self.simulacro,
+                                       mock.Mock(changed_data=['soluciones_s1']), change=True)
+        self.assertIn('matematicas:', mensaje.call_args.args[1])
+
+        ids = list(respuestas)
+        esperados = dict(zip(ids, puntajes_cohorte(self.simulacro, [respuestas[a][0] for a in ids],
+                                                   [respuestas[a][1] for a in ids])))
+        for resultado in ResultadoSimulacro.objects.all():
+            esperado = esperados[resultado.alumno_id]
+            self.assertEqual(resultado.puntaje_matematicas, esperado['matematicas'])
+            self.assertEqual(resultado.puntaje_global, esperado['global'])
+            self.assertEqual(resultado.puntaje_lectura, antes[resultado.alumno_id].puntaje_lectura)
+
+        salida = io.StringIO()
+        call_command('recalificar_simulacro', self.simulacro.pk, bloque=4, stdout=salida)
+        self.assertIn('4/6 resultados', salida.getvalue())
+        self.assertIn('0 resultados', salida.getvalue())
+
+        # Con muchos resultados el admin no recalifica en la petición: indica el comando
+        self.simulacro.soluciones_s1 = 'A' * 120
+        with mock.patch('simulacros.admin.MAX_RECALIFICAR_EN_LINEA', 5), \
+                mock.patch.object(admin_simulacro, 'message_user') as mensaje:
+            admin_simulacro.save_model(RequestFactory().post('/'), self.simulacro,
+                                       mock.Mock(changed_data=['soluciones_s1']), change=True)
+        self.assertIn(f'recalificar_simulacro {self.simulacro.pk} --componentes matematicas',
+                      mensaje.call_args.args[1])
+        self.assertEqual(ResultadoSimulacro.objects.get(alumno=self.alumno).puntaje_matematicas,
+                         esperados[self.alumno.id]['matematicas'])
+
+
+class EstadisticasItemsTests(SimulacroTestMixin, TestCase):
+    def _esperadas(self, respuestas, grupo_de, grupo, sesion):
+        """Conteos de una pregunta contados uno a uno, como referencia."""
+        clave = self.simulacro.soluciones_s1 if sesion == 0 else self.simulacro.soluciones_s2
+        filas = [r[sesion] for a, r in respuestas.items() if grupo_de[a] == grupo and len(r[sesion]) == len(clave)]
+        return [
+            (len(filas), sum(f[j] == clave[j] for f in filas), sum(f[j] == 'Z' for f in filas),
+             sum(f[j] == 'C' for f in filas))
+            for j in range(len(clave))
+        ]
+
+    def _guardadas(self, grupo, sesion):
+        from simulacros.models import EstadisticaItem
+
+        filas = EstadisticaItem.objects.filter(simulacro=self.simulacro, grupo=grupo, sesion=sesion).order_by('item')
+        return [(e.intentos, e.correctas, e.blancos, e.opcion_c) for e in filas]
+
+    def test_se_mantienen_al_calificar_recalificar_y_reconstruir(self):
+        from academico.models import Grupo
+        from django.core.management import call_command
+        from simulacros.calificacion import calificar_lote
+        from simulacros.models import EstadisticaItem
+        from simulacros.recalificacion import recalificar
+
+        self.crear_datos_base()
+        otro = Grupo.objects.create(salon=self.salon, codigo="SANTBUCCEN02")
+        rng = np.random.default_rng(5)
+        alumnos = [self.alumno] + [
+            Alumno.objects.create(nombres=f"Alumno {i}", primer_apellido="Rojas", identificacion=str(3000 + i),
+                                  municipio=self.muni, grupo_actual=otro if i % 2 else self.grupo)
+            for i in range(7)
+        ]
+        grupo_de = {a.id: a.grupo_actual_id for a in alumnos}
+
+        def responder():
+            return {a.id: (''.join(rng.choice(list('ABCDZ'), 120)), ''.join(rng.choice(list('ABCDZ'), 134)))
+                    for a in alumnos}
+
+        def comprobar(respuestas):
+            for grupo in (self.grupo.id, otro.id):
+                self.assertEqual(self._guardadas(grupo, 'S1'), self._esperadas(respuestas, grupo_de, grupo, 0))
+                self.assertEqual(self._guardadas(grupo, 'S2'), self._esperadas(respuestas, grupo_de, grupo, 1))
+
+        respuestas = responder()
+        respuestas[self.alumno.id] = ('A' * 50, respuestas[self.alumno.id][1])  # S1 incompleta: no cuenta
+        calificar_lote(self.simulacro, respuestas, '2026-05-01')
+        comprobar(respuestas)
+
+        # Volver a calificar a parte de los alumnos reemplaza lo que aportaban
+        nuevas = responder()
+        parte = {a: nuevas[a] for a in list(nuevas)[:4]}
+        calificar_lote(self.simulacro, parte, '2026-05-02')
+        respuestas.update(parte)
+        comprobar(respuestas)
+
+        # Cambiar a un alumno de grupo pasa sus aportes al nuevo, como los filtra el informe
+        movido = Alumno.objects.get(pk=alumnos[2].pk)
+        movido.grupo_actual = otro if movido.grupo_actual_id == self.grupo.id else self.grupo
+        movido.save(update_fields=['grupo_actual'])
+        grupo_de[movido.id] = movido.grupo_actual_id
+        comprobar(respuestas)
+
+        # Corregir la clave solo cambia los aciertos
+        self.simulacro.soluciones_s1 = 'C' * 120
+        self.simulacro.save()
+        recalificar(self.simulacro)
+        comprobar(respuestas)
+
+        antes = list(EstadisticaItem.objects.order_by('grupo', 'sesion', 'item').values_list(
+            'intentos', 'correctas', 'blancos', 'opcion_a', 'opcion_b', 'opcion_c', 'opcion_d'))
+        EstadisticaItem.objects.all().delete()
+        call_command('reconstruir_estadisticas_items', simulacro=self.simulacro.pk, stdout=mock.Mock())
+        despues = list(EstadisticaItem.objects.order_by('grupo', 'sesion', 'item').values_list(
+            'intentos', 'correctas', 'blancos', 'opcion_a', 'opcion_b', 'opcion_c', 'opcion_d'))
+        self.assertEqual(antes, despues)
+
+
+class AnaliticaTests(SimulacroTestMixin, TestCase):
+    def test_estadisticas_coinciden_con_las_formulas(self):
+        from simulacros.analitica import analizar_sesion
+
+        rng = np.random.default_rng(11)
+        clave = ''.join(rng.choice(list('ABCD'), 20))
+        habilidad = rng.normal(size=300)
+        respuestas = [
+            ''.join(c if rng.random() < 1 / (1 + np.exp(-h)) else rng.choice(list('ABCDZ')) for c in clave)
+            for h in habilidad
+        ] + ['A' * 5]  # incompleta: no cuenta
+        analisis = analizar_sesion(respuestas, clave, ['matematicas'] * 10 + ['lectura'] * 10)
+
+        x = np.array([[r[j] == clave[j] for j in range(20)] for r in respuestas[:-1]], float)
+        self.assertEqual(analisis['alumnos'], 300)
+        resto = x.sum(axis=1) - x[:, 3]
+        item = analisis['items'][3]
+        self.assertAlmostEqual(item['dificultad'], x[:, 3].mean())
+        self.assertAlmostEqual(item['discriminacion'], np.corrcoef(x[:, 3], resto)[0, 1])
+        otra = next(o for o in 'ABCD' if o != clave[3])
+        elegida = np.array([r[3] == otra for r in respuestas[:-1]], float)
+        self.assertAlmostEqual(item['opciones'][otra]['discriminacion'], np.corrcoef(elegida, resto)[0, 1])
+        p = x.mean(axis=0)
+        esperado = 20 / 19 * (1 - (p * (1 - p)).sum() / x.sum(axis=1).var())
+        self.assertAlmostEqual(analisis['kr20'], esperado)
+        self.assertEqual(analisis['componentes']['lectura']['items'], 10)
+
+        # Una clave errada se delata con discriminación negativa
+        errada = clave[:5] + next(o for o in 'ABCD' if o != clave[5]) + clave[6:]
+        self.assertIn('revisar la clave', ' '.join(analizar_sesion(respuestas, errada, [])['items'][5]['alertas']))
+
+    def test_cache_se_invalida_con_nuevos_resultados_y_se_muestra(self):
+        from django.contrib.auth import get_user_model
+        from django.urls import reverse
+        from simulacros import analitica
+        from simulacros.calificacion import calificar_lote
+
+        self.crear_datos_base()
+        calificar_lote(self.simulacro, {self.alumno.id: ('A' * 60 + 'B' * 60, 'B' * 134)}, '2026-05-01')
+        with mock.patch.object(analitica, 'analizar_respuestas', wraps=analitica.analizar_respuestas) as calcular:
+            analitica.analizar(self.simulacro)
+            self.assertEqual(analitica.analizar(self.simulacro)['S1']['alumnos'], 1)
+            self.assertEqual(calcular.call_count, 1)
+
+            otro = Alumno.objects.create(nombres="Ana", primer_apellido="Ruiz", identificacion="55",
+                                         municipio=self.muni, grupo_actual=self.grupo)
+            calificar_lote(self.simulacro, {otro.id: ('A' * 120, 'B' * 134)}, '2026-05-01')
+            self.assertEqual(analitica.analizar(self.simulacro)['S1']['alumnos'], 2)
+            self.assertEqual(calcular.call_count, 2)
+
+        user = get_user_model().objects.create_superuser(username='admin', password='x')
+        self.client.force_login(user)
+        respuesta = self.client.get(reverse('simulacros:analitica_items', args=[self.simulacro.id]))
+        self.assertContains(respuesta, 'KR-20')
+        pdf = self.client.get(reverse('simulacros:descargar_informe_directivo'), {'simulacro': self.simulacro.id})
+        self.assertEqual(pdf['Content-Type'], 'application/pdf')
+
+    def test_informe_directivo_sin_componentes_ni_clave_completa(self):
+        import io
+
+        from django.contrib.auth import get_user_model
+        from django.urls import reverse
+        from pypdf import PdfReader
+        from simulacros.calificacion import calificar_lote
+
+        self.crear_datos_base()
+        calificar_lote(self.simulacro, {self.alumno.id: ('B' * 120, 'A' * 134)}, '2026-05-01')
+        # Clave recortada después de calificar: las estadísticas quedan más largas
+        Simulacro.objects.filter(pk=self.simulacro.pk).update(soluciones_s2='B' * 100)
+
+        self.client.force_login(get_user_model().objects.create_superuser(username='admin', password='x'))
+        with mock.patch.object(Simulacro, 'get_componentes_s1', return_value=[]):
+            pdf = self.client.get(reverse('simulacros:descargar_informe_directivo'), {'simulacro': self.simulacro.id})
+        self.assertEqual(pdf.status_code, 200)
+        texto = ''.join(pagina.extract_text() for pagina in PdfReader(io.BytesIO(pdf.content)).pages)
+        self.assertIn('N/A', texto)
+
+
+class SimilitudTests(SimulacroTestMixin, TestCase):
+    def _cohorte(self, rng, n, claves):
+        """Respuestas de `n` alumnos de distinta habilidad; los errores se reparten con sesgo entre opciones."""
+        def responder(clave, habilidad):
+            aciertos = rng.random(len(clave)) < 1 / (1 + np.exp(-habilidad))
+            errores = rng.choice(list('ABCD'), len(clave), p=[0.4, 0.3, 0.2, 0.1])
+            return ''.join(c if ok else e for c, ok, e in zip(clave, aciertos, errores))
+        return [tuple(responder(clave, h) for clave in claves) for h in rng.normal(size=n)]
+
+    def test_detecta_la_copia_y_respeta_los_bloques(self):
+        from simulacros.similitud import similitudes
+
+        rng = np.random.default_rng(21)
+        claves = (''.join(rng.choice(list('ABCD'), 120)), ''.join(rng.choice(list('ABCD'), 134)))
+        respuestas = self._cohorte(rng, 400, claves)
+        copia = list(respuestas[10][0])
+        for j in rng.choice(120, 10, replace=False):
+            copia[j] = 'Z'
+        respuestas[30] = (''.join(copia), respuestas[10][1])
+        respuestas[31] = ('A' * 40, respuestas[31][1])  # S1 incompleta
+
+        parejas = similitudes(respuestas, claves)
+        self.assertEqual([(p['a'], p['b']) for p in parejas], [(10, 30)])
+        esperadas = sum(
+            a == b and a != c and a in 'ABCD' for s in (0, 1) for a, b, c in zip(respuestas[10][s], respuestas[30][s], claves[s])
+        )
+        self.assertEqual(parejas[0]['coincidencias'], esperadas)
+        self.assertEqual(parejas[0]['iguales'], sum(
+            a == b and a in 'ABCD' for s in (0, 1) for a, b in zip(respuestas[10][s], respuestas[30][s])))
+
+        # En salones distintos no se comparan
+        bloques = [i % 2 for i in range(400)]
+        bloques[30] = 1
+        self.assertEqual(similitudes(respuestas, claves, bloques=bloques), [])
+        bloques[30] = 0
+        self.assertEqual(len(similitudes(respuestas, claves, bloques=bloques)), 1)
+
+    def test_vista_lista_las_parejas(self):
+        from django.contrib.auth import get_user_model
+        from django.urls import reverse
+        from simulacros.calificacion import calificar_lote
+
+        self.crear_datos_base()
+        rng = np.random.default_rng(4)
+        alumnos = [self.alumno] + [
+            Alumno.objects.create(nombres=f"Alumno {i}", primer_apellido="Vega", identificacion=str(4000 + i),
+                                  municipio=self.muni, grupo_actual=self.grupo)
+            for i in range(29)
+        ]
+        claves = (self.simulacro.soluciones_s1, self.simulacro.soluciones_s2)
+        respuestas = dict(zip([a.id for a in alumnos], self._cohorte(rng, 30, claves)))
+        respuestas[alumnos[5].id] = respuestas[self.alumno.id]
+        calificar_lote(self.simulacro, respuestas, '2026-05-01')
+
+        self.client.force_login(get_user_model().objects.create_superuser(username='admin', password='x'))
+        respuesta = self.client.get(reverse('simulacros:copias_simulacro', args=[self.simulacro.id]), {'por': 'grupo'})
+        self.assertEqual(len(respuesta.context['parejas']), 1)
+        self.assertContains(respuesta, 'Alumno 4')
+
+
+class CargarImagenTests(SimpleTestCase):
+    def test_decodifica_desde_buffers_en_memoria(self):
+        """Las hojas subidas se decodifican sin escribirlas a disco."""
+        from simulacros.procesar_simulacro import cargar_imagen
+
+        datos = _hoja_en_blanco()
+        for fuente in (datos, memoryview(datos), SimpleUploadedFile('hoja.jpg', datos)):
+            self.assertEqual(cargar_imagen(fuente).shape, (1650, 1275, 3))
+
+    def test_buffer_invalido_lanza_error(self):
+        from simulacros.procesar_simulacro import cargar_imagen
+
+        with self.assertRaises(ValueError):
+            cargar_imagen(b'no es una imagen')
+
+
+class DocumentoMultipaginaTests(SimpleTestCase):
+    def _documento(self, formato):
+        import io
+        from PIL import Image
+
+        paginas = [Image.fromarray(np.full((600, 450, 3), i * 60, np.uint8)) for i in range(3)]
+        buf = io.BytesIO()
+        paginas[0].save(buf, format=formato, save_all=True, append_images=paginas[1:])
+        buf.seek(0)
+        return buf
+
+    def test_pdf_y_tiff_entregan_paginas_en_orden(self):
+        from simulacros.escaneos import DocumentoMultipagina
+        from simulacros.procesar_simulacro import cargar_imagen
+
+        for formato in ('PDF', 'TIFF'):
+            with DocumentoMultipagina(self._documento(formato)) as doc:
+                self.assertEqual(len(doc), 3)
+                tonos = [int(cargar_imagen(pagina)[0, 0, 0]) for pagina in doc]
+                self.assertEqual(len(tonos), 3)
+                self.assertTrue(tonos[0] < tonos[1] < tonos[2], (formato, tonos))
+                self.assertEqual(cargar_imagen(doc.pagina(2)).shape, (600, 450, 3))
+
+    @staticmethod
+    def _pdf_armado(objetos):
+        """PDF con los objetos {número: cuerpo} en el orden dado; el catálogo es el 1."""
+        pdf = bytearray(b'%PDF-1.4\n')
+        posiciones = {}
+        for numero, cuerpo in objetos.items():
+            posiciones[numero] = len(pdf)
+            pdf += b'%d 0 obj\n%s\nendobj\n' % (numero, cuerpo)
+        tamano = max(posiciones) + 1
+        inicio_xref = len(pdf)
+        pdf += b'xref\n0 %d\n' % tamano
+        for numero in range(tamano):
+            pdf += b'%010d 00000 n \n' % posiciones[numero] if numero in posiciones else b'0000000000 65535 f \n'
+        pdf += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (tamano, inicio_xref)
+        return bytes(pdf)
+
+    @staticmethod
+    def _imagen_pdf(tono, ancho=450, alto=600, filtro=b'/DCTDecode', extra=b''):
+        datos = cv2.imencode('.jpg', np.full((alto, ancho, 3), tono, np.uint8))[1].tobytes()
+        return (b'<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceRGB '
+                b'/BitsPerComponent 8 /Filter %s %s /Length %d >>\nstream\n%s\nendstream'
+                % (ancho, alto, filtro, extra, len(datos), datos))
+
+    def test_pdf_sigue_el_arbol_de_paginas(self):
+        """Orden del árbol /Pages, una imagen por página (la más grande, sin máscaras)."""
+        import io
+        from simulacros.escaneos import DocumentoMultipagina
+        from simulacros.procesar_simulacro import cargar_imagen
+
+        # Objetos al revés del orden de las páginas, con un nodo intermedio que hereda recursos
+        objetos = {
+            30: self._imagen_pdf(200),
+            31: self._imagen_pdf(250, ancho=900, alto=1200, extra=b'/ImageMask true'),
+            20: self._imagen_pdf(100),
+            21: self._imagen_pdf(0, ancho=80, alto=80),
+            10: self._imagen_pdf(30),
+            7: b'<< /Type /Page /Parent 5 0 R /Resources << /XObject << /Im0 30 0 R /M 31 0 R >> >> >>',
+            6: b'<< /Type /Page /Parent 5 0 R >>',
+            5: b'<< /Type /Pages /Parent 2 0 R /Kids [6 0 R 7 0 R] /Count 2 '
+               b'/Resources << /XObject << /Logo 21 0 R /Im1 20 0 R >> >> >>',
+            4: b'<< /Type /Page /Parent 2 0 R /Resources << /XObject << /Im0 10 0 R >> >> >>',
+            2: b'<< /Type /Pages /Kids [4 0 R 5 0 R] /Count 3 >>',
+            1: b'<< /Type /Catalog /Pages 2 0 R >>',
+        }
+        with DocumentoMultipagina(io.BytesIO(self._pdf_armado(objetos))) as doc:
+            self.assertEqual(len(doc), 3)
+            paginas = [cargar_imagen(pagina) for pagina in doc]
+        self.assertEqual([p.shape for p in paginas], [(600, 450, 3)] * 3)
+        tonos = [int(p[0, 0, 0]) for p in paginas]
+        self.assertTrue(all(abs(t - e) < 5 for t, e in zip(tonos, (30, 100, 200))), tonos)
+
+        # Una página con compresión no soportada invalida todo el PDF
+        objetos[20] = self._imagen_pdf(100, filtro=b'/JBIG2Decode')
+        with self.assertRaisesRegex(ValueError, 'página 2 .*JBIG2Decode'):
+            DocumentoMultipagina(io.BytesIO(self._pdf_armado(objetos)))
+        objetos[20] = self._imagen_pdf(100)
+        objetos[7] = b'<< /Type /Page /Parent 5 0 R /Resources << >> >>'
+        with self.assertRaisesRegex(ValueError, 'página 3 .*no tiene'):
+            DocumentoMultipagina(io.BytesIO(self._pdf_armado(objetos)))
+
+    def test_pdf_con_imagen_sin_jpeg(self):
+        """Una página en gris con /FlateDecode la decodifica pypdf y sale en BGR."""
+        import io
+        import zlib
+        from simulacros.escaneos import DocumentoMultipagina
+
+        gris = np.tile(np.arange(0, 200, 2, dtype=np.uint8), (80, 1))
+        datos = zlib.compress(gris.tobytes())
+        objetos = {
+            1: b'<< /Type /Catalog /Pages 2 0 R >>',
+            2: b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+            3: b'<< /Type /Page /Parent 2 0 R /Resources << /XObject << /Im0 4 0 R >> >> >>',
+            4: (b'<< /Type /XObject /Subtype /Image /Width 100 /Height 80 /ColorSpace /DeviceGray '
+                b'/BitsPerComponent 8 /Filter /FlateDecode /Length %d >>\nstream\n%s\nendstream' % (len(datos), datos)),
+        }
+        with DocumentoMultipagina(io.BytesIO(self._pdf_armado(objetos))) as doc:
+            pagina = doc.pagina(0)
+        self.assertEqual(pagina.shape, (80, 100, 3))
+        np.testing.assert_array_equal(pagina[:, :, 0], gris)
+
+    def test_archivo_que_no_es_pdf_ni_tiff(self):
+        import io
+        from simulacros.escaneos import DocumentoMultipagina
+
+        with self.assertRaises(ValueError):
+            DocumentoMultipagina(io.BytesIO(_hoja_en_blanco()))
+
+
+class PipelineOMRTests(SimpleTestCase):
+    def test_metricas_por_etapa(self):
+        """La hoja se binariza una sola vez aunque pase por varias etapas."""
+        from simulacros import procesar_simulacro
+
+        img = cv2.imdecode(np.frombuffer(_hoja_en_blanco(), np.uint8), cv2.IMREAD_COLOR)
+        metricas = {}
+        with mock.patch.object(procesar_simulacro, 'binarizar', wraps=procesar_simulacro.binarizar) as binarizar:
+            procesar_simulacro.extraer_tiras_hoja(img, 'S1', metricas=metricas)
+        self.assertEqual(binarizar.call_count, 1)
+        self.assertLessEqual({'normalizar', 'binarizar', 'tiras', 'circulos'}, set(metricas['tiempos']))
+        self.assertEqual(set(metricas['burbujas']), set(procesar_simulacro.ETIQUETAS_S1))
+        self.assertIn('fallback_coordenadas', metricas)
+
+
+class PoolOMRTests(SimpleTestCase):
+    def test_pool_real_conserva_el_orden_y_agota_el_tiempo(self):
+        """
+        Pool 'spawn' de 2 procesos con dos hojas sintéticas y una que no
+        termina (la alarma la corta); luego un proceso que muere rompe el
+        pool, que se reinicia y sigue leyendo.
+        """
+        import functools
+        import os
+        import signal
+        import time
+        import types
+        from simulacros.omr_paralelo import crear_pool, procesar_hojas
+        from simulacros.omr_sintetico import generar_hoja
+
+        if not hasattr(signal, 'SIGALRM'):
+            self.skipTest('El tiempo por hoja usa SIGALRM')
+
+        rng = np.random.default_rng(2)
+        s1, s2 = generar_hoja('S1', rng), generar_hoja('S2', rng)
+        jpg = {h.modo: cv2.imencode('.jpg', h.imagen)[1].tobytes() for h in (s1, s2)}
+        lecturas = {h.modo: _lectura(h) for h in (s1, s2)}
+        # Objetos que se pueden enviar al proceso hijo y cuyo read() (ver
+        # cargar_imagen) se queda dormido o mata al proceso
+        lenta = types.SimpleNamespace(read=functools.partial(time.sleep, 60))
+        mortal = types.SimpleNamespace(read=functools.partial(os._exit, 1))
+
+        def secuencia(resultado):
+            return ''.join(t['secuencia'] for t in resultado['tiras'])
+
+        with crear_pool(2) as pool:
+            inicio = time.perf_counter()
+            resultados = procesar_hojas([(jpg['S1'], 'S1'), (lenta, 'S1'), (jpg['S2'], 'S2')],
+                                        timeout_hoja=1, pool=pool)
+            self.assertLess(time.perf_counter() - inicio, 30)
+            self.assertEqual([r['error'] for r in resultados], [None, 'Tiempo agotado (1s)', None])
+            self.assertEqual(secuencia(resultados[0]), lecturas['S1'])
+            self.assertEqual(resultados[1]['tiras'], [])
+            self.assertEqual(secuencia(resultados[2]), lecturas['S2'])
+
+            rotos = procesar_hojas([(mortal, 'S1')], timeout_hoja=1, pool=pool)
+            self.assertTrue(rotos[0]['pool_roto'])
+            despues = procesar_hojas([(jpg['S2'], 'S2'), (jpg['S1'], 'S1')], timeout_hoja=1, pool=pool)
+            self.assertEqual([secuencia(r) for r in despues], [lecturas['S2'], lecturas['S1']])
+
+
+class RellenoVectorizadoTests(SimpleTestCase):
+    def test_razones_relleno_coincide_con_recortes(self):
+        from simulacros.procesar_simulacro import razones_relleno
+
+        rng = np.random.default_rng(0)
+        binaria = (rng.random((200, 150)) > 0.6).astype(np.uint8) * 255
+        rects = np.array([[10, 20, 30, 25], [0, 0, 150, 200], [140, 190, 30, 30], [5, 5, 0, 4]])
+        esperado = []
+        for x, y, w, h in rects:
+            roi = binaria[y:y + h, x:x + w]
+            esperado.append(cv2.countNonZero(roi) / roi.size if roi.size else 0)
+        np.testing.assert_allclose(razones_relleno(binaria, rects), esperado)
+
+    def test_decidir_filas(self):
+        from simulacros.procesar_simulacro import decidir_filas
+
+        razones = [
+            [0.05, 0.80, 0.06, 0.04],   # B marcada
+            [0.05, 0.06, 0.04, 0.10],   # en blanco
+            [0.70, 0.65, 0.05, 0.04],   # doble marca
+        ]
+        self.assertEqual(decidir_filas(razones, ['A', 'B', 'C', 'D']), ['B', 'Z', 'Z'])
+
+    def test_margen_filas(self):
+        from simulacros.procesar_simulacro import margen_filas
+
+        razones = [
+            [0.05, 0.80, 0.06, 0.04],   # marca clara
+            [0.05, 0.30, 0.04, 0.06],   # marca tenue, apenas sobre el umbral
+            [0.05, 0.06, 0.04, 0.10],   # en blanco
+            [0.70, 0.65, 0.05, 0.04],   # doble marca casi separada
+        ]
+        np.testing.assert_allclose(margen_filas(razones), [0.55, 0.05, 0.15, 0.05])
+
+    def test_agrupar_ovalos_con_burbujas_repetidas_coincide_con_el_bucle(self):
+        """
+        Dos contornos de la misma fila que caen en la misma opción cuentan por
+        separado, como en el bucle original por burbuja.
+        """
+        from simulacros.utils_omr import UMBRAL_OVALO_MARCADO, agrupar_y_evaluar_ovalos
+
+        binaria = np.zeros((300, 200), np.uint8)
+        a, b, c, d = 40, 65, 90, 115
+        # Por fila, (centro x, rellena) de cada burbuja; la repetida se corre
+        # 11 px, sin tocar a la original y más cerca de ella que de la vecina
+        filas = [
+            [(a, 0), (b, 1), (c, 0), (d, 0)],               # B
+            [(a, 0), (b, 0), (c, 0), (d, 0)],               # en blanco
+            [(a, 1), (b, 0), (c, 1), (d, 0)],               # doble marca
+            [(a, 0), (b, 0), (c, 0), (d, 1), (d + 11, 1)],  # D repetida, marcada dos veces
+            [(a, 0), (b, 1), (b + 11, 0), (c, 0), (d, 0)],  # B repetida, marcada una vez
+            [(a, 0), (b, 0), (c, 0), (c + 11, 0), (d, 0)],  # C repetida, en blanco
+        ]
+        contornos, esperado = [], []
+        for i, fila in enumerate(filas):
+            y = 30 + 40 * i
+            opciones = []
+            for cx, rellena in fila:
+                x = cx - 5
+                contornos.append(np.array([[[x, y]], [[x + 9, y]], [[x + 9, y + 13]], [[x, y + 13]]], np.int32))
+                if rellena:
+                    binaria[y:y + 14, x:x + 10] = 255
+                # Bucle original: opción más cercana y relleno con countNonZero
+                distancias = [abs(cx - centro) for centro in (a, b, c, d)]
+                roi = binaria[y:y + 14, x:x + 10]
+                opciones.append((distancias.index(min(distancias)), cv2.countNonZero(roi) / roi.size))
+            marcados = [idx for idx, ratio in opciones if ratio >= UMBRAL_OVALO_MARCADO]
+            esperado.append('ABCD'[marcados[0]] if len(marcados) == 1 else 'Z')
+
+        self.assertEqual(esperado, ['B', 'Z', 'Z', 'Z', 'B', 'Z'])
+        self.assertEqual(agrupar_y_evaluar_ovalos(contornos, binaria), esperado)
+
+
+    def test_evaluar_tira_coincide_con_el_bucle(self):
+        """Tiras con marcas claras, tenues, dobles, en blanco y filas incompletas leen igual que antes."""
+        from simulacros.procesar_simulacro import evaluar_tira
+
+        rng = np.random.default_rng(4)
+        # Relleno de cada tipo de burbuja: en blanco, tenue (alrededor de
+        # UMBRAL_MARCADO) y clara
+        rellenos = {'blanco': (0.0, 0.12), 'tenue': (0.18, 0.40), 'clara': (0.55, 0.95)}
+        for n_opciones in (4, 8):
+            for _tira in range(10):
+                binaria = np.zeros((40 * 30 + 40, 30 * n_opciones + 40), np.uint8)
+                contornos = []
+                for i in range(30):
+                    tipo = rng.choice(['blanco', 'clara', 'tenue', 'doble', 'doble_tenue', 'incompleta'])
+                    marcas = rng.choice(n_opciones, 2, replace=False)
+                    for j in range(n_opciones):
+                        if tipo == 'incompleta' and j == marcas[1]:
+                            continue
+                        if tipo == 'doble':
+                            nivel = 'clara' if j in marcas else 'blanco'
+                        elif tipo == 'doble_tenue':
+                            nivel = 'tenue' if j in marcas else 'blanco'
+                        elif tipo in ('clara', 'tenue'):
+                            nivel = tipo if j == marcas[0] else 'blanco'
+                        elif tipo == 'incompleta':
+                            nivel = 'clara' if j == marcas[0] else 'blanco'
+                        else:
+                            nivel = 'blanco'
+                        x = 20 + 30 * j + int(rng.integers(-2, 3))
+                        y = 20 + 40 * i + int(rng.integers(-2, 3))
+                        binaria[y:y + 16, x:x + 20] = (rng.random((16, 20)) < rng.uniform(*rellenos[nivel])) * 255
+                        contornos.append(np.array([[[x, y]], [[x + 19, y]], [[x + 19, y + 15]], [[x, y + 15]]],
+                                                  np.int32))
+                # Una mancha suelta: fila de una sola burbuja que ambas descartan
+                contornos.append(np.array([[[5, 1232]], [[9, 1232]], [[9, 1236]], [[5, 1236]]], np.int32))
+                rng.shuffle(contornos)
+                esperado = _evaluar_tira_en_bucle(contornos, binaria, n_opciones)
+                self.assertEqual(len(esperado), 30)
+                self.assertEqual(evaluar_tira(contornos, binaria, n_opciones), esperado)
+
+
+class CalificacionCohorteTests(SimpleTestCase):
+    def test_cohorte_coincide_con_calificar_por_alumno(self):
+        from simulacros.calculos import (
+            calcular_puntaje_icfes, calcular_puntaje_icfes_cohorte, calificar, calificar_cohorte,
+        )
+
+        rng = np.random.default_rng(7)
+        solucion = ''.join(rng.choice(list('ABCD'), 120))
+        respuestas = [''.join(rng.choice(list('ABCDZ'), 120)) for _ in range(300)]
+        respuestas += ['', 'A' * 119, 'Ñ' * 120, solucion]
+        componentes = ['matematicas', 'lectura', 'sociales', 'naturales']
+        # Cortes normales, desordenados, en el borde y que calificar deja sin aplicar
+        for cortes in ([30, 60, 90], [90, 30, 60], [30, 60, 120], [0, 60, 90], [30, 30, 90], [30, 60, 200]):
+            cohorte = calificar_cohorte(respuestas, solucion, cortes, componentes)
+            por_alumno = [calificar(r, solucion, cortes, componentes) for r in respuestas]
+            for comp in componentes:
+                for clave in ('buenas', 'totales'):
+                    self.assertEqual(cohorte[comp][clave].tolist(), [p[comp][clave] for p in por_alumno],
+                                     (cortes, comp, clave))
+
+            puntajes = calcular_puntaje_icfes_cohorte(cohorte)
+            for i, parcial in enumerate(por_alumno):
+                esperado = calcular_puntaje_icfes(parcial)
+                self.assertEqual({comp: int(v[i]) for comp, v in puntajes.items()}, esperado, cortes)
+
+        with self.assertRaises(ValueError):
+            calificar_cohorte(respuestas, solucion, [30, 60], componentes)
+
+
+class NormalizacionTests(SimpleTestCase):
+    def test_esquinas_subpixel_en_escaneo_grande(self):
+        """Las esquinas se buscan en la pirámide pero se afinan sobre el escaneo completo."""
+        from simulacros.procesar_simulacro import _detectar_esquinas
+
+        ancho, alto = 2550, 3300
+        hoja = np.full((alto, ancho), 250, np.uint8)
+        fondo = np.full((3500, 2750), 35, np.uint8)
+        matriz = cv2.getRotationMatrix2D((ancho / 2, alto / 2), 1.5, 1.0)
+        matriz[:, 2] += (100, 100)
+        escaneo = cv2.warpAffine(hoja, matriz, (2750, 3500), dst=fondo, borderMode=cv2.BORDER_TRANSPARENT)
+
+        vertices = np.array([[0, 0], [ancho, 0], [ancho, alto], [0, alto]], np.float64)
+        esperadas = vertices @ matriz[:, :2].T + matriz[:, 2]
+        self.assertLess(np.abs(_detectar_esquinas(escaneo) - esperadas).max(), 1.0)
+
+    def test_alineacion_aruco_en_foto(self):
+        """Con fondo claro el borde no sirve; los marcadores de las esquinas sí."""
+        from simulacros.omr_sintetico import NIVELES_RUIDO, generar_hoja
+        from simulacros.procesar_simulacro import extraer_tiras_hoja
+
+        hoja = generar_hoja('S1', np.random.default_rng(1), NIVELES_RUIDO['foto'], aruco=True)
+        metricas = {}
+        tiras = extraer_tiras_hoja(hoja.imagen, 'S1', metricas=metricas, alineacion='aruco')
+        self.assertEqual(metricas['normalizacion'], 'aruco')
+        self.assertEqual(''.join(t['secuencia'] for t in tiras), hoja.clave)
+
+    def test_alineacion_aruco_sin_marcadores_usa_contorno(self):
+        from simulacros.omr_sintetico import NIVELES_RUIDO, generar_hoja
+        from simulacros.procesar_simulacro import extraer_tiras_hoja
+
+        hoja = generar_hoja('S1', np.random.default_rng(0), NIVELES_RUIDO['leve'])
+        metricas = {}
+        extraer_tiras_hoja(hoja.imagen, 'S1', metricas=metricas, alineacion='aruco')
+        self.assertEqual(metricas['normalizacion'], 'perspectiva')
+
+
+class BenchmarkOMRTests(SimpleTestCase):
+    def test_generador_y_lectura_coinciden_sin_ruido(self):
+        """Sin ruido, el motor de contornos lee casi toda la hoja sintética."""
+        from simulacros.omr_sintetico import generar_par
+
+        for hoja in generar_par(np.random.default_rng(1)):
+            leida = _lectura(hoja)
+            self.assertEqual(len(leida), len(hoja.clave))
+            self.assertLessEqual(sum(a != b for a, b in zip(leida, hoja.clave)), 2)
+
+    def test_escaneos_de_referencia(self):
+        """
+        Hojas reales con lectura verificada (escaneos_referencia/): la sesión
+        se detecta por el formato, cada respuesta se lee bien y lo que lea
+        mal tiene que quedar marcado como dudoso.
+        """
+        import json
+        import os
+        from simulacros.procesar_simulacro import cargar_imagen, extraer_tiras_hoja
+
+        carpeta = os.path.join(os.path.dirname(__file__), 'escaneos_referencia')
+        hojas = sorted(n for n in os.listdir(carpeta) if n.lower().endswith(('.jpg', '.jpeg', '.png')))
+        if not hojas:
+            self.skipTest("No hay escaneos de referencia en simulacros/escaneos_referencia/.")
+        for nombre in hojas:
+            with self.subTest(hoja=nombre):
+                with open(os.path.join(carpeta, os.path.splitext(nombre)[0] + '.json'), encoding='utf-8') as f:
+                    esperado = json.load(f)
+                metricas = {}
+                tiras = extraer_tiras_hoja(cargar_imagen(os.path.join(carpeta, nombre)), None, metricas=metricas)
+                self.assertEqual(metricas['sesion_detectada']['sesion'], esperado['sesion'])
+                inicio, mal_sin_duda = 0, []
+                for tira in tiras:
+                    dudosas = {d['fila'] for d in tira['dudosas']}
+                    for fila, letra in enumerate(tira['secuencia']):
+                        if letra != esperado['respuestas'][inicio + fila] and fila not in dudosas:
+                            mal_sin_duda.append(inicio + fila + 1)
+                    inicio += len(tira['secuencia'])
+                self.assertEqual(mal_sin_duda, [])
+                self.assertEqual(''.join(t['secuencia'] for t in tiras), esperado['respuestas'])
+
+    def test_benchmark_guarda_y_compara(self):
+        import io
+        import json
+        import os
+        from django.core.management import call_command
+
+        carpeta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, carpeta, ignore_errors=True)
+        ruta = os.path.join(carpeta, 'base.json')
+        opciones = dict(pares=1, ruido='ninguno', funciones=['extraer_tiras_individuales'])
+
+        call_command('benchmark_omr', guardar=ruta, stdout=io.StringIO(), **opciones)
+        with open(ruta, encoding='utf-8') as f:
+            resultado = json.load(f)['resultados']['extraer_tiras_individuales']
+        self.assertEqual(resultado['hojas'], 2)
+        self.assertEqual(resultado['exactitud'], 1.0)
+        self.assertIn('normalizar', resultado['etapas_ms'])
+
+        salida = io.StringIO()
+        call_command('benchmark_omr', comparar=ruta, stdout=salida, **opciones)
+        self.assertIn('Comparación contra', salida.getvalue())
@@ -5,10 +5,14 @@ app_name = 'simulacros'
 
 urlpatterns = [
     path('grupo/<int:grupo_id>/calificar/', views.GrupoCalificarSimulacroView.as_view(), name='grupo_calificar_simulacro'),
-    path('revisar/', views.RevisarSimulacroView.as_view(), name='revisar_simulacro'),
+    path('grupo/<int:grupo_id>/hojas-respuesta/', views.DescargarHojasRespuestaPDFView.as_view(), name='descargar_hojas_respuesta'),
+    path('revisar/<int:lote_id>/', views.RevisarSimulacroView.as_view(), name='revisar_simulacro'),
+    path('revisar/recorte/<int:tarea_id>/<str:etiqueta>/', views.RecorteTiraView.as_view(), name='recorte_tira'),
     path('resultados/', views.ResultadosSimulacroListView.as_view(), name='resultados_simulacros'),
     path('resultados/pdf/', views.DescargarResultadosPDFView.as_view(), name='descargar_resultados_pdf'),
     path('resultados/pdf-reales/', views.DescargarResultadosRealesPDFView.as_view(), name='descargar_resultados_reales_pdf'),
+    path('resultados/analitica/<int:simulacro_id>/', views.AnaliticaItemsView.as_view(), name='analitica_items'),
+    path('resultados/copias/<int:simulacro_id>/', views.CopiasSimulacroView.as_view(), name='copias_simulacro'),
     path('resultados/informe-directivo/', views.DescargarInformeDirectivoPDFView.as_view(), name='descargar_informe_directivo'),
     path('resultados/<int:resultado_pk>/pdf/', views.DescargarResultadoIndividualPDFView.as_view(), name='descargar_resultado_individual_pdf'),
 ]
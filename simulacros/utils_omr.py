@@ -2,6 +2,15 @@ import cv2
 import numpy as np
 from collections import Counter
 
+try:
+    from .procesar_simulacro import razones_relleno
+except ImportError:
+    # Ejecutado como script desde la carpeta simulacros (test_cv.py)
+    from procesar_simulacro import razones_relleno
+
+# Umbral dinámico: vacío ~23%, marcado >= 40% (ajustado para el escáner)
+UMBRAL_OVALO_MARCADO = 0.40
+
 
 def alinear_documento(image_path):
     """Carga y redimensiona la imagen. Sin CamScanner — la foto ya viene derecha."""
@@ -100,7 +109,10 @@ def agrupar_y_evaluar_ovalos(burbujas_contours, imgThresh):
             col_actual = [b]
     columnas.append(col_actual)
 
-    respuestas = []
+    # Cada burbuja recibe (fila global, opción); el relleno y la decisión se
+    # calculan después para todas a la vez.
+    cajas, fila_de, opcion_de = [], [], []
+    n_filas = 0
 
     for columna in columnas:
         columna = sorted(columna, key=lambda b: b['cY'])
@@ -121,50 +133,39 @@ def agrupar_y_evaluar_ovalos(burbujas_contours, imgThresh):
         if filas_completas:
             for f in filas_completas:
                 f.sort(key=lambda b: b['cX'])
-            centros_esperados = [
-                np.median([f[0]['cX'] for f in filas_completas]),
-                np.median([f[1]['cX'] for f in filas_completas]),
-                np.median([f[2]['cX'] for f in filas_completas]),
-                np.median([f[3]['cX'] for f in filas_completas])
-            ]
+            centros_esperados = np.median([[b['cX'] for b in f] for f in filas_completas], axis=0)
         else:
             # Fallback en caso de que ninguna fila esté completa
             cXs = [b['cX'] for b in columna]
             min_x, max_x = min(cXs), max(cXs)
             sp = (max_x - min_x) / 3 if max_x > min_x else 1
-            centros_esperados = [min_x, min_x + sp, min_x + 2*sp, max_x]
+            centros_esperados = np.array([min_x, min_x + sp, min_x + 2*sp, max_x])
 
         for fila in filas:
             if len(fila) < 2:
                 continue
+            # Asignar a A, B, C, o D buscando el centro esperado más cercano
+            cXs = np.array([b['cX'] for b in fila])
+            opcion_de.extend(np.argmin(np.abs(cXs[:, None] - centros_esperados[None, :]), axis=1))
+            cajas.extend((b['x'], b['y'], b['w'], b['h']) for b in fila)
+            fila_de.extend([n_filas] * len(fila))
+            n_filas += 1
+
+    if not n_filas:
+        return []
 
-            opciones_detectadas = []
-            for b in fila:
-                # Asignar a A, B, C, o D buscando el centro esperado más cercano
-                distancias = [abs(b['cX'] - cx) for cx in centros_esperados]
-                idx_opcion = distancias.index(min(distancias))
-
-                # Evaluar llenado del óvalo
-                x, y, w, h = b['x'], b['y'], b['w'], b['h']
-                roi = imgThresh[y:y + h, x:x + w]
-                total = w * h
-                ratio = cv2.countNonZero(roi) / total if total > 0 else 0
-                opciones_detectadas.append((idx_opcion, ratio))
-
-            # Umbral dinámico: vacío ~23%, marcado >= 40% (ajustado para el escáner)
-            umbral_marcado = 0.40
-            marcados = [idx for idx, ratio in opciones_detectadas if ratio >= umbral_marcado]
-
-            letras = ['A', 'B', 'C', 'D']
-            if len(marcados) == 0:
-                respuestas.append('Z')
-            elif len(marcados) > 1:
-                respuestas.append('Z')
-            else:
-                idx = marcados[0]
-                respuestas.append(letras[idx] if idx < len(letras) else '?')
-
-    return respuestas
+    # Evaluar llenado de todos los óvalos en una sola operación
+    razones = razones_relleno(imgThresh, np.array(cajas))
+    # Burbujas marcadas por (fila, opción). np.add.at acumula las repetidas
+    # (dos contornos asignados a la misma opción): la asignación con índices
+    # repetidos se queda solo con la última.
+    marcados = np.zeros((n_filas, 4), dtype=int)
+    np.add.at(marcados, (fila_de, opcion_de), razones >= UMBRAL_OVALO_MARCADO)
+
+    # Vale la fila solo si hay exactamente una burbuja marcada
+    letras = np.array(['A', 'B', 'C', 'D'])
+    unica = marcados.sum(axis=1) == 1
+    return np.where(unica, letras[np.argmax(marcados, axis=1)], 'Z').tolist()
 
 
 def stackImages(imgArray, scale, lables=[]):
@@ -1,3 +1,3 @@
-from .calificar import GrupoCalificarSimulacroView, RevisarSimulacroView
-from .resultados import ResultadosSimulacroListView
-from .pdf import DescargarResultadosPDFView, DescargarInformeDirectivoPDFView, DescargarResultadosRealesPDFView, DescargarResultadoIndividualPDFView
+from .calificar import GrupoCalificarSimulacroView, RevisarSimulacroView, RecorteTiraView
+from .resultados import ResultadosSimulacroListView, AnaliticaItemsView, CopiasSimulacroView
+from .pdf import DescargarResultadosPDFView, DescargarInformeDirectivoPDFView, DescargarResultadosRealesPDFView, DescargarResultadoIndividualPDFView, DescargarHojasRespuestaPDFView
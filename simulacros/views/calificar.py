@@ -1,18 +1,25 @@
 # views/calificar.py
 
-import os
-import tempfile
-
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.http import FileResponse, Http404
 from django.shortcuts import render, get_object_or_404, redirect
 from django.views import View
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 
 from academico.models import Grupo, Alumno
-from ..models import Simulacro, ResultadoSimulacro
-from ..procesar_simulacro import extraer_tiras_individuales, LONGITUDES_ESPERADAS
-from ..calculos import calificar, calcular_puntaje_icfes, modificar_puntajes
+from ..models import Simulacro, LoteOMR, TareaOMR
+from ..procesar_simulacro import LETRAS_OPCIONES, LONGITUDES_ESPERADAS
+from ..recortes_omr import tipo_contenido
+from ..cola_omr import encolar_lote
+from ..escaneos import hojas_de_archivos
+from ..calificacion import calificar_lote
 
 
 class GrupoCalificarSimulacroView(LoginRequiredMixin, View):
@@ -20,11 +27,18 @@ class GrupoCalificarSimulacroView(LoginRequiredMixin, View):
         grupo = get_object_or_404(Grupo, id=grupo_id)
         alumnos = Alumno.objects.filter(grupo_actual=grupo).order_by('primer_apellido', 'segundo_apellido')
         simulacros = Simulacro.objects.all()
+        lotes = (
+            LoteOMR.objects.filter(grupo=grupo)
+            .exclude(estado=LoteOMR.ESTADO_CALIFICADO)
+            .select_related('simulacro')
+        )
 
         context = {
             'grupo': grupo,
             'alumnos': alumnos,
             'simulacros': simulacros,
+            'lotes': lotes,
+            'sesion_automatica': settings.OMR_SESION_AUTOMATICA,
         }
         return render(request, 'simulacros/calificar_grupo.html', context)
 
@@ -35,174 +49,308 @@ class GrupoCalificarSimulacroView(LoginRequiredMixin, View):
         fecha_realizacion = request.POST.get('fecha_realizacion')
         alumnos_ids       = request.POST.getlist('alumnos_seleccionados')
         archivos          = request.FILES.getlist('imagenes')
+        # Hojas personalizadas: el OMR lee alumno y sesión del QR de cada hoja
+        por_qr            = request.POST.get('identificar_qr') == '1'
+        # Cada alumno recibe dos hojas seguidas; el OMR decide cuál es S1 y cuál S2
+        detectar_sesion   = settings.OMR_SESION_AUTOMATICA and request.POST.get('detectar_sesion') == '1'
 
-        if not simulacro_id or not fecha_realizacion or not alumnos_ids or not archivos:
+        if not simulacro_id or not fecha_realizacion or not archivos or not (alumnos_ids or por_qr):
             messages.error(request, "Faltan datos requeridos para procesar.")
             return redirect('simulacros:grupo_calificar_simulacro', grupo_id=grupo.id)
 
         simulacro = get_object_or_404(Simulacro, id=simulacro_id)
 
-        if len(archivos) != len(alumnos_ids) * 2:
-            messages.error(request, f"La cantidad de imágenes ({len(archivos)}) no coincide con el doble de alumnos ({len(alumnos_ids) * 2}).")
+        # Cada archivo aporta una hoja, o varias si es el PDF/TIFF multipágina del escáner
+        try:
+            hojas = hojas_de_archivos(sorted(archivos, key=lambda x: x.name))
+        except ValueError as e:
+            messages.error(request, str(e))
             return redirect('simulacros:grupo_calificar_simulacro', grupo_id=grupo.id)
 
-        archivos_ordenados = sorted(archivos, key=lambda x: x.name)
-        alumnos_map = {str(a.id): a for a in Alumno.objects.filter(id__in=alumnos_ids)}
-        alumnos_seleccionados = [alumnos_map[aid] for aid in alumnos_ids if aid in alumnos_map]
+        if por_qr:
+            asignaciones = [(None, '')] * len(hojas)
+            alumnos_seleccionados = []
+        elif len(hojas) != len(alumnos_ids) * 2:
+            messages.error(request, f"La cantidad de hojas ({len(hojas)}) no coincide con el doble de alumnos ({len(alumnos_ids) * 2}).")
+            return redirect('simulacros:grupo_calificar_simulacro', grupo_id=grupo.id)
+        else:
+            alumnos_map = {str(a.id): a for a in Alumno.objects.filter(id__in=alumnos_ids)}
+            alumnos_seleccionados = [alumnos_map[aid] for aid in alumnos_ids if aid in alumnos_map]
+            # Dos hojas por alumno, en el orden de la lista: S1 y S2, o sin
+            # sesión si el OMR debe detectarla por el formato de la hoja
+            sesiones = ('', '') if detectar_sesion else ('S1', 'S2')
+            asignaciones = [(alumno, sesion) for alumno in alumnos_seleccionados for sesion in sesiones]
 
-        batch = {
-            'simulacro_id': simulacro_id,
-            'grupo_id':     grupo_id,
-            'fecha':        fecha_realizacion,
-            'alumnos':      [],
+        # Solo se guardan las hojas y se encolan: el OMR corre en el worker
+        # (python manage.py procesar_omr), así la petición responde de inmediato.
+        lote = encolar_lote(simulacro, hojas, asignaciones, fecha_realizacion, grupo=grupo,
+                            alumnos=alumnos_seleccionados, registrador=request.user)
+
+        messages.success(request, f"Se encolaron {len(hojas)} hojas para lectura OMR.")
+        return redirect('simulacros:revisar_simulacro', lote_id=lote.id)
+
+
+def _armar_batch(lote):
+    """
+    Reconstruye, a partir de las tareas del lote, la estructura por alumno que
+    usa la plantilla de revisión: [{'id', 'nombre', 's1', 's2', 'error'}, ...].
+    Cada tira con recorte guardado lleva en 'imagen' la URL para verlo.
+    Las hojas que el QR no logró asignar quedan fuera (ver _hojas_sin_identificar).
+    """
+    por_alumno = {}
+    for tarea in lote.tareas.filter(alumno__isnull=False).select_related('alumno'):
+        datos = por_alumno.setdefault(tarea.alumno_id, {
+            'id':     tarea.alumno_id,
+            'nombre': f"{tarea.alumno.primer_apellido} {tarea.alumno.segundo_apellido} {tarea.alumno.nombres}".strip(),
+            's1':     [],
+            's2':     [],
+            'error':  None,
+        })
+        if tarea.sesion:
+            for tira in tarea.tiras:
+                if tira['etiqueta'] in tarea.recortes:
+                    tira['imagen'] = reverse('simulacros:recorte_tira', args=[tarea.id, tira['etiqueta']])
+            datos[tarea.sesion.lower()] = tarea.tiras
+        if tarea.error:
+            err_prev = datos['error'] or ''
+            datos['error'] = (err_prev + ' | ' if err_prev else '') + f"{tarea.sesion}: {tarea.error}"
+
+    # Respetar el orden en que se seleccionaron los alumnos; los identificados
+    # por QR (sin orden de selección) van por apellido
+    orden = {alumno_id: i for i, alumno_id in enumerate(lote.alumnos)}
+    return sorted(por_alumno.values(), key=lambda a: (orden.get(a['id'], len(orden)), a['nombre']))
+
+
+def _nombre_hoja(tarea):
+    return tarea.nombre_original + (f" (página {tarea.pagina + 1})" if tarea.pagina is not None else '')
+
+
+def _hojas_sin_identificar(lote):
+    """Hojas subidas para identificar por QR que no se pudieron asignar a un alumno."""
+    return [
+        {
+            'nombre': _nombre_hoja(tarea),
+            'error':  tarea.error,
         }
+        for tarea in lote.tareas.filter(alumno__isnull=True)
+    ]
+
 
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            for idx, alumno in enumerate(alumnos_seleccionados):
-                file_s1 = archivos_ordenados[idx * 2]
-                file_s2 = archivos_ordenados[idx * 2 + 1]
-
-                path_s1 = os.path.join(tmpdirname, file_s1.name)
-                path_s2 = os.path.join(tmpdirname, file_s2.name)
-
-                with open(path_s1, 'wb+') as dest:
-                    for chunk in file_s1.chunks():
-                        dest.write(chunk)
-                with open(path_s2, 'wb+') as dest:
-                    for chunk in file_s2.chunks():
-                        dest.write(chunk)
-
-                resultado = extraer_tiras_individuales(path_s1, path_s2, user=request.user)
-
-                batch['alumnos'].append({
-                    'id':     alumno.id,
-                    'nombre': f"{alumno.primer_apellido} {alumno.segundo_apellido} {alumno.nombres}".strip(),
-                    's1':     resultado['s1'],
-                    's2':     resultado['s2'],
-                    'error':  resultado.get('error'),
+def _hojas_con_problemas_de_calidad(lote):
+    """
+    Hojas de alumnos que el control de calidad del OMR rechazó (no se leyeron:
+    hay que volver a escanearlas) o marcó (se leyeron, pero conviene revisar
+    sus tiras; ver RECHAZAR_ILEGIBLES). Las sin identificar van en
+    _hojas_sin_identificar.
+    """
+    hojas = []
+    for tarea in lote.tareas.filter(alumno__isnull=False).select_related('alumno'):
+        calidad = tarea.metricas.get('calidad') or {}
+        if not (calidad.get('motivos') or calidad.get('avisos')):
+            continue
+        hojas.append({
+            'alumno':    f"{tarea.alumno.primer_apellido} {tarea.alumno.segundo_apellido} {tarea.alumno.nombres}".strip(),
+            'sesion':    tarea.sesion,
+            'nombre':    _nombre_hoja(tarea),
+            'rechazada': bool(calidad.get('motivos')) and tarea.estado == TareaOMR.ESTADO_ERROR,
+            'motivos':   (calidad.get('motivos') or []) + (calidad.get('avisos') or []),
+        })
+    return hojas
+
+
+def _preguntas_dudosas(alumno_id, sesion, tiras):
+    """
+    Preguntas que el OMR leyó con poco margen (tira['dudosas']) en las tiras
+    de una sesión con la longitud correcta, listas para la plantilla: número
+    de pregunta en la sesión, letra leída, opciones, relleno de cada opción
+    en % y el recorte de sus burbujas. Las tiras con otra longitud se
+    corrigen completas y no entran aquí.
+    """
+    preguntas = []
+    inicio = 0
+    for tira in tiras:
+        if tira['ok']:
+            for dudosa in tira.get('dudosas', []):
+                fila = dudosa['fila']
+                razones = tira['razones'][fila]
+                preguntas.append({
+                    'campo':    f"{sesion}_{alumno_id}_{tira['etiqueta']}_{fila}",
+                    'sesion':   sesion.upper(),
+                    'etiqueta': tira['etiqueta'],
+                    'numero':   inicio + fila + 1,
+                    'leida':    tira['secuencia'][fila],
+                    'opciones': LETRAS_OPCIONES[len(razones)] + ['Z'],
+                    'rellenos': [(letra, round(r * 100)) for letra, r in zip(LETRAS_OPCIONES[len(razones)], razones)],
+                    'recorte':  dudosa['recorte'],
                 })
+        inicio += tira['esperado']
+    return preguntas
+
 
-        request.session['simulacro_batch'] = batch
-        return redirect('simulacros:revisar_simulacro')
+def _secuencia_corregida(post, sesion, alumno_id, tira):
+    """
+    Secuencia de la tira tras la revisión: la tira completa si se corrigió a
+    mano (tiras con otra longitud) o la leída, con lo que se haya cambiado en
+    la tira completa de "ver todas" (si conserva la longitud) y en las
+    preguntas dudosas.
+    """
+    completa = post.get(f"{sesion}_{alumno_id}_{tira['etiqueta']}")
+    if completa is not None:
+        return completa
+    secuencia = list(tira['secuencia'])
+    if tira['ok']:
+        revisada = post.get(f"{sesion}_{alumno_id}_{tira['etiqueta']}_todas", '').strip().upper()
+        if len(revisada) == len(secuencia):
+            secuencia = list(revisada)
+        for dudosa in tira.get('dudosas', []):
+            fila = dudosa['fila']
+            letra = post.get(f"{sesion}_{alumno_id}_{tira['etiqueta']}_{fila}", '')
+            # La lista de la pregunta manda solo si se cambió la letra leída
+            if letra != tira['secuencia'][fila] and (letra in LETRAS_OPCIONES[len(tira['razones'][fila])] or letra == 'Z'):
+                secuencia[fila] = letra
+    return ''.join(secuencia)
 
 
 class RevisarSimulacroView(LoginRequiredMixin, View):
     """
     Página intermedia de revisión/corrección de secuencias OMR antes de calificar.
+    Con ?todas=0 solo muestra lo que necesita una persona: las preguntas
+    dudosas (con el recorte de sus burbujas), las tiras con una longitud
+    distinta a la esperada y las hojas con error; el resto se califica tal
+    como se leyó. "Ver todas" (?todas=1, por defecto OMR_REVISAR_TODAS)
+    muestra además a todos los alumnos con cada tira completa editable, para
+    las lecturas erradas que MARGEN_DUDA no marcó.
     """
 
-    def get(self, request):
-        batch = request.session.get('simulacro_batch')
-        if not batch:
-            messages.error(request, "No hay datos de simulacro pendientes de revisión.")
+    def get(self, request, lote_id):
+        lote = get_object_or_404(LoteOMR.objects.select_related('simulacro'), id=lote_id)
+        if lote.estado == LoteOMR.ESTADO_CALIFICADO:
+            messages.error(request, "Este lote ya fue calificado.")
             return redirect('simulacros:resultados_simulacros')
 
-        simulacro = get_object_or_404(Simulacro, id=batch['simulacro_id'])
+        simulacro = lote.simulacro
+
+        if lote.estado == LoteOMR.ESTADO_PROCESANDO:
+            terminadas, total = lote.progreso()
+            context = {
+                'lote':       lote,
+                'simulacro':  simulacro,
+                'terminadas': terminadas,
+                'total':      total,
+            }
+            return render(request, 'simulacros/lote_procesando.html', context)
+
+        alumnos = _armar_batch(lote)
+        sin_identificar = _hojas_sin_identificar(lote)
+        ver_todas = request.GET.get('todas', '1' if settings.OMR_REVISAR_TODAS else '0') == '1'
 
         total_errores = 0
-        for alumno in batch['alumnos']:
-            for tira in alumno['s1'] + alumno['s2']:
-                if not tira['ok']:
-                    total_errores += 1
+        total_dudosas = 0
+        por_revisar = []
+        for alumno in alumnos:
+            alumno['dudosas'] = (_preguntas_dudosas(alumno['id'], 's1', alumno['s1'])
+                                 + _preguntas_dudosas(alumno['id'], 's2', alumno['s2']))
+            # [(sesión, tiras con otra longitud), ...], solo las sesiones que tienen alguna
+            alumno['tiras_error'] = [
+                (sesion, errores) for sesion in ('s1', 's2')
+                if (errores := [tira for tira in alumno[sesion] if not tira['ok']])
+            ]
+            total_errores += sum(len(errores) for _sesion, errores in alumno['tiras_error'])
             if alumno.get('error'):
                 total_errores += 1
+            alumno['con_imagenes'] = any('imagen' in tira for tira in alumno['s1'] + alumno['s2'])
+            total_dudosas += len(alumno['dudosas'])
+            if ver_todas:
+                # [(sesión, tiras leídas con la longitud correcta), ...]
+                alumno['tiras_ok'] = [
+                    (sesion, tiras) for sesion in ('s1', 's2')
+                    if (tiras := [tira for tira in alumno[sesion] if tira['ok']])
+                ]
+            if ver_todas or alumno['dudosas'] or alumno['tiras_error'] or alumno['error']:
+                por_revisar.append(alumno)
+        total_errores += len(sin_identificar)
+
+        batch = {
+            'fecha':   lote.fecha_realizacion,
+            'alumnos': por_revisar,
+        }
 
         context = {
+            'lote':          lote,
             'batch':         batch,
+            'sin_identificar': sin_identificar,
+            'calidad':       _hojas_con_problemas_de_calidad(lote),
             'simulacro':     simulacro,
             'total_errores': total_errores,
+            'total_dudosas': total_dudosas,
+            'sin_revision':  len(alumnos) - len(por_revisar),
+            'ver_todas':     ver_todas,
             'longitudes':    LONGITUDES_ESPERADAS,
         }
         return render(request, 'simulacros/revisar_simulacro.html', context)
 
-    def post(self, request):
-        batch = request.session.get('simulacro_batch')
-        if not batch:
-            messages.error(request, "Sesión expirada. Por favor vuelve a subir las imágenes.")
+    def post(self, request, lote_id):
+        lote = get_object_or_404(LoteOMR.objects.select_related('simulacro'), id=lote_id)
+        if lote.estado != LoteOMR.ESTADO_REVISION:
+            messages.error(request, "Este lote no está pendiente de revisión.")
             return redirect('simulacros:resultados_simulacros')
 
-        simulacro = get_object_or_404(Simulacro, id=batch['simulacro_id'])
-        fecha_realizacion = batch['fecha']
-
-        componentes_s1 = simulacro.get_componentes_s1()
-        componentes_s2 = simulacro.get_componentes_s2()
-
-        c_s1 = simulacro.puntos_corte_s1
-        cortes_s1 = c_s1 if isinstance(c_s1, list) else c_s1.get('cortes', [])
-        c_s2 = simulacro.puntos_corte_s2
-        cortes_s2 = c_s2 if isinstance(c_s2, list) else c_s2.get('cortes', [])
+        simulacro = lote.simulacro
+        fecha_realizacion = lote.fecha_realizacion.isoformat()
 
-        errores_calificacion = []
-
-        for alumno_data in batch['alumnos']:
+        # Las secuencias corregidas de todo el lote se arman en memoria (los
+        # alumnos llegan en la misma consulta de las tareas) y se califican y
+        # guardan de una vez: unas pocas consultas sin importar el tamaño del lote.
+        respuestas, nombres = {}, {}
+        for alumno_data in _armar_batch(lote):
             alumno_id = alumno_data['id']
-            alumno    = get_object_or_404(Alumno, id=alumno_id)
-
-            # Leer secuencias corregidas desde el formulario
-            s1_tiras = [
-                request.POST.get(f"s1_{alumno_id}_{tira['etiqueta']}", tira['secuencia'])
-                for tira in alumno_data['s1']
-            ]
-            s2_tiras = [
-                request.POST.get(f"s2_{alumno_id}_{tira['etiqueta']}", tira['secuencia'])
-                for tira in alumno_data['s2']
-            ]
-
-            resp_s1 = ''.join(s1_tiras)
-            resp_s2 = ''.join(s2_tiras)
-
-            try:
-                comp_s1 = calificar(resp_s1, simulacro.soluciones_s1, cortes_s1, componentes_s1)
-                comp_s2 = calificar(resp_s2, simulacro.soluciones_s2, cortes_s2, componentes_s2)
-
-                consolidados = {}
-                for comp in set(componentes_s1 + componentes_s2):
-                    consolidados[comp] = {'buenas': 0, 'totales': 0}
-                    if comp in comp_s1:
-                        consolidados[comp]['buenas']  += comp_s1[comp]['buenas']
-                        consolidados[comp]['totales'] += comp_s1[comp]['totales']
-                    if comp in comp_s2:
-                        consolidados[comp]['buenas']  += comp_s2[comp]['buenas']
-                        consolidados[comp]['totales'] += comp_s2[comp]['totales']
-
-                puntajes          = calcular_puntaje_icfes(consolidados)
-                # SE PASA EL SIMULACRO COMPLETO PARA SOPORTAR LOS PARÁMETROS CONFIGURABLES DESDE EL ADMIN
-                puntajes_modificados = modificar_puntajes(puntajes, simulacro)
-
-                ResultadoSimulacro.objects.update_or_create(
-                    alumno=alumno,
-                    simulacro=simulacro,
-                    defaults={
-                        'respuestas_s1': resp_s1,
-                        'respuestas_s2': resp_s2,
-                        'puntaje_global':      puntajes['global'],
-                        'puntaje_matematicas': puntajes.get('matematicas', 0),
-                        'puntaje_lectura':     puntajes.get('lectura', 0),
-                        'puntaje_sociales':    puntajes.get('sociales', 0),
-                        'puntaje_naturales':   puntajes.get('naturales', 0),
-                        'puntaje_ingles':      puntajes.get('ingles', 0),
-                        'puntaje_global_modificado':      puntajes_modificados['global'],
-                        'puntaje_matematicas_modificado': puntajes_modificados.get('matematicas', 0),
-                        'puntaje_lectura_modificado':     puntajes_modificados.get('lectura', 0),
-                        'puntaje_sociales_modificado':    puntajes_modificados.get('sociales', 0),
-                        'puntaje_naturales_modificado':   puntajes_modificados.get('naturales', 0),
-                        'puntaje_ingles_modificado':      puntajes_modificados.get('ingles', 0),
-                        'fecha_realizacion': fecha_realizacion,
-                        'registrador':       request.user,
-                    }
-                )
-            except Exception as e:
-                errores_calificacion.append(f"{alumno}: {e}")
-
-        del request.session['simulacro_batch']
+            nombres[alumno_id] = alumno_data['nombre']
+            respuestas[alumno_id] = tuple(
+                ''.join(_secuencia_corregida(request.POST, sesion, alumno_id, tira) for tira in alumno_data[sesion])
+                for sesion in ('s1', 's2')
+            )
+
+        with transaction.atomic():
+            _resultados, errores = calificar_lote(simulacro, respuestas, lote.fecha_realizacion, request.user)
+            lote.estado = LoteOMR.ESTADO_CALIFICADO
+            lote.fecha_calificacion = timezone.now()
+            lote.save(update_fields=['estado', 'fecha_calificacion'])
+        errores_calificacion = [f"{nombres[alumno_id]}: {error}" for alumno_id, error in errores.items()]
 
         for err in errores_calificacion:
             messages.error(request, f"Error calificando: {err}")
 
         messages.success(request, "Simulacros calificados exitosamente.")
-        grupo_id = batch['grupo_id']
         return redirect(
             f"{reverse('simulacros:resultados_simulacros')}"
-            f"?grupo={grupo_id}&simulacro={batch['simulacro_id']}"
+            f"?grupo={lote.grupo_id or ''}&simulacro={simulacro.id}"
             f"&fecha_inicio={fecha_realizacion}&fecha_fin={fecha_realizacion}"
         )
+
+
+class RecorteTiraView(LoginRequiredMixin, View):
+    """
+    Imagen de una tira guardada por recortes_omr, para la página de revisión.
+    Se pide solo cuando se muestra (loading="lazy") y el navegador la guarda:
+    el recorte de una tarea no cambia salvo que se vuelva a procesar, y en
+    ese caso cambia su nombre y con él el ETag.
+    """
+    MAX_AGE = 7 * 24 * 3600
+
+    def get(self, request, tarea_id, etiqueta):
+        tarea = get_object_or_404(TareaOMR.objects.only('id', 'recortes'), id=tarea_id)
+        nombre = tarea.recortes.get(etiqueta)
+        if not nombre:
+            raise Http404("La tira no tiene recorte guardado.")
+
+        etag = quote_etag(nombre)
+        respuesta = get_conditional_response(request, etag=etag)
+        if respuesta is None:
+            try:
+                archivo = default_storage.open(nombre, 'rb')
+            except OSError:
+                raise Http404("El recorte ya no existe.")
+            respuesta = FileResponse(archivo, content_type=tipo_contenido(nombre))
+        respuesta['ETag'] = etag
+        patch_cache_control(respuesta, private=True, max_age=self.MAX_AGE)
+        return respuesta
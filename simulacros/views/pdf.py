@@ -18,7 +18,11 @@ from academico.models import Grupo, Alumno
 from ubicaciones.models import Sede
 from ..models import Simulacro, ResultadoSimulacro
 from ..procesar_simulacro import procesar_imagen
-from ..calculos import calificar, calcular_puntaje_icfes
+from ..calculos import calificar, calcular_puntaje_icfes, componente_por_pregunta
+from ..calificacion import cortes_sesion
+from ..analitica import DISCRIMINACION_MINIMA, analizar
+from ..estadisticas_items import resumen, resumen_de_resultados
+from ..hojas_respuesta import generar_hojas_pdf
 
 # ReportLab imports
 from reportlab.lib.pagesizes import A4, landscape, LETTER
@@ -29,7 +33,6 @@ from reportlab.graphics.shapes import Drawing
 from reportlab.graphics.charts.barcharts import VerticalBarChart
 from reportlab.graphics.charts.piecharts import Pie
 from reportlab.graphics.charts.legends import Legend
-from collections import Counter
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.lib.units import inch
@@ -501,6 +504,35 @@ class DescargarResultadoIndividualPDFView(LoginRequiredMixin, View):
         doc.build(elements)
         return response
 
+class DescargarHojasRespuestaPDFView(LoginRequiredMixin, View):
+    """
+    Hojas de respuesta en blanco con nombre y QR de cada alumno del grupo
+    (o solo de los `?alumnos=` indicados), para calificar sin importar el orden.
+    """
+
+    def get(self, request, grupo_id):
+        grupo = get_object_or_404(Grupo, id=grupo_id)
+        alumnos = Alumno.objects.filter(grupo_actual=grupo).order_by('primer_apellido', 'segundo_apellido', 'nombres')
+        ids = [i for i in request.GET.getlist('alumnos') if i.isdigit()]
+        if ids:
+            alumnos = alumnos.filter(id__in=ids)
+        if not alumnos.exists():
+            messages.warning(request, "No hay alumnos para generar hojas de respuesta.")
+            return redirect('simulacros:grupo_calificar_simulacro', grupo_id=grupo.id)
+
+        simulacro = Simulacro.objects.filter(id=request.GET.get('simulacro') or None).first()
+        titulo = simulacro.nombre if simulacro else ''
+
+        response = HttpResponse(content_type='application/pdf')
+        response['Content-Disposition'] = f'inline; filename="Hojas_respuesta_{grupo.codigo}.pdf"'
+        generar_hojas_pdf(response, alumnos, titulo)
+        return response
+
+
+def _formato_kr20(valor):
+    return '-' if valor is None else f"{valor:.2f}"
+
+
 class DescargarInformeDirectivoPDFView(LoginRequiredMixin, PermisosResultadosMixin, View):
     def get(self, request):
         qs = ResultadoSimulacro.objects.all().select_related('alumno', 'simulacro', 'alumno__grupo_actual').order_by('-puntaje_global_modificado')
@@ -564,43 +596,32 @@ class DescargarInformeDirectivoPDFView(LoginRequiredMixin, PermisosResultadosMix
             clasificar_area(r.puntaje_naturales_modificado, niv_nat)
             clasificar_area(r.puntaje_ingles_modificado, niv_ing)
 
-        # Análisis de Ítems Críticos
-        errores_s1 = Counter()
-        errores_s2 = Counter()
-        sol_s1 = simulacro.soluciones_s1
-        sol_s2 = simulacro.soluciones_s2
-        
-        for r in qs:
-            if r.respuestas_s1 and sol_s1:
-                for idx, (resp, sol) in enumerate(zip(r.respuestas_s1, sol_s1)):
-                    if resp != sol: errores_s1[idx+1] += 1
-            if r.respuestas_s2 and sol_s2:
-                for idx, (resp, sol) in enumerate(zip(r.respuestas_s2, sol_s2)):
-                    if resp != sol: errores_s2[idx+1] += 1
-
-        def get_componente_from_item(item_idx, cortes, componentes):
-            c_idx = 0
-            for c in cortes:
-                if item_idx <= c: return componentes[c_idx]
-                c_idx += 1
-            return componentes[-1] if componentes else "N/A"
-
-        cortes_s1 = simulacro.puntos_corte_s1 if isinstance(simulacro.puntos_corte_s1, list) else simulacro.puntos_corte_s1.get('cortes', [])
-        cortes_s2 = simulacro.puntos_corte_s2 if isinstance(simulacro.puntos_corte_s2, list) else simulacro.puntos_corte_s2.get('cortes', [])
-        comp_s1 = simulacro.get_componentes_s1()
-        comp_s2 = simulacro.get_componentes_s2()
+        # Análisis de Ítems Críticos: sale de las estadísticas por pregunta
+        # guardadas al calificar; con rango de fechas se cuenta sobre qs.
+        # Errores = intentos - correctas: blancos y respuestas inválidas cuentan
+        # como error, pero las secuencias de otra longitud que la clave no
+        # entran (tampoco se califican), a diferencia del conteo por resultado.
+        if fecha_inicio or fecha_fin:
+            items = resumen_de_resultados(simulacro, qs.filter(simulacro=simulacro))
+        else:
+            items = resumen(simulacro, sede_id=sede_id, grupo_id=grupo_id)
+        componentes = {
+            'S1': componente_por_pregunta(len(simulacro.soluciones_s1 or ''), cortes_sesion(simulacro.puntos_corte_s1),
+                                          list(simulacro.get_componentes_s1())),
+            'S2': componente_por_pregunta(len(simulacro.soluciones_s2 or ''), cortes_sesion(simulacro.puntos_corte_s2),
+                                          list(simulacro.get_componentes_s2())),
+        }
 
         top_errores = []
-        for item, count in errores_s1.most_common(50):
+        for (sesion, item), estadistica in items.items():
+            count = estadistica['intentos'] - estadistica['correctas']
+            if not count:
+                continue
             pct = (count / total_alumnos) * 100
-            comp = get_componente_from_item(item, cortes_s1, comp_s1).upper()
-            top_errores.append(['S1', item, comp, pct, count])
-            
-        for item, count in errores_s2.most_common(50):
-            pct = (count / total_alumnos) * 100
-            comp = get_componente_from_item(item, cortes_s2, comp_s2).upper()
-            top_errores.append(['S2', item, comp, pct, count])
-            
+            por_pregunta = componentes[sesion]
+            comp = por_pregunta[item - 1].upper() if 0 < item <= len(por_pregunta) else "N/A"
+            top_errores.append([sesion, item, comp, pct, count])
+
         top_errores.sort(key=lambda x: x[3], reverse=True)
         top_errores = top_errores[:50] # Top 50 de ambos cuadernillos combinados
 
@@ -796,11 +817,64 @@ class DescargarInformeDirectivoPDFView(LoginRequiredMixin, PermisosResultadosMix
             ('TOPPADDING', (0,0), (-1,-1), 4),
         ]))
         elements.append(t_err)
+
+        # 4. Calidad de las preguntas (todos los resultados del simulacro)
+        analisis = analizar(simulacro)
+        elements.append(Paragraph('4. Calidad de las Preguntas', h2))
+        elements.append(Paragraph(
+            'Calculado sobre todos los estudiantes del simulacro con la sesión completa, sin los filtros del informe. '
+            'Dificultad (p): proporción que acierta. Discriminación: correlación punto-biserial con el resto de la '
+            f'sesión (se espera al menos {DISCRIMINACION_MINIMA:.2f}). KR-20: confiabilidad (se espera al menos 0.70).',
+            p_style))
+        conf_data = [['Sesión', 'Componente', 'Preguntas', 'KR-20']]
+        for sesion in ('S1', 'S2'):
+            conf_data.append([sesion, 'SESIÓN COMPLETA', str(len(analisis[sesion]['items'])),
+                              _formato_kr20(analisis[sesion]['kr20'])])
+            for comp, datos in analisis[sesion]['componentes'].items():
+                conf_data.append([sesion, comp.upper(), str(datos['items']), _formato_kr20(datos['kr20'])])
+        t_conf = Table(conf_data, colWidths=[50, 200, 70, 70], repeatRows=1)
+        t_conf.setStyle(TableStyle([
+            ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#1C3A5F')),
+            ('TEXTCOLOR', (0,0), (-1,0), colors.white),
+            ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+            ('ALIGN', (1,1), (1,-1), 'LEFT'),
+            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0,0), (-1,-1), 8),
+            ('GRID', (0,0), (-1,-1), 0.5, colors.HexColor('#BDC3C7')),
+            ('ROWBACKGROUNDS', (0,1), (-1,-1), [colors.white, colors.HexColor('#F4F6F8')]),
+        ]))
+        elements.append(t_conf)
+        elements.append(Spacer(1, 12))
+
+        alerta_style = ParagraphStyle(name='Alerta', parent=styles['Normal'], fontSize=8)
+        revisar = sorted(
+            ((sesion, item) for sesion in ('S1', 'S2') for item in analisis[sesion]['items'] if item['alertas']),
+            key=lambda x: x[1]['discriminacion'],
+        )[:40]
+        rev_data = [['Ses.', 'Preg.', 'Componente', 'Clave', 'p', 'Discr.', 'Observación']]
+        for sesion, item in revisar:
+            rev_data.append([sesion, str(item['item']), item['componente'].upper(), item['clave'],
+                             f"{item['dificultad']:.2f}", f"{item['discriminacion']:.2f}",
+                             Paragraph('; '.join(item['alertas']), alerta_style)])
+        if len(rev_data) == 1:
+            rev_data.append(['-', '-', '-', '-', '-', '-', 'Ninguna pregunta requiere revisión'])
+        t_rev = Table(rev_data, colWidths=[30, 35, 85, 35, 40, 45, 240], repeatRows=1)
+        t_rev.setStyle(TableStyle([
+            ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#C0392B')),
+            ('TEXTCOLOR', (0,0), (-1,0), colors.white),
+            ('ALIGN', (0,0), (-2,-1), 'CENTER'),
+            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0,0), (-1,-1), 8),
+            ('GRID', (0,0), (-1,-1), 0.5, colors.HexColor('#BDC3C7')),
+            ('ROWBACKGROUNDS', (0,1), (-1,-1), [colors.white, colors.HexColor('#F4F6F8')]),
+        ]))
+        elements.append(t_rev)
         
         elements.append(PageBreak())
         
-        # 4. Escalafón
-        elements.append(Paragraph('4. Escalafón de Estudiantes', h2))
+        # 5. Escalafón
+        elements.append(Paragraph('5. Escalafón de Estudiantes', h2))
         
         top_mat = sorted(list(set(r.puntaje_matematicas_modificado for r in qs)), reverse=True)[:3]
         top_lec = sorted(list(set(r.puntaje_lectura_modificado for r in qs)), reverse=True)[:3]
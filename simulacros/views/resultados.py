@@ -1,5 +1,5 @@
 # views/resultados.py
-# Aquí van ResultadosSimulacroListView y PermisosResultadosMixin
+# Aquí van ResultadosSimulacroListView, AnaliticaItemsView, CopiasSimulacroView y PermisosResultadosMixin
 
 import os
 
@@ -17,6 +17,8 @@ from ubicaciones.models import Sede
 from ..models import Simulacro, ResultadoSimulacro
 from ..procesar_simulacro import procesar_imagen
 from ..calculos import calificar, calcular_puntaje_icfes
+from ..analitica import analizar
+from ..similitud import BLOQUES, MINIMO_COINCIDENCIAS, UMBRAL_Z, buscar_copias
 
 
 class PermisosResultadosMixin(UserPassesTestMixin):
@@ -58,4 +60,39 @@ class ResultadosSimulacroListView(LoginRequiredMixin, PermisosResultadosMixin, L
         context['sedes'] = Sede.objects.all()
         context['grupos'] = Grupo.objects.all()
         context['simulacros'] = Simulacro.objects.all()
-        return context
\ No newline at end of file
+        return context
+
+class AnaliticaItemsView(LoginRequiredMixin, PermisosResultadosMixin, View):
+    """Dificultad, discriminación, distractores y KR-20 de las preguntas de un simulacro."""
+
+    def get(self, request, simulacro_id):
+        simulacro = get_object_or_404(Simulacro, pk=simulacro_id)
+        analisis = analizar(simulacro)
+        sesiones = [(sesion, analisis[sesion]) for sesion in ('S1', 'S2')]
+        return render(request, 'simulacros/analitica_items.html', {
+            'simulacro': simulacro,
+            'sesiones': sesiones,
+            'solo_alertas': request.GET.get('alertas') == '1',
+        })
+
+
+class CopiasSimulacroView(LoginRequiredMixin, PermisosResultadosMixin, View):
+    """Parejas de alumnos con patrones de respuesta sospechosamente parecidos en un simulacro."""
+
+    def get(self, request, simulacro_id):
+        simulacro = get_object_or_404(Simulacro, pk=simulacro_id)
+        por = request.GET.get('por', 'salon')
+        if por not in BLOQUES:
+            por = 'salon'
+        parejas = buscar_copias(simulacro, por=por)
+        alumnos = Alumno.objects.select_related('grupo_actual').in_bulk(
+            {p['alumno_a'] for p in parejas} | {p['alumno_b'] for p in parejas})
+        for pareja in parejas:
+            pareja['alumno_a'], pareja['alumno_b'] = alumnos[pareja['alumno_a']], alumnos[pareja['alumno_b']]
+        return render(request, 'simulacros/copias.html', {
+            'simulacro': simulacro,
+            'parejas': parejas,
+            'por': por,
+            'umbral_z': UMBRAL_Z,
+            'minimo': MINIMO_COINCIDENCIAS,
+        })